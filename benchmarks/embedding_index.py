@@ -0,0 +1,116 @@
+"""
+Compare NumpyEmbeddingIndex with HnswEmbeddingIndex on build time, query
+latency and recall.
+
+The vectors are random points around --clusters centers, like embeddings of
+related texts. A stub embedding model returns them directly, so the benchmark
+only measures the indexes. Recall@k is the fraction of the exact top k that
+each index returns.
+
+Usage:
+    python benchmarks/embedding_index.py --vectors 10000 50000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+
+from horsona.index.embedding_model import EmbeddingModel
+from horsona.index.hnsw_index import HnswEmbeddingIndex
+from horsona.index.numpy_index import NumpyEmbeddingIndex
+
+
+class StubEmbeddingModel(EmbeddingModel):
+    def __init__(self, embeddings: dict[str, np.ndarray]) -> None:
+        super().__init__()
+        self.embeddings = embeddings
+
+    async def get_data_embeddings(self, sentences: list[str]) -> list[np.ndarray]:
+        return [self.embeddings[sentence] for sentence in sentences]
+
+    async def get_query_embeddings(self, sentences: list[str]) -> list[np.ndarray]:
+        return await self.get_data_embeddings(sentences)
+
+
+def clustered(rng, count: int, centers: np.ndarray) -> np.ndarray:
+    points = centers[rng.integers(len(centers), size=count)]
+    points += rng.standard_normal(points.shape).astype(np.float32) * 0.5
+    return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+
+async def measure(index, values, queries, truth, topk, batch) -> dict[str, float]:
+    start = time.perf_counter()
+    for i in range(0, len(values), 1000):
+        await index.extend(values[i : i + 1000])
+    build = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = await index.query(query, topk)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(result.values()) & expected)
+
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        await index.query_many_with_weights(queries[i : i + batch], topk)
+    batched = time.perf_counter() - start
+
+    return {
+        "build (s)": build,
+        "query latency (ms)": statistics.mean(latencies) * 1000,
+        "batched (ms/query)": batched / len(queries) * 1000,
+        f"recall@{topk}": hits / (len(queries) * topk),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vectors", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for count in args.vectors:
+        rng = np.random.default_rng(args.seed)
+        centers = rng.standard_normal((args.clusters, args.dim)).astype(np.float32)
+        data = clustered(rng, count, centers)
+        query_data = clustered(rng, args.queries, centers)
+
+        values = [f"value {i}" for i in range(count)]
+        queries = [f"query {i}" for i in range(args.queries)]
+        embeddings = dict(zip(values, data)) | dict(zip(queries, query_data))
+
+        # Exact top k by cosine similarity
+        similarities = query_data @ data.T
+        top = np.argsort(-similarities, axis=1)[:, : args.topk]
+        truth = [{values[i] for i in row} for row in top]
+
+        results = {}
+        for label, cls in [
+            ("numpy", NumpyEmbeddingIndex),
+            ("hnsw", HnswEmbeddingIndex),
+        ]:
+            index = cls(StubEmbeddingModel(embeddings))
+            results[label] = await measure(
+                index, values, queries, truth, args.topk, args.batch
+            )
+
+        print(f"\n{count} vectors, {args.dim} dimensions")
+        print(f"{'':<24}{'numpy':>12}{'hnsw':>12}")
+        for key in results["numpy"]:
+            print(
+                f"{key:<24}{results['numpy'][key]:>12.3f}{results['hnsw'][key]:>12.3f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
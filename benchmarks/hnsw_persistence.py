@@ -0,0 +1,122 @@
+"""
+Compare checkpointing an HnswEmbeddingIndex inside its state_dict with saving
+it to a persist_dir.
+
+The script builds an index of random vectors once. Each checkpoint and restore
+then runs in a fresh process, which reports its wall time and peak RSS:
+
+- state_dict: the hnswlib index goes through a temp file into the state_dict,
+  which is deflated into a ZIP. Restoring reverses that.
+- persist_dir: the hnswlib index is written uncompressed next to its metadata,
+  and the ZIP only holds a reference to the directory.
+
+Both checkpoints start with the index already in memory, so their peak RSS
+includes it.
+
+Usage:
+    python benchmarks/hnsw_persistence.py --vectors 1000000
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import hnswlib
+import numpy as np
+
+from horsona.autodiff.basic import load_state_dict, state_dict, unzip, zip
+from horsona.index.hnsw_index import HnswEmbeddingIndex
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def open_index(scratch: str, vectors: int, dim: int) -> HnswEmbeddingIndex:
+    embeddings = hnswlib.Index(space="cosine", dim=dim)
+    embeddings.load_index(
+        os.path.join(scratch, "built.bin"), allow_replace_deleted=True
+    )
+    return HnswEmbeddingIndex(
+        None,
+        index_size=vectors,
+        index_to_value={i: f"value {i}" for i in range(vectors)},
+        value_to_index={f"value {i}": i for i in range(vectors)},
+        embeddings=embeddings,
+        dim=dim,
+    )
+
+
+def run_phase(phase: str, scratch: str, vectors: int, dim: int, results) -> None:
+    checkpoint = os.path.join(scratch, "checkpoint.zip")
+    if phase.endswith("checkpoint"):
+        index = open_index(scratch, vectors, dim)
+        if phase.startswith("persist_dir"):
+            index.persist_dir = os.path.join(scratch, "persist_dir")
+        start = time.perf_counter()
+        zip(state_dict(index), checkpoint)
+    else:
+        start = time.perf_counter()
+        load_state_dict(unzip(checkpoint))
+    results.put((time.perf_counter() - start, peak_rss_mb()))
+
+
+def measure(phase: str, scratch: str, vectors: int, dim: int) -> tuple[float, float]:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=run_phase, args=(phase, scratch, vectors, dim, results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vectors", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        data = np.random.default_rng(args.seed).random(
+            (args.vectors, args.dim), dtype=np.float32
+        )
+        embeddings = hnswlib.Index(space="cosine", dim=args.dim)
+        embeddings.init_index(
+            max_elements=args.vectors,
+            ef_construction=200,
+            M=16,
+            allow_replace_deleted=True,
+        )
+        embeddings.add_items(data, np.arange(args.vectors))
+        embeddings.save_index(os.path.join(scratch, "built.bin"))
+        del data, embeddings
+        print(f"Built {args.vectors} vectors in {time.perf_counter() - start:.1f}s")
+
+        size = os.path.getsize(os.path.join(scratch, "built.bin")) / 2**20
+        print(f"hnswlib index size: {size:.0f} MB\n")
+
+        print(f"{'':<28}{'seconds':>10}{'peak RSS (MB)':>16}")
+        for label in ["state_dict", "persist_dir"]:
+            for action in ["checkpoint", "restore"]:
+                phase = f"{label} {action}"
+                seconds, rss = measure(phase, scratch, args.vectors, args.dim)
+                print(f"{phase:<28}{seconds:>10.2f}{rss:>16.0f}")
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measure how long common horsona entry points take to import.
+
+Each entry point is imported in a fresh interpreter with python -X importtime.
+The script reports the best wall time over --runs runs, minus the time to
+start an empty interpreter, and the packages that took longest to import.
+load_llms is measured with a config that only uses AsyncOpenAIEngine, so other
+providers' SDKs should not show up.
+
+Usage:
+    python benchmarks/import_time.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ENTRY_POINTS = {
+    "load_llms (OpenAI only)": "from horsona.config import load_llms; load_llms()",
+    "horsona.llm.chat_engine": "import horsona.llm.chat_engine",
+    "horsona.memory.wiki_module": "import horsona.memory.wiki_module",
+    "horsona.smarts.causal": "import horsona.smarts.causal.llm_estimator",
+    "horsona.interface.oai": "import horsona.interface.oai",
+}
+
+
+def run(code: str, cwd: str) -> tuple[float, str]:
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "x")}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def slowest_packages(importtime: str, count: int) -> list[tuple[str, int]]:
+    packages = []
+    started = False
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        module = module.strip()
+        # Skip what the interpreter imports at startup, before any horsona code
+        started = started or module.startswith("horsona")
+        if started and "." not in module and module != "horsona":
+            packages.append((module, int(cumulative)))
+    return sorted(packages, key=lambda item: -item[1])[:count]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        with open(os.path.join(cwd, "llm_config.json"), "w") as f:
+            json.dump([{"gpt": {"type": "AsyncOpenAIEngine", "model": "gpt-4o"}}], f)
+
+        baseline = min(run("pass", cwd)[0] for _ in range(args.runs))
+        for label, code in ENTRY_POINTS.items():
+            runs = [run(code, cwd) for _ in range(args.runs)]
+            wall, importtime = min(runs)
+            slowest = ", ".join(
+                f"{module} {cumulative / 1000:.0f}ms"
+                for module, cumulative in slowest_packages(importtime, args.top)
+            )
+            print(f"{label:<28}{(wall - baseline) * 1000:>8.0f}ms  {slowest}")
+
+
+if __name__ == "__main__":
+    main()
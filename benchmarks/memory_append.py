@@ -0,0 +1,178 @@
+"""
+Measure the cost of appending to ListModule and GistModule.
+
+Both modules check prompt lengths on every append to decide what stays in
+context. The previous implementations are embedded below as subclasses: they
+re-serialized the pending items (ListModule) or the growing page and gist
+context (GistModule) for each check, and summed every stored length on each
+eviction step. The current modules keep per-item lengths with running totals
+or prefix sums. GistModule uses a stub LLM, so only horsona's own work is
+timed. The legacy GistModule takes tens of milliseconds per append, so it
+only runs --legacy-items appends; times are reported per append.
+
+Usage:
+    python benchmarks/memory_append.py --items 100000
+"""
+
+import argparse
+import asyncio
+import time
+
+from horsona.autodiff.variables import ListValue, Value
+from horsona.llm.engine_utils import compile_user_prompt_length
+from horsona.memory.gist_module import GistModule
+from horsona.memory.list_module import ListModule
+
+
+class LegacyListModule(ListModule):
+    async def append(self, item):
+        if self.items and (
+            not self.item_lengths or len(self.item_lengths) != len(self.items)
+        ):
+            self.item_lengths = [
+                await compile_user_prompt_length(ITEM=item) for item in self.items
+            ]
+
+        self.pending_items.append(item)
+
+        pending_length = await compile_user_prompt_length(ITEM=self.pending_items)
+        result = None
+        if pending_length >= self.min_item_length:
+            if len(self.pending_items) == 1:
+                new_item = self.pending_items[0]
+            else:
+                new_item = ListValue("Item list", self.pending_items)
+            self.items.append(new_item)
+            self.item_lengths.append(pending_length)
+            self.pending_items = []
+            result = new_item
+
+        while self.items and (
+            sum(self.item_lengths) + pending_length > self.max_length
+        ):
+            self.items.pop(0)
+            self.item_lengths.pop(0)
+
+        return result
+
+
+class LegacyGistModule(GistModule):
+    async def append(self, page, **kwargs):
+        page_context = []
+        i = len(self.available_pages) - 1
+        while i > 0:
+            if (
+                await compile_user_prompt_length(ITEMS=page_context)
+                > self.max_page_chars
+            ):
+                if page_context:
+                    page_context.pop()
+                break
+            page_context.append(self.available_pages[i])
+            i -= 1
+
+        page_context.reverse()
+
+        gist_context = []
+        for j in range(i, 0, -1):
+            if (
+                await compile_user_prompt_length(ITEMS=gist_context)
+                > self.max_gist_chars
+            ):
+                if gist_context:
+                    gist_context.pop()
+                break
+            gist_context.append(self.available_gists[j])
+
+        gist_context.reverse()
+
+        page_summary = await self.llm.query_block(
+            "text",
+            PREVIOUS_GISTS=gist_context,
+            PREVIOUS_PAGES=page_context,
+            CURRENT_PAGE=page,
+        )
+
+        self.available_gists.append(page_summary)
+        self.available_pages.append(page)
+        self.page_lengths.append(await compile_user_prompt_length(ITEM=page))
+
+        return Value("Summary", page_summary, predecessors=[page])
+
+
+class StubLLM:
+    async def query_block(self, block_type: str, **kwargs) -> str:
+        return f"Summary of {kwargs['CURRENT_PAGE'][:40]}"
+
+
+async def time_appends(module, items: list) -> float:
+    start = time.perf_counter()
+    for item in items:
+        await module.append(item)
+    return time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument(
+        "--legacy-items",
+        type=int,
+        default=2000,
+        help="appends for the legacy modules, whose cost per append stops "
+        "growing once the context is full",
+    )
+    parser.add_argument("--item-chars", type=int, default=80)
+    parser.add_argument("--max-length", type=int, default=8192)
+    parser.add_argument("--min-item-length", type=int, default=512)
+    parser.add_argument("--page-chars", type=int, default=400)
+    parser.add_argument("--max-context-chars", type=int, default=2048)
+    args = parser.parse_args()
+
+    text = "Ponies & dragons <in> Equestria. " * (
+        max(args.item_chars, args.page_chars) // 30 + 1
+    )
+    messages = [
+        Value("Message", f"{i}: {text[: args.item_chars]}") for i in range(args.items)
+    ]
+    pages = [f"{i}: {text[: args.page_chars]}" for i in range(args.items)]
+
+    list_kwargs = {
+        "max_length": args.max_length,
+        "min_item_length": args.min_item_length,
+    }
+    gist_kwargs = {
+        "max_page_chars": args.max_context_chars,
+        "max_gist_chars": args.max_context_chars,
+    }
+    legacy_items = min(args.items, args.legacy_items)
+    rows = [
+        (
+            "ListModule",
+            await time_appends(
+                LegacyListModule(**list_kwargs), messages[:legacy_items]
+            ),
+            await time_appends(ListModule(**list_kwargs), messages),
+        ),
+        (
+            "GistModule",
+            await time_appends(
+                LegacyGistModule(StubLLM(), **gist_kwargs), pages[:legacy_items]
+            ),
+            await time_appends(GistModule(StubLLM(), **gist_kwargs), pages),
+        ),
+    ]
+
+    print(f"{legacy_items} legacy appends, {args.items} current appends\n")
+    print(f"{'us/append':<16}{'legacy':>12}{'current':>12}{'speedup':>10}")
+    for label, legacy, current in rows:
+        legacy_us = legacy / legacy_items * 1e6
+        current_us = current / args.items * 1e6
+        print(
+            f"{label:<16}{legacy_us:>12.1f}{current_us:>12.1f}"
+            f"{legacy_us / current_us:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,190 @@
+"""
+Measure compile_user_prompt against the recursive compiler it replaced.
+
+The legacy implementation is embedded below as it was before the single-pass
+compiler, so both run on the same inputs. Prompt args mimic what the memory
+modules send: a ListValue of Values (ListModule), long pages keyed by title
+(WikiModule and GistModule), and a deeply nested dict. The length check the
+memory modules do before every insertion is measured separately, since it now
+counts characters without building the prompt.
+
+Usage:
+    python benchmarks/prompt_compiler.py --items 500 --depth 8
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+from xml.sax.saxutils import escape as xml_escape
+
+from pydantic import BaseModel
+
+from horsona.autodiff.variables import ListValue, Value
+from horsona.llm.engine_utils import compile_user_prompt, compile_user_prompt_length
+
+
+def legacy_convert_to_xml(obj, prefix=None, indent=0) -> str:
+    if prefix is None:
+        prefix = []
+
+    indent_str = "  " * indent
+    if isinstance(obj, dict):
+        result = []
+        for key, value in obj.items():
+            if not isinstance(value, (dict, list, set)):
+                single_item = True
+            else:
+                single_item = len(value) == 1
+
+            if single_item and not isinstance(value, (dict, list, set)):
+                value_str = legacy_convert_to_xml(value, prefix + [key], 0)
+                closing_indent = ""
+                newline = ""
+            else:
+                value_str = legacy_convert_to_xml(value, prefix + [key], indent + 1)
+                closing_indent = indent_str
+                newline = "\n"
+
+            if value_str.strip():
+                result.append(
+                    (
+                        f"{indent_str}<{'.'.join((prefix + [key]))}>{newline}"
+                        f"{value_str}{newline}"
+                        f"{closing_indent}</{'.'.join((prefix + [key]))}>"
+                    )
+                )
+            else:
+                result.append((f"{indent_str}<{prefix}.{key}></{prefix}.{key}>"))
+
+        return "\n".join(result)
+    elif isinstance(obj, (list, set)):
+        result = []
+        for i, value in enumerate(obj):
+            if not isinstance(value, (dict, list, set)):
+                single_item = True
+            else:
+                single_item = len(value) == 1
+
+            if single_item and not isinstance(value, (dict, list, set)):
+                value_str = legacy_convert_to_xml(value, prefix, 0)
+                closing_indent = ""
+                newline = ""
+            else:
+                value_str = legacy_convert_to_xml(value, prefix, indent + 1)
+                closing_indent = indent_str
+                newline = "\n"
+
+            tag = ".".join(prefix + [str(i)])
+            if value_str.strip():
+                result.append(
+                    f"{indent_str}<{tag}>{newline}{value_str}{newline}"
+                    f"{closing_indent}</{tag}>"
+                )
+            else:
+                result.append(f"{indent_str}<{tag}></{tag}>")
+        return "\n".join(result)
+    else:
+        return indent_str + xml_escape(str(obj))
+
+
+async def legacy_convert_to_dict(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    elif isinstance(obj, dict):
+        return {k: await legacy_convert_to_dict(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple, set)):
+        return [await legacy_convert_to_dict(v) for v in obj]
+    elif isinstance(obj, (int, float, str, bool)):
+        return obj
+    else:
+        return await legacy_convert_to_dict(
+            await obj.json() if obj is not None else "None"
+        )
+
+
+async def legacy_compile_user_prompt(**kwargs) -> str:
+    prompt_pieces = []
+    for key, value in kwargs.items():
+        value = legacy_convert_to_xml(await legacy_convert_to_dict(value), None, 1)
+        prompt_pieces.append(f"<{key}>\n{value}\n</{key}>")
+
+    return "\n\n".join(prompt_pieces)
+
+
+class Page(BaseModel):
+    title: str
+    sections: list[str]
+    links: dict[str, str]
+
+
+def nested(depth: int, width: int) -> Any:
+    if depth == 0:
+        return "Twilight & Spike <library>"
+    return {f"level{depth}_{i}": nested(depth - 1, width) for i in range(width)}
+
+
+def build_args(items: int, depth: int, page_chars: int) -> dict[str, Any]:
+    paragraph = ("Equestria is a land of magic & friendship. " * page_chars)[
+        :page_chars
+    ]
+    return {
+        "ITEMS": ListValue(
+            "Remembered items",
+            [Value("Fact", f"Fact {i}: {paragraph[:200]}") for i in range(items)],
+        ),
+        "PAGES": {
+            f"Page {i}": Page(
+                title=f"Page {i}",
+                sections=[paragraph] * 4,
+                links={"next": f"Page {i + 1}", "prev": f"Page {i - 1}"},
+            )
+            for i in range(items // 10)
+        },
+        "NESTED": nested(depth, 2),
+    }
+
+
+async def measure(fn, args: dict[str, Any], repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        await fn(**args)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+async def legacy_length(**kwargs) -> int:
+    return len(await legacy_compile_user_prompt(**kwargs))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=8)
+    parser.add_argument("--page-chars", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    prompt_args = build_args(args.items, args.depth, args.page_chars)
+    prompt = await compile_user_prompt(**prompt_args)
+    print(f"prompt length: {len(prompt)} characters\n")
+
+    rows = [
+        (
+            "compile (ms)",
+            await measure(legacy_compile_user_prompt, prompt_args, args.repeats),
+            await measure(compile_user_prompt, prompt_args, args.repeats),
+        ),
+        (
+            "length only (ms)",
+            await measure(legacy_length, prompt_args, args.repeats),
+            await measure(compile_user_prompt_length, prompt_args, args.repeats),
+        ),
+    ]
+
+    print(f"{'':<20}{'legacy':>12}{'current':>12}{'speedup':>10}")
+    for label, legacy, current in rows:
+        print(f"{label:<20}{legacy:>12.2f}{current:>12.2f}{legacy / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
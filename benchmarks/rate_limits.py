@@ -0,0 +1,109 @@
+"""
+Measure how closely RateLimits tracks its configured call limit.
+
+Concurrent callers loop on consume_call for a fixed duration, against the
+current token bucket limits and against the previous implementation, which is
+embedded below. The previous CallLimit spaced calls evenly at interval / limit,
+so it never allowed a burst, and concurrent callers that woke at the same time
+all went ahead, overshooting the limit. For each implementation the script
+reports:
+
+- Steady rate: calls per second after the first interval, against the
+  configured rate.
+- Burst time: seconds until the first max_calls calls were made. A provider
+  allows these at once.
+- Excess: the most calls made in any stretch of time beyond what a provider's
+  token bucket allows over that stretch (the burst plus the refill). Any
+  excess means calls the provider would reject.
+
+Usage:
+    python benchmarks/rate_limits.py --max-calls 20 --interval 1 --duration 5
+"""
+
+import argparse
+import asyncio
+import time
+
+from horsona.llm.base_engine import RateLimits
+
+
+class LegacyCallLimit:
+    def __init__(self, limit: float, interval: float) -> None:
+        self.limit = limit
+        self.interval = interval
+        self.last_blocked = time.time() - self.interval / self.limit
+
+    async def consume_call(self) -> None:
+        await self.wait_for()
+        self.last_blocked = max(
+            self.last_blocked, time.time() - self.interval / self.limit
+        )
+        self.last_blocked += self.interval / self.limit
+
+    def next_allowed(self) -> float:
+        return max(self.last_blocked + self.interval / self.limit, time.time())
+
+    async def wait_for(self) -> None:
+        next_allowed = self.next_allowed()
+        now = time.time()
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+
+async def run(limit, callers: int, duration: float) -> list[float]:
+    start = time.time()
+    calls = []
+
+    async def caller() -> None:
+        while True:
+            await limit.consume_call()
+            now = time.time() - start
+            if now >= duration:
+                return
+            calls.append(now)
+
+    await asyncio.gather(*[caller() for _ in range(callers)])
+    return sorted(calls)
+
+
+def excess(calls: list[float], burst: int, rate: float) -> int:
+    # Calls i..j take j - i + 1 slots, and the bucket allows the burst plus
+    # rate * (calls[j] - calls[i]) of them
+    worst = 0.0
+    best_start = float("-inf")
+    for j, call in enumerate(calls):
+        best_start = max(best_start, rate * call - j)
+        worst = max(worst, j + 1 - burst - rate * call + best_start)
+    return int(worst + 1e-6)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-calls", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--callers", type=int, default=32)
+    args = parser.parse_args()
+
+    rate = args.max_calls / args.interval
+    implementations = {
+        "legacy": LegacyCallLimit(args.max_calls, args.interval),
+        "token bucket": RateLimits(
+            [{"interval": args.interval, "max_calls": args.max_calls}]
+        ),
+    }
+
+    print(f"Configured: {rate:g} calls/s, burst of {args.max_calls}")
+    print(f"{'':<16}{'steady calls/s':>16}{'burst time (s)':>16}{'excess':>8}")
+    for label, limit in implementations.items():
+        calls = await run(limit, args.callers, args.duration)
+        steady = sum(1 for call in calls if call >= args.interval)
+        print(
+            f"{label:<16}{steady / (args.duration - args.interval):>16.2f}"
+            f"{calls[args.max_calls - 1]:>16.3f}"
+            f"{excess(calls, args.max_calls, rate):>8}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,200 @@
+"""
+Compare native structured output with the prompt-based JSON path.
+
+A local stub of the OpenAI chat completions API stands in for the provider, so
+the benchmark needs no API key and measures only what horsona controls:
+
+- Prompt tokens: the stub counts about 4 characters per token over everything it
+  receives, including the schema in response_format.
+- Latency: the stub waits a fixed time per completion token, so longer
+  completions (fences, preambles) cost more.
+- Parse failures: both paths get the same generations. --malformed-rate of
+  them have one of the mistakes models make (a trailing comma, a cut off
+  object, or the schema echoed back). The prompt path gets each generation in
+  a fenced code block after a short preamble, as models write it in free text,
+  and the native path gets the bare JSON. A call counts as a failure when the
+  client raises or returns a different object than the one generated.
+
+Usage:
+    python benchmarks/structured_output.py --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from pydantic import BaseModel
+
+from horsona.llm.base_engine import LLMMetrics
+from horsona.llm.openai_engine import AsyncOpenAIEngine
+
+
+class Category(BaseModel):
+    name: str
+    description: str
+    examples: list[str]
+
+
+class Structure(BaseModel):
+    topic: str
+    categories: list[Category]
+
+
+EXPECTED = Structure(
+    topic="Pony hobbies",
+    categories=[
+        Category(
+            name=name,
+            description=f"Hobbies involving {name.lower()}",
+            examples=["one", "two", "three"],
+        )
+        for name in ["Music", "Fashion", "Weather", "Books"]
+    ],
+)
+RESPONSE = EXPECTED.model_dump()
+
+
+def create_stub(seconds_per_token: float, malformed_rate: float, seed: int) -> FastAPI:
+    app = FastAPI()
+    # One generator per path, so both paths see the same generations
+    rngs = {"prompt": random.Random(seed), "native": random.Random(seed)}
+
+    def generate(rng: random.Random) -> str:
+        generation = json.dumps(RESPONSE, indent=2)
+        if rng.random() < malformed_rate:
+            generation = rng.choice(
+                [
+                    f"{generation[:-2]},\n}}",
+                    generation[: len(generation) // 2],
+                    json.dumps(Structure.model_json_schema(), indent=2),
+                ]
+            )
+        return generation
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request) -> dict:
+        body = await request.json()
+        received = json.dumps(body["messages"]) + json.dumps(
+            body.get("response_format", "")
+        )
+
+        if "response_format" in body:
+            content = generate(rngs["native"])
+        else:
+            content = (
+                f"Here is the JSON response:\n\n```json\n"
+                f"{generate(rngs['prompt'])}\n```"
+            )
+
+        prompt_tokens = len(received) // 4
+        completion_tokens = len(content) // 4
+        await asyncio.sleep(completion_tokens * seconds_per_token)
+
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return app
+
+
+async def run_path(
+    engine: AsyncOpenAIEngine, requests: int, concurrency: int
+) -> dict[str, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    metrics = LLMMetrics()
+
+    async def one() -> None:
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await engine.query_object(
+                    Structure,
+                    TOPIC="Pony hobbies",
+                    INSTRUCTIONS="Split the topic into 4 MECE categories.",
+                    metrics=metrics,
+                )
+                failures += result != EXPECTED
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one() for _ in range(requests)])
+
+    latencies.sort()
+    return {
+        "prompt tokens/call": metrics.prompt_tokens / requests,
+        "completion tokens/call": metrics.completion_tokens / requests,
+        "mean latency (ms)": statistics.mean(latencies) * 1000,
+        "p95 latency (ms)": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        "parse failure rate": failures / requests,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds-per-token", type=float, default=0.0005)
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    app = create_stub(args.seconds_per_token, args.malformed_rate, args.seed)
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    results = {}
+    for label, structured_output in [("prompt", False), ("native", True)]:
+        engine = AsyncOpenAIEngine(
+            model="stub", structured_output=structured_output, coalesce_requests=False
+        )
+        results[label] = await run_path(engine, args.requests, args.concurrency)
+
+    server.should_exit = True
+    await server_task
+
+    print(f"{'':<24}{'prompt':>12}{'native':>12}")
+    for key in results["prompt"]:
+        print(
+            f"{key:<24}{results['prompt'][key]:>12.3f}{results['native'][key]:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
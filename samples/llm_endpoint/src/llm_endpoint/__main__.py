@@ -5,10 +5,12 @@ import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI
 
-from horsona.autodiff.basic import unzip, zip
+from horsona.autodiff.basic import unzip
+from horsona.autodiff.checkpoint import CheckpointStore
 from horsona.autodiff.variables import Value
 from horsona.config import load_indices, load_llms
 from horsona.database.embedding_database import EmbeddingDatabase
+from horsona.index.hnsw_index import HnswEmbeddingIndex
 from horsona.interface import oai
 from horsona.memory.wiki_module import WikiModule
 
@@ -21,7 +23,14 @@ indices = load_indices()
 
 
 async def load_backstory_llm() -> BackstoryLLMEngine:
-    if os.path.exists("./backstory_llm_state.zip"):
+    # Each checkpoint only writes the modules that changed since the last one
+    checkpoints = CheckpointStore("./backstory_llm_state")
+
+    if checkpoints.exists():
+        backstory_llm: BackstoryLLMEngine = checkpoints.load()
+        backstory_module = backstory_llm.backstory_module
+    elif os.path.exists("./backstory_llm_state.zip"):
+        # Checkpoint from before CheckpointStore
         state_dict = unzip("./backstory_llm_state.zip")
         backstory_llm: BackstoryLLMEngine = BackstoryLLMEngine.load_state_dict(
             state_dict,
@@ -30,6 +39,10 @@ async def load_backstory_llm() -> BackstoryLLMEngine:
     else:
         reasoning_llm = llms["reasoning_llm"]
         query_index = indices["query_index"]
+        if isinstance(query_index, HnswEmbeddingIndex) and not query_index.persist_dir:
+            # Keep the index next to the checkpoints, so a checkpoint only
+            # refers to it instead of serializing the whole index every time
+            query_index.persist_dir = "./backstory_llm_state/query_index"
         embedding_db = EmbeddingDatabase(reasoning_llm, query_index)
 
         backstory_module = WikiModule(
@@ -64,11 +77,7 @@ async def load_backstory_llm() -> BackstoryLLMEngine:
             )
 
             if new_module:
-                state_dict = backstory_llm.state_dict()
-                zip(state_dict, f"./backstory_llm_state.zip.new")
-                os.rename(
-                    f"./backstory_llm_state.zip.new", f"./backstory_llm_state.zip"
-                )
+                checkpoints.save(backstory_llm)
 
     return backstory_llm
 
@@ -2,8 +2,7 @@ import asyncio
 from collections import defaultdict
 from typing import Any, Dict, Optional
 
-import httpx
-
+from horsona.http.pool import get_http_client
 from horsona.lock.resource_state_lock import ResourceStateLock
 
 
@@ -61,10 +60,11 @@ class SpeakerLock(ResourceStateLock):
 
         headers = {"accept": "application/json"}
 
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.get(endpoint, params=params, headers=headers)
-            response.raise_for_status()
-            return response.json()
+        response = await get_http_client().get(
+            endpoint, params=params, headers=headers, timeout=None
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def _change_reference(
         self,
@@ -95,10 +95,11 @@ class SpeakerLock(ResourceStateLock):
 
         headers = {"accept": "application/json"}
 
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.get(endpoint, params=params, headers=headers)
-            response.raise_for_status()
-            return response.json()
+        response = await get_http_client().get(
+            endpoint, params=params, headers=headers, timeout=None
+        )
+        response.raise_for_status()
+        return response.json()
 
 
 class GptSovitsTTS:
@@ -163,9 +164,10 @@ class GptSovitsTTS:
 
         headers = {"accept": "application/json"}
 
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.get(endpoint, params=params, headers=headers)
-            response.raise_for_status()
+        response = await get_http_client().get(
+            endpoint, params=params, headers=headers, timeout=None
+        )
+        response.raise_for_status()
 
         # Return the audio data as bytes
         return response.content
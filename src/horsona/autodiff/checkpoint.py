@@ -0,0 +1,235 @@
+import hashlib
+import importlib
+import json
+import os
+import uuid
+from typing import Any, Optional
+
+from horsona.autodiff.basic import HorseData, load_state_dict, state_dict
+
+# Types of state_dict nodes that never hold HorseData or binary data
+_SCALAR_TYPES = ("NoneType", "bool", "int", "float", "str")
+
+
+class CheckpointStore:
+    """
+    An incremental, content-addressed store for checkpoints of HorseData.
+
+    A checkpoint is split into objects: one per HorseData in the state_dict,
+    and one per binary field. Each object is stored once under the hash of
+    its contents, so saving again only writes the objects that changed since
+    any earlier save. Unchanged modules, and large binary fields like HNSW
+    indexes, cost nothing to write.
+
+    Each save then points a named ref at the new root with an atomic rename,
+    so loading always sees a complete checkpoint. Objects that no ref uses
+    anymore are removed by compact, which also runs every compact_every saves.
+
+    Layout:
+        path/refs/<ref>: Hash of the root object of the latest save
+        path/objects/<hash[:2]>/<hash[2:]>: Contents of each object
+
+    Attributes:
+        path (str): Directory of the store
+        compact_every (int | None): Saves between compactions, or None to
+            only compact when compact is called
+        objects_written (int): Objects written by the last save
+        bytes_written (int): Bytes written by the last save
+    """
+
+    def __init__(self, path: str, compact_every: Optional[int] = 100) -> None:
+        """
+        Args:
+            path: Directory of the store. It's created if it doesn't exist.
+            compact_every: Saves between compactions, or None to never compact
+                automatically
+        """
+        self.path = path
+        self.compact_every = compact_every
+        self.objects_written = 0
+        self.bytes_written = 0
+        self._saves = 0
+        # Objects known to be in the store, to skip checking the filesystem
+        self._known: set[str] = set()
+        self._horse_data_types: dict[tuple[str, str], bool] = {}
+
+        os.makedirs(os.path.join(path, "refs"), exist_ok=True)
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+
+    def save(self, value: Any, ref: str = "latest") -> str:
+        """
+        Save a checkpoint of a value.
+
+        Args:
+            value: Value to save, usually a HorseData
+            ref: Name to save the checkpoint under
+
+        Returns:
+            str: Hash of the checkpoint's root object
+        """
+        self.objects_written = 0
+        self.bytes_written = 0
+
+        encoded = self._encode(state_dict(value))
+        if isinstance(encoded, dict) and encoded.keys() == {"$ref"}:
+            root = encoded["$ref"]
+        else:
+            root = self._put(json.dumps(encoded).encode("utf-8"))
+        _write_atomic(os.path.join(self.path, "refs", ref), root.encode("utf-8"))
+
+        self._saves += 1
+        if self.compact_every is not None and self._saves % self.compact_every == 0:
+            self.compact()
+        return root
+
+    def load(self, ref: str = "latest", args: dict = {}) -> Any:
+        """
+        Load the latest checkpoint saved under a ref.
+
+        Args:
+            ref: Name the checkpoint was saved under
+            args: Constructor args to override, as for load_state_dict
+
+        Returns:
+            Any: The loaded value
+        """
+        with open(os.path.join(self.path, "refs", ref), "rb") as f:
+            root = f.read().decode("utf-8")
+        return load_state_dict(self._decode({"$ref": root}), args)
+
+    def exists(self, ref: str = "latest") -> bool:
+        """
+        Check whether a checkpoint was saved under a ref.
+
+        Args:
+            ref: Name of the checkpoint
+
+        Returns:
+            bool: Whether the ref exists
+        """
+        return os.path.exists(os.path.join(self.path, "refs", ref))
+
+    def compact(self) -> int:
+        """
+        Remove objects that no ref uses.
+
+        Returns:
+            int: Number of objects removed
+        """
+        reachable = set()
+        pending = []
+        for ref in os.listdir(os.path.join(self.path, "refs")):
+            if ref.endswith(".tmp"):
+                continue
+            with open(os.path.join(self.path, "refs", ref), "rb") as f:
+                pending.append(f.read().decode("utf-8"))
+
+        while pending:
+            digest = pending.pop()
+            if digest in reachable:
+                continue
+            reachable.add(digest)
+            with open(self._object_path(digest), "rb") as f:
+                contents = f.read()
+            # Blobs are raw bytes, and only JSON objects refer to others
+            try:
+                pending.extend(_refs(json.loads(contents)))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                pass
+
+        removed = 0
+        objects_dir = os.path.join(self.path, "objects")
+        for prefix in os.listdir(objects_dir):
+            for name in os.listdir(os.path.join(objects_dir, prefix)):
+                if prefix + name not in reachable:
+                    os.unlink(os.path.join(objects_dir, prefix, name))
+                    self._known.discard(prefix + name)
+                    removed += 1
+        return removed
+
+    def _encode(self, node: Any) -> Any:
+        if isinstance(node, bytes):
+            return {"$blob": self._put(node)}
+        elif isinstance(node, list):
+            return [self._encode(v) for v in node]
+        elif not isinstance(node, dict):
+            return node
+        elif node.get("package") == "builtins" and node.get("type") in _SCALAR_TYPES:
+            # Most fields are scalars, which can't hold anything to split out
+            return node
+
+        encoded = {k: self._encode(v) for k, v in node.items()}
+        if self._is_horse_data(node):
+            # Each HorseData is its own object, so unchanged ones aren't
+            # written again
+            return {"$ref": self._put(json.dumps(encoded).encode("utf-8"))}
+        return encoded
+
+    def _decode(self, node: Any) -> Any:
+        if isinstance(node, list):
+            return [self._decode(v) for v in node]
+        elif not isinstance(node, dict):
+            return node
+
+        if len(node) == 1 and isinstance(node.get("$blob"), str):
+            with open(self._object_path(node["$blob"]), "rb") as f:
+                return f.read()
+        if len(node) == 1 and isinstance(node.get("$ref"), str):
+            with open(self._object_path(node["$ref"]), "rb") as f:
+                return self._decode(json.loads(f.read()))
+        return {k: self._decode(v) for k, v in node.items()}
+
+    def _is_horse_data(self, node: dict) -> bool:
+        if node.keys() != {"package", "type", "data"} or node["package"] == "builtins":
+            return False
+
+        key = (node["package"], node["type"])
+        if key not in self._horse_data_types:
+            cls = getattr(importlib.import_module(key[0]), key[1], None)
+            self._horse_data_types[key] = isinstance(cls, type) and issubclass(
+                cls, HorseData
+            )
+        return self._horse_data_types[key]
+
+    def _put(self, contents: bytes) -> str:
+        digest = hashlib.sha256(contents).hexdigest()
+        if digest in self._known:
+            return digest
+
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, contents)
+            self.objects_written += 1
+            self.bytes_written += len(contents)
+        self._known.add(digest)
+        return digest
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.path, "objects", digest[:2], digest[2:])
+
+
+def _refs(node: Any) -> list[str]:
+    if isinstance(node, list):
+        return [ref for v in node for ref in _refs(v)]
+    elif not isinstance(node, dict):
+        return []
+
+    for marker in ("$ref", "$blob"):
+        if len(node) == 1 and isinstance(node.get(marker), str):
+            return [node[marker]]
+    return [ref for v in node.values() for ref in _refs(v)]
+
+
+def _write_atomic(path: str, contents: bytes) -> None:
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
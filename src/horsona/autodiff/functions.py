@@ -13,6 +13,15 @@ from horsona.autodiff.variables import Value
 from horsona.llm.base_engine import AsyncLLMEngine
 
 
+class SuggestedAssignment(BaseModel):
+    input_name: str
+    relevant_feedback: list[str]
+
+
+class FeedbackAssignments(BaseModel):
+    assignments: list[SuggestedAssignment]
+
+
 @horsefunction
 async def extract_object(
     llm: AsyncLLMEngine,
@@ -50,13 +59,6 @@ async def assign_feedback(
     result: HorseVariable,
     inputs: Any,
 ) -> None:
-    class SuggestedAssignment(BaseModel):
-        input_name: str
-        relevant_feedback: list[str]
-
-    class FeedbackAssignments(BaseModel):
-        assignments: list[SuggestedAssignment]
-
     gradients = await llm.query_object(
         FeedbackAssignments,
         INPUTS=inputs,
@@ -1,3 +1,4 @@
+import functools
 from collections import OrderedDict
 from typing import (
     AsyncGenerator,
@@ -11,7 +12,7 @@ from typing import (
     ValuesView,
 )
 
-from pydantic import BaseModel
+from pydantic import BaseModel, create_model
 
 from horsona.autodiff.basic import (
     GradContext,
@@ -103,11 +104,8 @@ class Value(HorseVariable, Generic[HorseType]):
                 f"Cannot apply gradients to {self} without an updater LLM."
             )
 
-        class UpdatedValue(BaseModel):
-            final_value: type(self.value)
-
         update = await self.llm.query_object(
-            UpdatedValue,
+            _updated_value_model(type(self.value)),
             DATA=self,
             ERRATA=gradients,
             DATATYPE=self.datatype,
@@ -240,3 +238,9 @@ class ListValue(Value[list]):
 
     async def apply_gradients(self, gradients: list[HorseGradient]) -> None:
         pass
+
+
+@functools.lru_cache(maxsize=None)
+def _updated_value_model(value_type: type) -> Type[BaseModel]:
+    # One model per value type, so repeated updates reuse its schema
+    return create_model("UpdatedValue", final_value=(value_type, ...))
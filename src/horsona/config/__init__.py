@@ -1,4 +1,5 @@
-from typing import TYPE_CHECKING
+import importlib
+from typing import TYPE_CHECKING, Any
 
 from horsona.config.json_with_comments import load_json_with_comments
 
@@ -6,6 +7,7 @@ if TYPE_CHECKING:
     from horsona.index.base_index import BaseIndex
     from horsona.index.embedding_model import EmbeddingModel
     from horsona.llm.base_engine import AsyncLLMEngine
+    from horsona.llm.token_estimator import TokenEstimator
 
 
 LLM_CONFIG_PATH = "llm_config.json"
@@ -17,6 +19,63 @@ _loaded_indices: bool = False
 llms: dict[str, "AsyncLLMEngine"] = {}
 _loaded_llms: bool = False
 
+# Modules of the types that can appear in config files. Each module is only
+# imported once a config uses its type, so loading a config doesn't import the
+# SDKs of providers it doesn't use.
+_ENGINE_MODULES = {
+    "AsyncAnthropicEngine": "horsona.llm.anthropic_engine",
+    "AsyncCerebrasEngine": "horsona.llm.cerebras_engine",
+    "AsyncFireworksEngine": "horsona.llm.fireworks_engine",
+    "AsyncGrokEngine": "horsona.llm.grok_engine",
+    "AsyncGroqEngine": "horsona.llm.groq_engine",
+    "AsyncOpenAIEngine": "horsona.llm.openai_engine",
+    "AsyncPerplexityEngine": "horsona.llm.perplexity_engine",
+    "AsyncTogetherEngine": "horsona.llm.together_engine",
+}
+_INDEX_MODULES = {
+    "HnswEmbeddingIndex": "horsona.index.hnsw_index",
+    "NumpyEmbeddingIndex": "horsona.index.numpy_index",
+    "OllamaEmbeddingModel": "horsona.index.ollama_model",
+    "OpenAIEmbeddingModel": "horsona.index.openai_embedding_model",
+}
+
+# Optional llm_config.json fields that are passed through to engine constructors
+_ENGINE_OPTIONS = (
+    "coalesce_requests",
+    "token_estimator",
+    "structured_output",
+    "prompt_caching",
+    "batch_api",
+    "max_in_flight",
+    "max_queued",
+    "rate_limit_key",
+)
+
+# Optional fields for embedding models in index_config.json
+_EMBEDDING_OPTIONS = (
+    "batch_window",
+    "max_batch_size",
+    "max_concurrency",
+    "memory_entries",
+)
+
+# Optional fields for each index type in index_config.json
+_INDEX_OPTIONS = {
+    "HnswEmbeddingIndex": ("persist_dir", "num_threads"),
+    "NumpyEmbeddingIndex": ("space",),
+}
+
+# Optional fields for MultiEngine entries
+_ROUTING_OPTIONS = (
+    "max_retries",
+    "weights",
+    "cooldown",
+    "max_cooldown",
+    "hedge_percentile",
+    "hedge_min_delay",
+    "resume_streams",
+)
+
 
 def load_llms() -> dict[str, "AsyncLLMEngine"]:
     """
@@ -30,16 +89,6 @@ def load_llms() -> dict[str, "AsyncLLMEngine"]:
     if _loaded_llms:
         return llms
 
-    from horsona.llm.anthropic_engine import AsyncAnthropicEngine
-    from horsona.llm.cerebras_engine import AsyncCerebrasEngine
-    from horsona.llm.fireworks_engine import AsyncFireworksEngine
-    from horsona.llm.grok_engine import AsyncGrokEngine
-    from horsona.llm.groq_engine import AsyncGroqEngine
-    from horsona.llm.multi_engine import create_multi_engine
-    from horsona.llm.openai_engine import AsyncOpenAIEngine
-    from horsona.llm.perplexity_engine import AsyncPerplexityEngine
-    from horsona.llm.together_engine import AsyncTogetherEngine
-
     with open(LLM_CONFIG_PATH, "r") as f:
         config = load_json_with_comments(f)
 
@@ -49,59 +98,102 @@ def load_llms() -> dict[str, "AsyncLLMEngine"]:
     for item in config:
         for name, params in item.items():
             engine_type = params["type"]
+            if engine_type == "HttpPool":
+                _configure_http_pool(params)
+                continue
+            if engine_type in ("SqliteLimitBackend", "RedisLimitBackend"):
+                # Applies to the engines that come after it
+                _configure_limit_backend(params)
+                continue
+
             model = params.get("model")
             rate_limits = params.get("rate_limits", [])
-
-            if engine_type == "AsyncCerebrasEngine":
-                llms[name] = AsyncCerebrasEngine(
-                    model=model,
-                    rate_limits=rate_limits,
-                    name=name,
-                )
-            elif engine_type == "AsyncGroqEngine":
-                llms[name] = AsyncGroqEngine(
-                    model=model, rate_limits=rate_limits, name=name
-                )
-            elif engine_type == "AsyncFireworksEngine":
-                llms[name] = AsyncFireworksEngine(
-                    model=model, rate_limits=rate_limits, name=name
-                )
-            elif engine_type == "AsyncOpenAIEngine":
-                llms[name] = AsyncOpenAIEngine(
-                    model=model, rate_limits=rate_limits, name=name
-                )
-            elif engine_type == "AsyncAnthropicEngine":
-                llms[name] = AsyncAnthropicEngine(
-                    model=model, rate_limits=rate_limits, name=name
-                )
-            elif engine_type == "AsyncTogetherEngine":
-                llms[name] = AsyncTogetherEngine(
-                    model=model, rate_limits=rate_limits, name=name
+            engine_args = {k: params[k] for k in _ENGINE_OPTIONS if k in params}
+            if "token_estimator" in engine_args:
+                engine_args["token_estimator"] = _token_estimator_from_config(
+                    engine_args["token_estimator"]
                 )
-            elif engine_type == "AsyncGrokEngine":
-                llms[name] = AsyncGrokEngine(
-                    model=model, rate_limits=rate_limits, name=name
-                )
-            elif engine_type == "AsyncPerplexityEngine":
-                llms[name] = AsyncPerplexityEngine(
-                    model=model, rate_limits=rate_limits, name=name
+
+            if engine_type in _ENGINE_MODULES:
+                llms[name] = _import_type(_ENGINE_MODULES, engine_type)(
+                    model=model, rate_limits=rate_limits, name=name, **engine_args
                 )
             elif engine_type == "MultiEngine":
+                from horsona.llm.multi_engine import create_multi_engine
+
                 sub_engines = [llms[engine_name] for engine_name in params["engines"]]
-                llms[name] = create_multi_engine(*sub_engines, name=name)
+                routing_args = {k: params[k] for k in _ROUTING_OPTIONS if k in params}
+                llms[name] = create_multi_engine(
+                    *sub_engines, name=name, **routing_args
+                )
             elif engine_type == "ReferenceEngine":
                 sub_engine = params["reference"]
                 llms[name] = llms[sub_engine]
             else:
                 raise ValueError(f"Unknown engine type: {engine_type}")
 
+            if params.get("cache") is not None:
+                from horsona.llm.cached_engine import CachedLLMEngine, ResponseCache
+
+                llms[name] = CachedLLMEngine(
+                    llms[name], ResponseCache(**params["cache"]), name=name
+                )
+
     _loaded_llms = True
     return llms
 
 
+def _import_type(modules: dict[str, str], type_name: str) -> Any:
+    """
+    Get the class for a type name from a config file, importing its module.
+
+    Args:
+        modules: Module of each type name
+        type_name: Name of the type
+
+    Returns:
+        Any: The class
+    """
+    return getattr(importlib.import_module(modules[type_name]), type_name)
+
+
+def _token_estimator_from_config(config: dict) -> "TokenEstimator":
+    from horsona.llm.token_estimator import (
+        CharsPerTokenEstimator,
+        TiktokenEstimator,
+    )
+
+    args = {k: v for k, v in config.items() if k != "type"}
+    if config["type"] == "CharsPerTokenEstimator":
+        return CharsPerTokenEstimator(**args)
+    elif config["type"] == "TiktokenEstimator":
+        return TiktokenEstimator(**args)
+    else:
+        raise ValueError(f"Unknown token estimator type: {config['type']}")
+
+
+def _configure_limit_backend(config: dict) -> None:
+    from horsona.llm.limit_backends import (
+        RedisLimitBackend,
+        SqliteLimitBackend,
+        configure_limit_backend,
+    )
+
+    args = {k: v for k, v in config.items() if k != "type"}
+    if config["type"] == "SqliteLimitBackend":
+        configure_limit_backend(SqliteLimitBackend(**args))
+    else:
+        configure_limit_backend(RedisLimitBackend(**args))
+
+
+def _configure_http_pool(config: dict) -> None:
+    from horsona.http.pool import configure_http_pool
+
+    configure_http_pool(**{k: v for k, v in config.items() if k != "type"})
+
+
 def load_indices() -> dict[str, "BaseIndex"]:
     global _loaded_indices, indices
-    from horsona.index.hnsw_index import HnswEmbeddingIndex
 
     if _loaded_indices:
         return
@@ -115,9 +207,16 @@ def load_indices() -> dict[str, "BaseIndex"]:
         for name, params in item.items():
             index_type = params["type"]
 
-            if index_type == "HnswEmbeddingIndex":
+            if index_type == "HttpPool":
+                _configure_http_pool(params)
+            elif index_type in _INDEX_OPTIONS:
                 embedding = _embedding_model_from_config(params["embedding"])
-                indices[name] = HnswEmbeddingIndex(model=embedding)
+                index_args = {
+                    k: params[k] for k in _INDEX_OPTIONS[index_type] if k in params
+                }
+                indices[name] = _import_type(_INDEX_MODULES, index_type)(
+                    model=embedding, **index_args
+                )
             else:
                 raise ValueError(f"Unknown index type: {index_type}")
 
@@ -126,19 +225,24 @@ def load_indices() -> dict[str, "BaseIndex"]:
 
 
 def _embedding_model_from_config(config: dict) -> "EmbeddingModel":
-    from horsona.index.ollama_model import OllamaEmbeddingModel
-    from horsona.index.openai_embedding_model import OpenAIEmbeddingModel
+    from horsona.index.embedding_service import EmbeddingCache, EmbeddingService
 
     if config["type"] == "OllamaEmbeddingModel":
         model = config["model"]
         url = config.get("url")
-        return OllamaEmbeddingModel(model, url=url)
+        embedding = _import_type(_INDEX_MODULES, config["type"])(model, url=url)
     elif config["type"] == "OpenAIEmbeddingModel":
         model = config["model"]
-        return OpenAIEmbeddingModel(model)
+        embedding = _import_type(_INDEX_MODULES, config["type"])(model)
     else:
         raise ValueError(f"Unknown embedding model type: {config['type']}")
 
+    # Batch concurrent requests and keep recent embeddings in memory
+    service_args = {k: config[k] for k in _EMBEDDING_OPTIONS if k in config}
+    if config.get("cache") is not None:
+        service_args["cache"] = EmbeddingCache(**config["cache"])
+    return EmbeddingService(embedding, **service_args)
+
 
 def get_index(name: str) -> "BaseIndex | EmbeddingModel":
     load_indices()
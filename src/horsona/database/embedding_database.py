@@ -1,8 +1,10 @@
+import asyncio
 from collections import defaultdict
 from typing import Any
 
 from horsona.database.base_database import Database
 from horsona.index.base_index import BaseIndex
+from horsona.index.embedding_index import EmbeddingIndex
 from horsona.llm.base_engine import AsyncLLMEngine
 
 
@@ -34,6 +36,35 @@ class EmbeddingDatabase(Database):
             if key in self.data
         }
 
+    async def query_many_with_weights(
+        self, queries: list[str], topk: int = 1
+    ) -> list[dict]:
+        """
+        Search for several queries at once.
+
+        Args:
+            queries: Queries to search for
+            topk: Maximum number of results per query
+
+        Returns:
+            list[dict]: The results of each query, in the same order as queries
+        """
+        if isinstance(self.index, EmbeddingIndex):
+            all_indices = await self.index.query_many_with_weights(queries, topk)
+        else:
+            all_indices = await asyncio.gather(
+                *[self.index.query_with_weights(query, topk) for query in queries]
+            )
+
+        return [
+            {
+                key: (self.data[key], weight)
+                for key, weight in indices.values()
+                if key in self.data
+            }
+            for indices in all_indices
+        ]
+
     async def delete(self, index: str) -> None:
         deleted_keys = await self.index.delete([index])
         for key in deleted_keys:
@@ -0,0 +1,144 @@
+import asyncio
+import weakref
+from typing import Any, Optional
+
+import httpx
+
+# Settings used for any host without an override
+DEFAULT_POOL_CONFIG: dict[str, Any] = {
+    "http2": True,
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 60.0,
+}
+
+_config: dict[str, Any] = dict(DEFAULT_POOL_CONFIG)
+_host_config: dict[str, dict[str, Any]] = {}
+_client: Optional[httpx.AsyncClient] = None
+_transport: Optional["PooledTransport"] = None
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    """
+    Transport that keeps one connection pool per host and event loop.
+
+    httpx connections belong to the event loop that opened them, so pools are
+    created lazily for each running loop. This lets a single client be shared
+    by engines that are created before any loop is running, and by code that
+    runs in several loops (like tests).
+    """
+
+    def __init__(self) -> None:
+        self._pools: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[str, httpx.AsyncHTTPTransport]
+        ] = weakref.WeakKeyDictionary()
+
+    def _pool_for(self, host: str) -> httpx.AsyncHTTPTransport:
+        pools = self._pools.setdefault(asyncio.get_running_loop(), {})
+        pool = pools.get(host)
+        if pool is None:
+            settings = {**_config, **_host_config.get(host, {})}
+            pool = httpx.AsyncHTTPTransport(
+                http2=settings["http2"] and _h2_available(),
+                limits=httpx.Limits(
+                    max_connections=settings["max_connections"],
+                    max_keepalive_connections=settings["max_keepalive_connections"],
+                    keepalive_expiry=settings["keepalive_expiry"],
+                ),
+            )
+            pools[host] = pool
+        return pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._pool_for(request.url.host).handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """Close the pools that belong to the running event loop."""
+        pools = self._pools.pop(asyncio.get_running_loop(), {})
+        for pool in pools.values():
+            await pool.aclose()
+
+
+def configure_http_pool(
+    hosts: Optional[dict[str, dict[str, Any]]] = None, **settings: Any
+) -> None:
+    """
+    Configure the shared HTTP connection pools.
+
+    Settings only apply to pools opened afterwards, so this should be called
+    before any requests are made. load_llms and load_indices call it for "HttpPool"
+    entries in llm_config.json and index_config.json.
+
+    Args:
+        hosts: Per-host overrides, keyed by host name
+        **settings: Defaults for every host: http2, max_connections,
+            max_keepalive_connections and keepalive_expiry. HTTP/2 is only used
+            if the h2 package is installed.
+
+    Example:
+        >>> configure_http_pool(
+        ...     max_connections=50,
+        ...     hosts={"api.openai.com": {"max_connections": 200}},
+        ... )
+    """
+    unknown = set(settings) - set(DEFAULT_POOL_CONFIG)
+    for host_settings in (hosts or {}).values():
+        unknown |= set(host_settings) - set(DEFAULT_POOL_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown HTTP pool settings: {sorted(unknown)}")
+
+    _config.update(settings)
+    for host, host_settings in (hosts or {}).items():
+        _host_config.setdefault(host, {}).update(host_settings)
+
+
+def get_http_transport() -> PooledTransport:
+    """
+    Get the process-wide pooled transport.
+
+    Use this for clients that have to create their own httpx.AsyncClient.
+
+    Returns:
+        PooledTransport: The shared transport
+    """
+    global _transport
+    if _transport is None:
+        _transport = PooledTransport()
+    return _transport
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the process-wide HTTP client.
+
+    Every engine and embedding model sends its requests through this client so
+    that connections stay warm between requests. Don't close it directly; use
+    close_http_clients instead.
+
+    Returns:
+        httpx.AsyncClient: The shared client
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            transport=get_http_transport(), timeout=httpx.Timeout(600, connect=10)
+        )
+    return _client
+
+
+async def close_http_clients() -> None:
+    """
+    Close all pooled connections opened from the running event loop.
+
+    The shared client stays usable and opens new connections as needed.
+    """
+    if _transport is not None:
+        await _transport.aclose()
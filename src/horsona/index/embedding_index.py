@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 from horsona.index.base_index import BaseIndex
@@ -13,6 +14,29 @@ class EmbeddingIndex(BaseIndex[str], ABC):
         self, query: str, topk: int
     ) -> dict[str, tuple[str, float]]: ...
 
+    async def query_many_with_weights(
+        self, queries: list[str], topk: int
+    ) -> list[dict[str, tuple[str, float]]]:
+        """
+        Search for several queries at once.
+
+        Indexes that can embed and search a batch of queries in one pass should
+        override this. By default, the queries run concurrently.
+
+        Args:
+            queries: Queries to search for
+            topk: Maximum number of results per query
+
+        Returns:
+            list[dict[str, tuple[str, float]]]: The results of each query, in
+                the same order as queries
+        """
+        return list(
+            await asyncio.gather(
+                *[self.query_with_weights(query, topk) for query in queries]
+            )
+        )
+
     @abstractmethod
     async def extend(self, data: list[str]) -> None: ...
 
@@ -36,6 +36,25 @@ class EmbeddingModel(HorseData, ABC):
         else:
             return super().load_state_dict(state_dict, args, debug_prefix)
 
+    def cache_key(self) -> str | None:
+        """
+        Get a key that identifies the embeddings this model produces, so they
+        can be cached across runs.
+
+        Models that call a server override this to add its address, so the same
+        model name on different servers doesn't share cached embeddings.
+
+        Returns:
+            str | None: The key, or None if the model has no model or name to
+                identify it by
+        """
+        # Read fields directly so wrapped models don't forward the lookup
+        model_fields = vars(self)
+        model = model_fields.get("model") or model_fields.get("name")
+        if model is None:
+            return None
+        return f"{type(self).__name__}:{model}"
+
     @abstractmethod
     async def get_data_embeddings(self, sentences: list[str]) -> list[list[float]]:
         pass
@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict
+from typing import Literal, Optional
+
+from horsona.autodiff.basic import HorseData
+from horsona.index.embedding_model import EmbeddingModel
+
+Kind = Literal["data", "query"]
+
+
+class EmbeddingCache(HorseData):
+    """
+    A persistent store for embeddings.
+
+    Embeddings are stored in a SQLite database keyed by the embedding model and
+    a hash of the text. The least recently used entries are evicted once the
+    cache holds more than max_entries.
+
+    Attributes:
+        path (str): Path to the SQLite database file
+        max_entries (int | None): Maximum number of entries, or None for no limit
+    """
+
+    def __init__(
+        self,
+        path: str = "embedding_cache.sqlite",
+        max_entries: Optional[int] = 100000,
+    ) -> None:
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, "
+            "accessed REAL NOT NULL, "
+            "PRIMARY KEY (model, key))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)"
+        )
+        self.connection.commit()
+
+    def get_many(self, model: str, keys: list[str]) -> dict[str, list[float]]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            model: Embedding model key
+            keys: Text keys
+
+        Returns:
+            dict[str, list[float]]: The embedding of each key that is cached
+        """
+        if not keys:
+            return {}
+
+        found = {}
+        # Stay under SQLite's limit on query parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, embedding FROM embeddings "
+                f"WHERE model = ? AND key IN ({placeholders})",
+                (model, *chunk),
+            ).fetchall()
+            for key, embedding in rows:
+                found[key] = array("d", embedding).tolist()
+
+        if found:
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE embeddings SET accessed = ? WHERE model = ? AND key = ?",
+                [(now, model, key) for key in found],
+            )
+            self.connection.commit()
+        return found
+
+    def put_many(self, model: str, embeddings: dict[str, list[float]]) -> None:
+        """
+        Store embeddings, evicting the least recently used entries if needed.
+
+        Args:
+            model: Embedding model key
+            embeddings: Embedding of each text key
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, key, embedding, accessed) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (model, key, array("d", embedding).tobytes(), now)
+                for key, embedding in embeddings.items()
+            ],
+        )
+
+        if self.max_entries is not None:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM embeddings ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+        self.connection.commit()
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self.connection.execute("DELETE FROM embeddings")
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+
+class _Batcher:
+    """Requests waiting to be sent to the embedding model."""
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self) -> None:
+        """Start over if the running event loop changed."""
+        # Futures and semaphores belong to one event loop
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Futures for texts that are waiting or being embedded, by kind and key
+        self.futures: dict[Kind, dict[str, asyncio.Future]] = {
+            "data": {},
+            "query": {},
+        }
+        # Texts waiting for the next batch, by kind and key
+        self.pending: dict[Kind, dict[str, str]] = {"data": {}, "query": {}}
+        self.flush_handles: dict[Kind, Optional[asyncio.TimerHandle]] = {
+            "data": None,
+            "query": None,
+        }
+        self.tasks: set[asyncio.Task] = set()
+
+
+class EmbeddingService(EmbeddingModel):
+    """
+    An embedding model that batches and caches requests to another model.
+
+    Requests that arrive within batch_window seconds of each other are sent to
+    the underlying model as one call, with duplicate texts sent once. Embeddings
+    are kept in an in-memory LRU of memory_entries texts and, if a cache is
+    given, on disk. At most max_concurrency calls to the underlying model run
+    at once.
+
+    Attributes:
+        underlying_model (EmbeddingModel): The model used on cache misses
+        cache (EmbeddingCache | None): Storage for embeddings on disk
+        batch_window (float): Seconds to wait for more requests before sending
+            a batch
+        max_batch_size (int): Maximum number of texts per call
+        max_concurrency (int): Maximum number of concurrent calls
+        memory_entries (int): Number of embeddings kept in memory
+    """
+
+    def __init__(
+        self,
+        underlying_model: EmbeddingModel,
+        cache: Optional[EmbeddingCache] = None,
+        batch_window: float = 0.005,
+        max_batch_size: int = 256,
+        max_concurrency: int = 4,
+        memory_entries: int = 4096,
+        name: Optional[str] = None,
+    ) -> None:
+        super().__init__(name=name)
+        if cache is not None and underlying_model.cache_key() is None:
+            raise ValueError(
+                f"Cannot cache embeddings of a {type(underlying_model).__name__} "
+                "without a model or name to identify it by"
+            )
+        self.underlying_model = underlying_model
+        self.cache = cache
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.memory_entries = memory_entries
+
+        self._memory = _LRU(memory_entries)
+        self._batcher = _Batcher(max_concurrency)
+
+    def cache_key(self) -> Optional[str]:
+        return self.underlying_model.cache_key()
+
+    async def get_data_embeddings(self, sentences: list[str]) -> list[list[float]]:
+        return await self._embed("data", sentences)
+
+    async def get_query_embeddings(self, sentences: list[str]) -> list[list[float]]:
+        return await self._embed("query", sentences)
+
+    async def _embed(self, kind: Kind, sentences: list[str]) -> list[list[float]]:
+        keys = [self._key(kind, sentence) for sentence in sentences]
+        found = {}
+        missing = {}
+        for key, sentence in zip(keys, sentences):
+            if key in found or key in missing:
+                continue
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                found[key] = embedding
+            else:
+                missing[key] = sentence
+
+        if missing and self.cache is not None:
+            cached = self.cache.get_many(self._model_key(), list(missing))
+            for key, embedding in cached.items():
+                self._memory.put(key, embedding)
+                found[key] = embedding
+                del missing[key]
+
+        if missing:
+            futures = self._request(kind, missing)
+            embeddings = await asyncio.gather(*futures.values())
+            found.update(zip(futures.keys(), embeddings))
+
+        return [found[key] for key in keys]
+
+    def _key(self, kind: Kind, sentence: str) -> str:
+        digest = hashlib.sha256(sentence.encode("utf-8")).hexdigest()
+        return f"{kind}:{digest}"
+
+    def _model_key(self) -> str:
+        return self.underlying_model.cache_key()
+
+    def _request(
+        self, kind: Kind, sentences: dict[str, str]
+    ) -> dict[str, asyncio.Future]:
+        batcher = self._batcher
+        batcher.bind()
+        futures = batcher.futures[kind]
+        pending = batcher.pending[kind]
+
+        result = {}
+        for key, sentence in sentences.items():
+            # Texts that are already waiting or being embedded are only sent once
+            if key not in futures:
+                futures[key] = batcher.loop.create_future()
+                pending[key] = sentence
+            result[key] = futures[key]
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(batcher, kind)
+        elif pending and batcher.flush_handles[kind] is None:
+            batcher.flush_handles[kind] = batcher.loop.call_later(
+                self.batch_window, self._flush, batcher, kind
+            )
+
+        return result
+
+    def _flush(self, batcher: _Batcher, kind: Kind) -> None:
+        handle = batcher.flush_handles[kind]
+        if handle is not None:
+            handle.cancel()
+            batcher.flush_handles[kind] = None
+
+        pending = list(batcher.pending[kind].items())
+        batcher.pending[kind].clear()
+        for i in range(0, len(pending), self.max_batch_size):
+            task = batcher.loop.create_task(
+                self._send(batcher, kind, dict(pending[i : i + self.max_batch_size]))
+            )
+            batcher.tasks.add(task)
+            task.add_done_callback(batcher.tasks.discard)
+
+    async def _send(self, batcher: _Batcher, kind: Kind, batch: dict[str, str]) -> None:
+        futures = batcher.futures[kind]
+        try:
+            async with batcher.semaphore:
+                if kind == "data":
+                    embeddings = await self.underlying_model.get_data_embeddings(
+                        list(batch.values())
+                    )
+                else:
+                    embeddings = await self.underlying_model.get_query_embeddings(
+                        list(batch.values())
+                    )
+            embeddings = dict(zip(batch.keys(), embeddings))
+
+            for key, embedding in embeddings.items():
+                self._memory.put(key, embedding)
+            if self.cache is not None:
+                self.cache.put_many(self._model_key(), embeddings)
+        except BaseException as e:
+            for key in batch:
+                future = futures.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for key, embedding in embeddings.items():
+            future = futures.pop(key)
+            if not future.done():
+                future.set_result(embedding)
+
+
+class _LRU:
+    """An in-memory least-recently-used map from keys to embeddings."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, list[float]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[list[float]]:
+        embedding = self.entries.get(key)
+        if embedding is not None:
+            self.entries.move_to_end(key)
+        return embedding
+
+    def put(self, key: str, embedding: list[float]) -> None:
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -1,6 +1,8 @@
+import json
 import os
 import tempfile
-from typing import Type
+import uuid
+from typing import Optional, Type
 
 import hnswlib
 
@@ -8,8 +10,37 @@ from horsona.autodiff.basic import state_dict
 from horsona.index.embedding_index import EmbeddingIndex
 from horsona.index.embedding_model import EmbeddingModel
 
+METADATA_FILE = "metadata.json"
+
+# Fields saved in the metadata file of a persist_dir
+PERSISTED_FIELDS = (
+    "index_size",
+    "index_to_value",
+    "value_to_index",
+    "indices",
+    "deleted_indices",
+    "next_index",
+    "space",
+    "dim",
+    "ef_construction",
+)
+
 
 class HnswEmbeddingIndex(EmbeddingIndex):
+    """
+    An embedding index backed by hnswlib.
+
+    By default the whole index is embedded in its state_dict. For large
+    indexes, set persist_dir instead: taking the state_dict then saves the
+    index to that directory, uncompressed, and the state_dict only refers to
+    it. Creating an index with a persist_dir that holds a saved index loads it.
+
+    Attributes:
+        model (EmbeddingModel): Embedding model for values and queries
+        num_threads (int): Threads for batched queries, or -1 to use every core
+        persist_dir (str | None): Directory the index is saved in
+    """
+
     def __init__(
         self,
         model: EmbeddingModel,
@@ -23,6 +54,8 @@ class HnswEmbeddingIndex(EmbeddingIndex):
         space: str = None,
         dim: int = None,
         ef_construction: int = None,
+        num_threads: int = -1,
+        persist_dir: Optional[str] = None,
         **kwargs,
     ) -> None:
         super().__init__(**kwargs)
@@ -46,8 +79,23 @@ class HnswEmbeddingIndex(EmbeddingIndex):
         self.dim = dim or None
         self.embeddings = embeddings
         self.ef_construction = ef_construction or 200
+        self.num_threads = num_threads
+        self.persist_dir = persist_dir
+        self._changes = _Changes()
+
+        if persist_dir is not None and os.path.exists(
+            os.path.join(persist_dir, METADATA_FILE)
+        ):
+            self._load_dir()
 
     def state_dict(self) -> dict:
+        if self.persist_dir is not None:
+            # The index lives in persist_dir, so only keep the reference
+            self.save()
+            return super().state_dict(
+                **{field: None for field in PERSISTED_FIELDS}, embeddings=None
+            )
+
         if self.embeddings is None:
             return super().state_dict()
 
@@ -103,6 +151,81 @@ class HnswEmbeddingIndex(EmbeddingIndex):
             debug_prefix=debug_prefix,
         )
 
+    def save(self) -> None:
+        """
+        Save the index to persist_dir.
+
+        The hnswlib index is written straight to a new file next to the
+        metadata, and the metadata is then swapped in with an atomic rename.
+        Readers and crashes only ever see a complete save.
+        """
+        if self.persist_dir is None:
+            raise ValueError("Cannot save an HnswEmbeddingIndex without persist_dir")
+
+        # Skip the save if the directory already holds this version
+        if self._changes.saved == (self.persist_dir, self._changes.version):
+            if os.path.exists(os.path.join(self.persist_dir, METADATA_FILE)):
+                return
+
+        os.makedirs(self.persist_dir, exist_ok=True)
+        save_id = uuid.uuid4().hex
+
+        index_file = None
+        if self.embeddings is not None:
+            index_file = f"index-{save_id}.bin"
+        index_path = os.path.join(self.persist_dir, f"index-{save_id}.bin")
+        metadata_path = os.path.join(self.persist_dir, METADATA_FILE)
+        temp_path = f"{metadata_path}.{save_id}.tmp"
+
+        metadata = {field: getattr(self, field) for field in PERSISTED_FIELDS}
+        metadata["deleted_indices"] = sorted(self.deleted_indices)
+        metadata["index_file"] = index_file
+
+        try:
+            if index_file is not None:
+                self.embeddings.save_index(index_path)
+                _fsync(index_path)
+
+            with open(temp_path, "w") as f:
+                json.dump(metadata, f)
+            _fsync(temp_path)
+            os.replace(temp_path, metadata_path)
+        except BaseException:
+            # The previous save is still intact
+            for path in (index_path, temp_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+        _fsync(self.persist_dir)
+        self._changes.saved = (self.persist_dir, self._changes.version)
+
+        # Remove index files from earlier saves
+        for filename in os.listdir(self.persist_dir):
+            if filename.startswith("index-") and filename != index_file:
+                os.unlink(os.path.join(self.persist_dir, filename))
+
+    def _load_dir(self) -> None:
+        with open(os.path.join(self.persist_dir, METADATA_FILE)) as f:
+            metadata = json.load(f)
+
+        self.index_to_value = {int(k): v for k, v in metadata["index_to_value"].items()}
+        self.value_to_index = {k: int(v) for k, v in metadata["value_to_index"].items()}
+        self.deleted_indices = set(metadata["deleted_indices"])
+        for field in PERSISTED_FIELDS:
+            if field not in ("index_to_value", "value_to_index", "deleted_indices"):
+                setattr(self, field, metadata[field])
+
+        self.embeddings = None
+        if metadata["index_file"] is not None:
+            # hnswlib reads the file directly into the index
+            self.embeddings = hnswlib.Index(space=self.space, dim=self.dim)
+            self.embeddings.load_index(
+                os.path.join(self.persist_dir, metadata["index_file"]),
+                max_elements=self.index_size,
+                allow_replace_deleted=True,
+            )
+        self._changes.saved = (self.persist_dir, self._changes.version)
+
     def _ensure_capacity(self, example_embeddings: list) -> None:
         self.dim = len(example_embeddings[0])
         num_elements = len(example_embeddings) + len(self.index_to_value)
@@ -124,29 +247,51 @@ class HnswEmbeddingIndex(EmbeddingIndex):
     async def query_with_weights(
         self, query: str, topk: int
     ) -> dict[str, tuple[str, float]]:
-        if self.embeddings is None:
-            return {}
+        return (await self.query_many_with_weights([query], topk))[0]
 
-        if not query:
-            return {}
+    async def query_many_with_weights(
+        self, queries: list[str], topk: int
+    ) -> list[dict[str, tuple[str, float]]]:
+        results = [{} for _ in queries]
+        if self.embeddings is None:
+            return results
 
         if topk == 0:
-            return {}
+            return results
 
-        if len(self.index_to_value) == 0:
-            return {}
+        # Deleted values stay in index_to_value but can't be returned
+        live = len(self.index_to_value) - len(self.deleted_indices)
+        if live <= 0:
+            return results
 
-        if topk > len(self.index_to_value):
-            topk = len(self.index_to_value)
+        if topk > live:
+            topk = live
 
-        ef = max(min(topk * 10, self.ef_construction), len(self.index_to_value))
+        # Empty queries have no results
+        positions = [i for i, query in enumerate(queries) if query]
+        if not positions:
+            return results
+
+        query_embs = await self.model.get_query_embeddings(
+            [queries[i] for i in positions]
+        )
+
+        # Set ef after the await since concurrent queries may set their own.
+        # ef must be at least topk, and past ef_construction the extra search
+        # effort barely improves recall.
+        ef = max(topk, min(topk * 10, self.ef_construction))
         self.embeddings.set_ef(ef)
+        indices, distances = self.embeddings.knn_query(
+            query_embs, k=topk, num_threads=self.num_threads
+        )
 
-        query_emb = await self.model.get_query_embeddings([query])
-        indices, distances = self.embeddings.knn_query(query_emb, k=topk)
-        values = [self.index_to_value[i] for i in indices[0].tolist()]
+        for i, row_indices, row_distances in zip(
+            positions, indices.tolist(), distances.tolist()
+        ):
+            values = [self.index_to_value[j] for j in row_indices]
+            results[i] = dict(zip(row_indices, zip(values, row_distances)))
 
-        return dict(zip(indices[0].tolist(), zip(values, distances[0].tolist())))
+        return results
 
     async def extend(self, data: list[str]) -> None:
         if not data:
@@ -176,6 +321,7 @@ class HnswEmbeddingIndex(EmbeddingIndex):
             new_indices,
             replace_deleted=True,
         )
+        self._changes.version += 1
 
     async def delete(self, indices: list[int | str] = []) -> list[str]:
         if not indices:
@@ -197,4 +343,27 @@ class HnswEmbeddingIndex(EmbeddingIndex):
                 self.deleted_indices.add(index)
                 deleted_values.append(value)
 
+        if deleted_values:
+            self._changes.version += 1
         return deleted_values
+
+
+class _Changes:
+    """Tracks whether an index changed since it was saved to its persist_dir."""
+
+    def __init__(self) -> None:
+        # Incremented by every change to the index
+        self.version = 0
+        # persist_dir and version of the last save
+        self.saved: Optional[tuple[str, int]] = None
+
+
+def _fsync(path: str) -> None:
+    # Directories can only be opened for fsync on POSIX systems
+    if os.path.isdir(path) and os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,197 @@
+from typing import Optional
+
+import numpy as np
+
+from horsona.index.embedding_index import EmbeddingIndex
+from horsona.index.embedding_model import EmbeddingModel
+
+
+class NumpyEmbeddingIndex(EmbeddingIndex):
+    """
+    An exact embedding index that compares queries against every vector.
+
+    Embeddings are kept in one contiguous float32 matrix, with rows normalized
+    up front for cosine similarity. A batch of queries is searched with a
+    single matrix multiply and a partial sort. Results are exact and there is
+    no graph to build, so adding values is much faster than with
+    HnswEmbeddingIndex. Query time grows with the size of the index, so this
+    suits indexes up to around 100k vectors.
+
+    Deleted rows are masked out and reused when their value is added again.
+    The matrix doubles in size when it runs out of rows.
+
+    Attributes:
+        model (EmbeddingModel): Embedding model for values and queries
+        space (str): "cosine" for cosine distance, or "ip" for inner product
+            distance, as in hnswlib
+        index_to_value (dict[int, str]): Value of each row
+        value_to_index (dict[str, int]): Row of each value
+        deleted_indices (set[int]): Rows of deleted values
+        next_index (int): Number of rows in use
+        dim (int | None): Embedding dimension, or None before the first value
+    """
+
+    def __init__(
+        self,
+        model: EmbeddingModel,
+        space: str = "cosine",
+        index_to_value: dict = None,
+        value_to_index: dict = None,
+        deleted_indices: set = None,
+        next_index: int = 0,
+        dim: Optional[int] = None,
+        embeddings: bytes | np.ndarray = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        if space not in ("cosine", "ip"):
+            raise ValueError(f"Unsupported space for NumpyEmbeddingIndex: {space}")
+
+        self.model = model
+        self.space = space
+        self.index_to_value = {int(k): v for k, v in (index_to_value or {}).items()}
+        self.value_to_index = {k: int(v) for k, v in (value_to_index or {}).items()}
+        self.deleted_indices = set(deleted_indices or [])
+        self.next_index = next_index
+        self.dim = dim
+
+        if isinstance(embeddings, bytes) and next_index > 0:
+            embeddings = np.frombuffer(embeddings, dtype=np.float32).reshape(
+                next_index, dim
+            )
+        if embeddings is None or isinstance(embeddings, bytes):
+            self.embeddings = np.zeros((0, dim or 0), dtype=np.float32)
+        else:
+            self.embeddings = np.array(embeddings, dtype=np.float32)
+
+        # Rows that hold a value that isn't deleted
+        self.mask = np.zeros(len(self.embeddings), dtype=bool)
+        self.mask[: self.next_index] = True
+        self.mask[list(self.deleted_indices)] = False
+
+    def state_dict(self) -> dict:
+        # Only the rows in use are saved. The mask isn't saved since it's
+        # rebuilt from deleted_indices.
+        return super().state_dict(
+            embeddings=self.embeddings[: self.next_index].tobytes()
+        )
+
+    async def query_with_weights(
+        self, query: str, topk: int
+    ) -> dict[str, tuple[str, float]]:
+        return (await self.query_many_with_weights([query], topk))[0]
+
+    async def query_many_with_weights(
+        self, queries: list[str], topk: int
+    ) -> list[dict[str, tuple[str, float]]]:
+        results = [{} for _ in queries]
+        if topk == 0 or len(self.index_to_value) <= len(self.deleted_indices):
+            return results
+
+        # Empty queries have no results
+        positions = [i for i, query in enumerate(queries) if query]
+        if not positions:
+            return results
+
+        query_embs = self._normalize(
+            await self.model.get_query_embeddings([queries[i] for i in positions])
+        )
+
+        # Read the index after the await since concurrent calls may change it
+        live = len(self.index_to_value) - len(self.deleted_indices)
+        if live <= 0:
+            return results
+        topk = min(topk, live)
+        rows = self.next_index
+        similarities = query_embs @ self.embeddings[:rows].T
+        similarities[:, ~self.mask[:rows]] = -np.inf
+
+        # Find the topk rows of each query without sorting all of them
+        if topk < rows:
+            top = np.argpartition(similarities, rows - topk, axis=1)[:, rows - topk :]
+        else:
+            top = np.broadcast_to(np.arange(rows), (len(positions), rows))
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        distances = 1.0 - np.take_along_axis(top_similarities, order, axis=1)
+
+        for i, row_indices, row_distances in zip(
+            positions, top.tolist(), distances.tolist()
+        ):
+            values = [self.index_to_value[j] for j in row_indices]
+            results[i] = dict(zip(row_indices, zip(values, row_distances)))
+
+        return results
+
+    async def extend(self, data: list[str]) -> None:
+        if not data:
+            return
+
+        new_embeddings = self._normalize(await self.model.get_data_embeddings(data))
+
+        # Assign rows after the await, so queries that run in the meantime
+        # never see rows without an embedding and a value
+        new_indices = []
+        for value in data:
+            if value in self.value_to_index:
+                new_indices.append(self.value_to_index[value])
+            else:
+                self.value_to_index[value] = self.next_index
+                new_indices.append(self.next_index)
+                self.next_index += 1
+        self._ensure_capacity(new_embeddings.shape[1])
+
+        self.embeddings[new_indices] = new_embeddings
+        self.mask[new_indices] = True
+        self.index_to_value.update(dict(zip(new_indices, data)))
+        self.value_to_index.update(dict(zip(data, new_indices)))
+        self.deleted_indices.difference_update(new_indices)
+
+    async def delete(self, indices: list[int | str] = []) -> list[str]:
+        deleted_values = []
+        for value in indices:
+            if isinstance(value, int):
+                index = value
+            elif value in self.value_to_index:
+                index = self.value_to_index[value]
+            else:
+                continue
+
+            if index not in self.index_to_value or index in self.deleted_indices:
+                continue
+            self.mask[index] = False
+            self.deleted_indices.add(index)
+            deleted_values.append(self.index_to_value[index])
+
+        return deleted_values
+
+    def _normalize(self, embeddings: list[list[float]]) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.space == "cosine":
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        return embeddings
+
+    def _ensure_capacity(self, dim: int) -> None:
+        if self.dim is None or len(self.embeddings) == 0:
+            self.dim = dim
+        elif dim != self.dim:
+            raise ValueError(f"Expected embeddings of size {self.dim}, got {dim}")
+
+        capacity = len(self.embeddings)
+        if self.next_index <= capacity:
+            return
+
+        # Double the matrix so adding n vectors costs O(n) copies overall
+        new_capacity = max(1024, capacity)
+        while new_capacity < self.next_index:
+            new_capacity *= 2
+
+        embeddings = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        mask = np.zeros(new_capacity, dtype=bool)
+        if capacity > 0:
+            embeddings[:capacity] = self.embeddings
+            mask[:capacity] = self.mask
+        self.embeddings = embeddings
+        self.mask = mask
@@ -1,7 +1,9 @@
+import os
 from typing import List, Optional
 
 from ollama import AsyncClient
 
+from horsona.http.pool import get_http_transport
 from horsona.index.embedding_model import EmbeddingModel
 
 
@@ -12,10 +14,15 @@ class OllamaEmbeddingModel(EmbeddingModel):
         super().__init__(name=name)
         self.model = model
         self.url = url
+        self.client = AsyncClient(host=url, transport=get_http_transport())
+
+    def cache_key(self) -> Optional[str]:
+        # Without a url, the client uses OLLAMA_HOST or the local server
+        host = self.url or os.environ.get("OLLAMA_HOST") or "localhost"
+        return f"{super().cache_key()}@{host}"
 
     async def get_data_embeddings(self, sentences: List[str]) -> List[List[float]]:
-        client = AsyncClient(host=self.url)
-        response = await client.embed(model=self.model, input=sentences)
+        response = await self.client.embed(model=self.model, input=sentences)
         return response["embeddings"]
 
     async def get_query_embeddings(self, sentences: List[str]) -> List[List[float]]:
@@ -2,6 +2,7 @@ from typing import Any, List, Optional
 
 from openai import AsyncOpenAI
 
+from horsona.http.pool import get_http_client
 from horsona.index.embedding_model import EmbeddingModel
 
 
@@ -10,10 +11,23 @@ class OpenAIEmbeddingModel(EmbeddingModel):
         super().__init__(name=name)
         self.model = model
         self.kwargs = kwargs
+        self.client = AsyncOpenAI(http_client=get_http_client(), **kwargs)
+
+    def cache_key(self) -> Optional[str]:
+        # Options like organization or project can change what the endpoint
+        # serves, but the api key is a secret and shouldn't land on disk
+        options = sorted(
+            (k, v)
+            for k, v in self.kwargs.items()
+            if isinstance(v, str) and k not in ("api_key", "base_url")
+        )
+        key = f"{super().cache_key()}@{self.client.base_url}"
+        return f"{key}{options}" if options else key
 
     async def get_data_embeddings(self, sentences: List[str]) -> List[List[float]]:
-        client = AsyncOpenAI(**self.kwargs)
-        response = await client.embeddings.create(model=self.model, input=sentences)
+        response = await self.client.embeddings.create(
+            model=self.model, input=sentences
+        )
         return [embedding.embedding for embedding in response.data]
 
     async def get_query_embeddings(self, sentences: List[str]) -> List[List[float]]:
@@ -1,7 +1,10 @@
 from fastapi import APIRouter
 
+from horsona.interface import metrics_api
+
 from . import node_graph_api
 
 api_router = APIRouter()
 
 api_router.include_router(node_graph_api.router)
+api_router.include_router(metrics_api.router)
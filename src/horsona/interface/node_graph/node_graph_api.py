@@ -15,6 +15,7 @@ from uuid import uuid4
 from fastapi import APIRouter, Body, FastAPI, HTTPException, Request, status
 
 from horsona.autodiff.basic import HorseData, HorseVariable
+from horsona.http.pool import close_http_clients
 
 from .node_graph_models import *
 
@@ -48,6 +49,7 @@ async def lifespan(app: FastAPI):
     await start_session_cleanup_task()
     yield
     await stop_session_cleanup_task()
+    await close_http_clients()
 
 
 router = APIRouter(prefix="/api", lifespan=lifespan)
@@ -1,77 +1,92 @@
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from horsona.http.pool import close_http_clients
 from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.limits import QueueFullException
+from horsona.llm.scheduler import Priority, request_priority
 
 from .oai_models import *
 
 llm_engines: dict[str, AsyncChatEngine] = {}
-router = APIRouter(prefix="/api")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_http_clients()
+
+
+router = APIRouter(prefix="/api", lifespan=lifespan)
 
 
 async def _get_streaming_response(engine: AsyncChatEngine, request_dict: dict):
     response: AsyncGenerator[str, None] = engine.query_stream(**request_dict)
 
     async def stream_response():
-        # First chunk should include role
-        i = 0
-        async for chunk in response:
-            # Add data: prefix and double newline suffix for SSE format
-            if i == 0:
-                yield (
-                    "data: "
-                    + ChatCompletionChunkResponse(
-                        id="chatcmpl-" + str(i),
-                        model=request_dict["model"],
-                        choices=[
-                            ChatCompletionChunkChoice(
-                                index=0,
-                                delta=DeltaMessage(role="assistant", content=chunk),
-                                finish_reason=None,
-                            )
-                        ],
-                    ).model_dump_json()
-                    + "\n\n"
-                )
-                i += 1
-            else:
-                yield (
-                    "data: "
-                    + ChatCompletionChunkResponse(
-                        id="chatcmpl-" + str(i),
-                        model=request_dict["model"],
-                        choices=[
-                            ChatCompletionChunkChoice(
-                                index=0,
-                                delta=DeltaMessage(content=chunk),
-                                finish_reason=None,
-                            )
-                        ],
-                    ).model_dump_json()
-                    + "\n\n"
-                )
-                i += 1
-
-        # Send final chunk with finish_reason
-        yield (
-            "data: "
-            + ChatCompletionChunkResponse(
-                id="chatcmpl-" + str(i + 1),
-                model=request_dict["model"],
-                choices=[
-                    ChatCompletionChunkChoice(
-                        index=0, delta=DeltaMessage(), finish_reason="stop"
+        # The response is generated after the handler returns, so the priority
+        # has to be set here rather than in the handler
+        with request_priority(Priority.INTERACTIVE, request_dict.get("user")):
+            # First chunk should include role
+            i = 0
+            async for chunk in response:
+                # Add data: prefix and double newline suffix for SSE format
+                if i == 0:
+                    yield (
+                        "data: "
+                        + ChatCompletionChunkResponse(
+                            id="chatcmpl-" + str(i),
+                            model=request_dict["model"],
+                            choices=[
+                                ChatCompletionChunkChoice(
+                                    index=0,
+                                    delta=DeltaMessage(role="assistant", content=chunk),
+                                    finish_reason=None,
+                                )
+                            ],
+                        ).model_dump_json()
+                        + "\n\n"
                     )
-                ],
-            ).model_dump_json()
-            + "\n\n"
-        )
-
-        # Send final [DONE] message
-        yield "data: [DONE]\n\n"
+                    i += 1
+                else:
+                    yield (
+                        "data: "
+                        + ChatCompletionChunkResponse(
+                            id="chatcmpl-" + str(i),
+                            model=request_dict["model"],
+                            choices=[
+                                ChatCompletionChunkChoice(
+                                    index=0,
+                                    delta=DeltaMessage(content=chunk),
+                                    finish_reason=None,
+                                )
+                            ],
+                        ).model_dump_json()
+                        + "\n\n"
+                    )
+                    i += 1
+
+            # Send final chunk with finish_reason
+            yield (
+                "data: "
+                + ChatCompletionChunkResponse(
+                    id="chatcmpl-" + str(i + 1),
+                    model=request_dict["model"],
+                    choices=[
+                        ChatCompletionChunkChoice(
+                            index=0, delta=DeltaMessage(), finish_reason="stop"
+                        )
+                    ],
+                ).model_dump_json()
+                + "\n\n"
+            )
+
+            # Send final [DONE] message
+            yield "data: [DONE]\n\n"
 
     return StreamingResponse(
         stream_response(),
@@ -85,7 +100,8 @@ async def _get_streaming_response(engine: AsyncChatEngine, request_dict: dict):
 
 async def _get_nonstreaming_response(engine: AsyncChatEngine, request_dict: dict):
     try:
-        response = await engine.query_response(**request_dict)
+        with request_priority(Priority.INTERACTIVE, request_dict.get("user")):
+            response = await engine.query_response(**request_dict)
 
         return ChatCompletionResponse(
             model=request_dict["model"],
@@ -105,6 +121,14 @@ async def _get_nonstreaming_response(engine: AsyncChatEngine, request_dict: dict
         raise e
 
 
+def _too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests are queued for this model",
+        headers={"Retry-After": str(int(retry_after))},
+    )
+
+
 @router.post("/v1/chat/completions")
 async def create_chat_completion(
     request: ChatCompletionRequest,
@@ -119,10 +143,16 @@ async def create_chat_completion(
     request_dict = request.model_dump(exclude_unset=True)
 
     try:
+        # Shed load up front when the engine's queue is full. Streams only
+        # start after this handler returns, so they can't report it later.
+        engine.check_capacity()
+
         if request.stream:
             return await _get_streaming_response(engine, request_dict)
         else:
             return await _get_nonstreaming_response(engine, request_dict)
+    except QueueFullException as e:
+        raise _too_many_requests(e.retry_after)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,9 +1,13 @@
-from typing import AsyncGenerator
+import json
+from typing import Any, AsyncGenerator, Optional, Type
 
 from anthropic import AsyncAnthropic
+from pydantic import BaseModel
 
+from horsona.http.pool import get_http_client
 from horsona.llm.base_engine import LLMMetrics, tracks_metrics
 from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.engine_utils import response_schema, schema_name
 
 
 class AsyncAnthropicEngine(AsyncChatEngine):
@@ -23,7 +27,7 @@ class AsyncAnthropicEngine(AsyncChatEngine):
     def __init__(self, model: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.model = model
-        self.client = AsyncAnthropic()
+        self.client = AsyncAnthropic(http_client=get_http_client())
 
     @tracks_metrics
     async def query(
@@ -49,9 +53,19 @@ class AsyncAnthropicEngine(AsyncChatEngine):
                 **kwargs,
             )
 
-            total_tokens = response.usage.input_tokens + response.usage.output_tokens
-            metrics.tokens_consumed = total_tokens
-            yield response.content[0].text
+            input_tokens, cached_tokens = _prompt_usage(response.usage)
+            metrics.tokens_consumed = input_tokens + response.usage.output_tokens
+            metrics.prompt_tokens = input_tokens
+            metrics.completion_tokens = response.usage.output_tokens
+            metrics.cached_tokens = cached_tokens
+            # Structured output arrives as the input of a forced tool call
+            tool_uses = [
+                block for block in response.content if block.type == "tool_use"
+            ]
+            if tool_uses:
+                yield json.dumps(tool_uses[0].input)
+            else:
+                yield response.content[0].text
         else:
             kwargs.pop("stream", None)
 
@@ -65,12 +79,21 @@ class AsyncAnthropicEngine(AsyncChatEngine):
                 system="\n\n".join(system_msg), **kwargs
             ) as stream:
                 async for chunk in stream:
+                    if chunk.type == "message_start":
+                        input_tokens, cached_tokens = _prompt_usage(chunk.message.usage)
+                        metrics.tokens_consumed = input_tokens + output_tokens
+                        metrics.prompt_tokens = input_tokens
+                        metrics.cached_tokens = cached_tokens
+
                     if hasattr(chunk, "usage"):
-                        if hasattr(chunk.usage, "input_tokens"):
-                            input_tokens = chunk.usage.input_tokens
+                        if getattr(chunk.usage, "input_tokens", None) is not None:
+                            input_tokens, cached_tokens = _prompt_usage(chunk.usage)
+                            metrics.cached_tokens = cached_tokens
                         if hasattr(chunk.usage, "output_tokens"):
                             output_tokens = chunk.usage.output_tokens
                         metrics.tokens_consumed = input_tokens + output_tokens
+                        metrics.prompt_tokens = input_tokens
+                        metrics.completion_tokens = output_tokens
 
                     if chunk.type not in ("content_block_start", "content_block_delta"):
                         continue
@@ -85,3 +108,49 @@ class AsyncAnthropicEngine(AsyncChatEngine):
                     if hasattr(chunk, "delta"):
                         if hasattr(chunk.delta, "text") and chunk.delta.text:
                             yield chunk.delta.text
+                        if (
+                            hasattr(chunk.delta, "partial_json")
+                            and chunk.delta.partial_json
+                        ):
+                            yield chunk.delta.partial_json
+
+    def user_prompt_message(self, prompt: str, stable_length: int) -> dict[str, Any]:
+        if not self.prompt_caching or not stable_length:
+            return super().user_prompt_message(prompt, stable_length)
+
+        # Anthropic only caches prefixes that end at a cache_control
+        # breakpoint, so the stable args get a text block of their own
+        content = [
+            {
+                "type": "text",
+                "text": prompt[:stable_length],
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+        if stable_length < len(prompt):
+            content.append({"type": "text", "text": prompt[stable_length:]})
+        return {"role": "user", "content": content}
+
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        # Anthropic has no JSON response format, so the model is made to call a
+        # tool whose input schema is the response model
+        name = schema_name(response_model)
+        return {
+            "tools": [
+                {
+                    "name": name,
+                    "description": "Respond with the requested object.",
+                    "input_schema": response_schema(response_model),
+                }
+            ],
+            "tool_choice": {"type": "tool", "name": name},
+        }
+
+
+def _prompt_usage(usage: Any) -> tuple[int, int]:
+    # input_tokens excludes tokens read from or written to the prompt cache
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return usage.input_tokens + cache_read + cache_write, cache_read
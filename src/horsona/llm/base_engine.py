@@ -2,22 +2,60 @@ import asyncio
 import functools
 import time
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Any, AsyncGenerator, Callable, Optional, Type, TypeVar, Union
+from contextlib import aclosing
+from dataclasses import dataclass, fields
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Generic,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from pydantic import BaseModel
 
 from horsona.autodiff.basic import HorseData
 from horsona.config import llms, load_llms
-from horsona.llm.limits import CallLimit, TokenLimit
+from horsona.llm.limit_backends import LimitBackend, default_limit_backend
+from horsona.llm.limits import (
+    CallLimit,
+    ConcurrencyLimit,
+    TokenBucket,
+    TokenLimit,
+    sleep_until,
+)
+from horsona.llm.scheduler import RequestScheduler
+from horsona.llm.telemetry import EngineTelemetry, RequestRecord
+from horsona.llm.token_estimator import (
+    CharsPerTokenEstimator,
+    TokenEstimator,
+    messages_text,
+)
 
 T = TypeVar("T", bound=BaseModel)
 S = TypeVar("S", bound=Union[str, T])
+R = TypeVar("R")
+
+# Default number of batch requests in flight at once when a batch runs as
+# individual calls. The engine's rate limits still apply to every call.
+BATCH_CONCURRENCY = 16
 
 
 class RateLimits(HorseData):
     """
     Manages both call-based and token-based rate limits.
+
+    Each entry of limits sets an interval in seconds and the max_calls and
+    max_tokens allowed per interval. Limits are token buckets, so a full
+    interval's worth of calls or tokens can be used in a burst. Set
+    burst_calls or burst_tokens on an entry to allow smaller bursts.
+
+    With a key and a backend, the limits are stored in the backend, shared
+    with every RateLimits that has the same key.
     """
 
     def __init__(
@@ -25,8 +63,13 @@ class RateLimits(HorseData):
         limits: list[dict[str, float]],
         call_limits: Optional[list[CallLimit]] = None,
         token_limits: Optional[list[TokenLimit]] = None,
+        key: Optional[str] = None,
+        backend: Optional[LimitBackend] = None,
+        clock: Callable[[], float] = time.time,
     ) -> None:
         self.limits = limits
+        self.key = key
+        self.clock = clock
         self.call_limits: list[CallLimit] = []
         self.token_limits: list[TokenLimit] = []
 
@@ -36,46 +79,84 @@ class RateLimits(HorseData):
             calls = rate_limit.get("max_calls")
             tokens = rate_limit.get("max_tokens")
             if calls is not None:
-                self.call_limits.append(CallLimit(calls, interval))
+                self.call_limits.append(
+                    CallLimit(
+                        calls,
+                        interval,
+                        rate_limit.get("burst_calls"),
+                        key=_limit_key(key, interval, "calls"),
+                        backend=backend,
+                        clock=clock,
+                    )
+                )
             if tokens is not None:
-                self.token_limits.append(TokenLimit(tokens, interval))
+                self.token_limits.append(
+                    TokenLimit(
+                        tokens,
+                        interval,
+                        rate_limit.get("burst_tokens"),
+                        key=_limit_key(key, interval, "tokens"),
+                        backend=backend,
+                        clock=clock,
+                    )
+                )
 
     async def consume_call(self) -> None:
         """Record consumption of one API call across all limits."""
-        await asyncio.gather(*[limit.consume() for limit in self.call_limits])
+        await sleep_until(_reserve_all(self.call_limits, 1, self.clock), self.clock)
 
     def report_tokens_consumed(self, count: int) -> None:
         """Record token consumption across all limits."""
         for limit in self.token_limits:
             limit.report_consumed(count)
 
+    async def reserve_tokens(self, count: int) -> None:
+        """
+        Wait until the token limits allow count tokens, then record them as consumed.
+        Reservations are reconciled later by reporting the difference between the
+        actual and reserved counts.
+        """
+        # Taking the tokens before sleeping holds this caller's place in line
+        await sleep_until(
+            _reserve_all(self.token_limits, count, self.clock), self.clock
+        )
+
     async def wait_for(self, expected_tokens: Optional[int] = None) -> None:
         """Wait until both call and token consumption is allowed."""
-        await asyncio.gather(
-            *[limit.wait_for() for limit in self.call_limits],
-            *[limit.wait_for(expected_tokens) for limit in self.token_limits],
-        )
+        await sleep_until(self.next_allowed(expected_tokens), self.clock)
 
     def next_allowed(self, expected_tokens: Optional[int] = None) -> float:
         """Return timestamp when both call and token consumption will be allowed."""
-        if self.call_limits:
-            next_call = max(limit.next_allowed() for limit in self.call_limits)
-        else:
-            next_call = time.time()
-
+        next_call = max(
+            (limit.next_allowed() for limit in self.call_limits), default=self.clock()
+        )
         if not expected_tokens:
             return next_call
 
-        if self.token_limits:
-            next_token = max(
-                limit.next_allowed(expected_tokens) for limit in self.token_limits
-            )
-        else:
-            next_token = time.time()
-
+        next_token = max(
+            (limit.next_allowed(expected_tokens) for limit in self.token_limits),
+            default=self.clock(),
+        )
         return max(next_call, next_token)
 
 
+def _limit_key(key: Optional[str], interval: float, unit: str) -> Optional[str]:
+    if key is None:
+        return None
+    return f"{key}:{interval:g}s:{unit}"
+
+
+def _reserve_all(
+    limits: list[TokenBucket], count: int, clock: Callable[[], float]
+) -> float:
+    # Reserve the same moment in every limit, so the ones with capacity to spare
+    # don't give away a slot the call can't use yet. Limits shared through a
+    # backend may be taken by another client after next_allowed is read, so
+    # wait for the latest time any of them actually granted.
+    at = max((limit.next_allowed(count) for limit in limits), default=clock())
+    return max((limit.reserve(count, at) for limit in limits), default=at)
+
+
 class TokenLimitException(Exception):
     """Raised when token rate limits are exceeded."""
 
@@ -90,17 +171,114 @@ class CallLimitException(Exception):
 
 @dataclass
 class LLMMetrics:
-    """Tracks metrics for LLM API usage."""
+    """
+    Tracks metrics for LLM API usage.
+
+    Durations are in seconds and, like the token counts, are summed over every
+    call made with the same metrics object.
+    """
 
     tokens_consumed: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    time_to_first_token: float = 0.0
+    latency: float = 0.0
+    rate_limit_wait: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    tokens_saved: int = 0
+
+    def add(self, other: "LLMMetrics") -> None:
+        """Add every count and duration of other to this object."""
+        for field in fields(self):
+            setattr(
+                self, field.name, getattr(self, field.name) + getattr(other, field.name)
+            )
+
+
+@dataclass
+class BatchResult(Generic[R]):
+    """
+    Outcome of one request in a batch.
+
+    Attributes:
+        value (Optional[R]): The response, if the request succeeded
+        error (Optional[Exception]): The exception, if the request failed
+    """
+
+    value: Optional[R] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def unwrap(self) -> R:
+        """
+        Get the response.
+
+        Raises:
+            Exception: The request's error, if it failed
+        """
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+async def run_batch(
+    fn: Callable[[dict[str, Any]], Awaitable[R]],
+    requests: list[dict[str, Any]],
+    max_concurrency: int = BATCH_CONCURRENCY,
+) -> list[BatchResult[R]]:
+    """
+    Call fn with each request's kwargs, at most max_concurrency at a time.
+
+    Args:
+        fn: Function that makes one call
+        requests: Keyword arguments for each call
+        max_concurrency: Maximum number of calls in flight
+
+    Returns:
+        list[BatchResult[R]]: Results in the same order as requests. Exceptions
+            are caught and returned per request.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(kwargs: dict[str, Any]) -> BatchResult[R]:
+        async with semaphore:
+            try:
+                return BatchResult(value=await fn(kwargs))
+            except Exception as e:
+                return BatchResult(error=e)
+
+    return await asyncio.gather(*[run(kwargs) for kwargs in requests])
 
 
 def tracks_metrics(
     fn: Callable[..., AsyncGenerator[str, None]],
 ) -> Callable[..., AsyncGenerator[str, None]]:
     """
-    Decorator that tracks token consumption metrics for LLM API calls.
-    Updates both the rate limiter and optional metrics object.
+    Decorator that enforces rate limits and tracks token consumption for LLM API
+    calls.
+
+    Before the call, it waits for one of the engine's concurrency slots, which
+    it holds until the call finishes. Then the engine's scheduler admits it in
+    priority order, consuming one call from the call limits and reserving the
+    estimated prompt tokens against the token limits. Usage beyond the
+    reservation is reported to the rate limiter as it arrives, and any unused
+    reservation is returned once the call finishes. The optional metrics object
+    is updated with the actual usage, and the call is recorded in the engine's
+    telemetry.
+
+    The wrapped function should set tokens_consumed and prompt_tokens on the
+    metrics it receives. It may also set completion_tokens; otherwise completion
+    tokens are taken to be the non-prompt part of tokens_consumed. Prompt tokens
+    the provider read from its prompt cache go in cached_tokens; they are also
+    counted in prompt_tokens.
     """
 
     @functools.wraps(fn)
@@ -109,13 +287,75 @@ def tracks_metrics(
     ) -> AsyncGenerator[str, None]:
         orig_metrics = kwargs.pop("metrics", None)
         new_metrics = LLMMetrics()
+        record = RequestRecord(engine=self.telemetry.engine, timestamp=time.time())
+        start = time.perf_counter()
 
-        async for chunk in fn(self, *args, metrics=new_metrics, **kwargs):
-            new_consumed = new_metrics.tokens_consumed - new_metrics.tokens_consumed
-            self.rate_limit.report_tokens_consumed(new_consumed)
+        prompt_text = messages_text(kwargs.get("messages", []))
+        expected_tokens = self.token_estimator.estimate_messages(
+            kwargs.get("messages", [])
+        )
+        slot = await self.concurrency.acquire()
+        try:
+            await self.scheduler.admit(expected_tokens)
+        except BaseException:
+            self.concurrency.release(slot)
+            raise
+        sent = time.perf_counter()
+        record.rate_limit_wait = sent - start
+
+        consumed = 0
+        reported = expected_tokens
+
+        def update_consumption() -> None:
+            nonlocal consumed, reported
             if orig_metrics is not None:
-                orig_metrics.tokens_consumed += new_consumed
-            yield chunk
+                orig_metrics.tokens_consumed += new_metrics.tokens_consumed - consumed
+            consumed = new_metrics.tokens_consumed
+
+            if consumed > reported:
+                self.rate_limit.report_tokens_consumed(consumed - reported)
+                reported = consumed
+
+        try:
+            async with aclosing(
+                fn(self, *args, metrics=new_metrics, **kwargs)
+            ) as stream:
+                async for chunk in stream:
+                    if record.time_to_first_token is None:
+                        record.time_to_first_token = time.perf_counter() - sent
+                    update_consumption()
+                    yield chunk
+        except Exception as e:
+            record.error = type(e).__name__
+            raise
+        finally:
+            self.concurrency.release(slot)
+            update_consumption()
+
+            # Return whatever part of the reservation went unused
+            if reported > consumed:
+                self.rate_limit.report_tokens_consumed(consumed - reported)
+
+            if new_metrics.prompt_tokens:
+                self.token_estimator.calibrate(prompt_text, new_metrics.prompt_tokens)
+
+            record.prompt_tokens = new_metrics.prompt_tokens
+            record.cached_tokens = new_metrics.cached_tokens
+            record.completion_tokens = new_metrics.completion_tokens or max(
+                consumed - new_metrics.prompt_tokens, 0
+            )
+            record.latency = time.perf_counter() - start
+            self.telemetry.record(record)
+
+            if orig_metrics is not None:
+                orig_metrics.prompt_tokens += record.prompt_tokens
+                orig_metrics.completion_tokens += record.completion_tokens
+                orig_metrics.cached_tokens += record.cached_tokens
+                orig_metrics.requests += 1
+                orig_metrics.errors += record.error is not None
+                orig_metrics.time_to_first_token += record.time_to_first_token or 0
+                orig_metrics.latency += record.latency
+                orig_metrics.rate_limit_wait += record.rate_limit_wait
 
     return wrapper
 
@@ -137,6 +377,11 @@ class AsyncLLMEngine(HorseData, ABC):
         self,
         rate_limits: list[dict[str, float]] = [],
         name: Optional[str] = None,
+        token_estimator: Optional[TokenEstimator] = None,
+        max_in_flight: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        rate_limit_key: Optional[str] = None,
+        rate_limit_backend: Optional[LimitBackend] = None,
         **kwargs: Any,
     ) -> None:
         """
@@ -145,11 +390,36 @@ class AsyncLLMEngine(HorseData, ABC):
         Args:
             rate_limits: List of rate limit configurations
             name: Optional name for the engine instance
+            token_estimator: Estimates prompt tokens before each call so they can
+                be reserved against token rate limits
+            max_in_flight: Maximum number of calls in flight at once. Further
+                calls wait for a free slot in priority order. None means no
+                limit.
+            max_queued: Maximum number of calls waiting for a slot. Calls beyond
+                that raise a QueueFullException. None means no limit.
+            rate_limit_key: Engines with the same key share their rate limits
+                through the rate limit backend. Defaults to the engine's name.
+            rate_limit_backend: Where shared rate limits are stored. Defaults to
+                the one set with configure_limit_backend. Without one, every
+                engine keeps its own limits.
             **kwargs: Additional engine-specific arguments
         """
         super().__init__()
-        self.rate_limit = RateLimits(rate_limits)
+        self.rate_limit_key = rate_limit_key
+        self.rate_limit = RateLimits(
+            rate_limits,
+            key=rate_limit_key or name,
+            backend=rate_limit_backend or default_limit_backend(),
+        )
+        self.scheduler = RequestScheduler(self.rate_limit)
         self.name = name
+        self.token_estimator = token_estimator or CharsPerTokenEstimator()
+        self.telemetry = EngineTelemetry(name or type(self).__name__)
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.concurrency = ConcurrencyLimit(
+            max_in_flight, max_queued, telemetry=self.telemetry
+        )
 
     def state_dict(self, **override: Any) -> dict[str, Any]:
         """
@@ -188,6 +458,15 @@ class AsyncLLMEngine(HorseData, ABC):
         else:
             return super().load_state_dict(state_dict, args, debug_prefix)
 
+    def check_capacity(self) -> None:
+        """
+        Reject a new call early if the engine's queue is full.
+
+        Raises:
+            QueueFullException: If every slot is taken and the queue is full
+        """
+        self.concurrency.check()
+
     @abstractmethod
     async def query_response(self, **kwargs: Any) -> tuple[str, int]:
         """
@@ -242,6 +521,54 @@ class AsyncLLMEngine(HorseData, ABC):
         """
         ...
 
+    async def query_batch(
+        self,
+        requests: list[dict[str, Any]],
+        max_concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[BatchResult[str]]:
+        """
+        Run many independent query_response calls.
+
+        Engines that support their provider's batch endpoint use it when
+        configured to. Otherwise the calls run concurrently, with at most
+        max_concurrency in flight, under the engine's rate limits.
+
+        Args:
+            requests: Keyword arguments for each query_response call
+            max_concurrency: Maximum number of calls in flight
+
+        Returns:
+            list[BatchResult[str]]: Responses in the same order as requests, with
+                per-request errors
+        """
+        return await run_batch(
+            lambda kwargs: self.query_response(**kwargs), requests, max_concurrency
+        )
+
+    async def query_object_batch(
+        self,
+        response_model: Type[T],
+        requests: list[dict[str, Any]],
+        max_concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[BatchResult[T]]:
+        """
+        Run many independent query_object calls for the same response model.
+
+        Args:
+            response_model: Pydantic model class to parse each response into
+            requests: Keyword arguments for each query_object call
+            max_concurrency: Maximum number of calls in flight
+
+        Returns:
+            list[BatchResult[T]]: Parsed responses in the same order as requests,
+                with per-request errors, including parse errors
+        """
+        return await run_batch(
+            lambda kwargs: self.query_object(response_model, **kwargs),
+            requests,
+            max_concurrency,
+        )
+
     @abstractmethod
     async def query_continuation(self, prompt: str, **kwargs: Any) -> str:
         """
@@ -0,0 +1,270 @@
+import sqlite3
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+from horsona.autodiff.basic import HorseData
+from horsona.llm.base_engine import AsyncLLMEngine, LLMMetrics
+from horsona.llm.engine_utils import (
+    compile_user_prompt,
+    request_key,
+    response_schema,
+    type_adapter,
+)
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class ResponseCache(HorseData):
+    """
+    A persistent, content-addressed store for LLM responses.
+
+    Responses are stored in a SQLite database keyed by a hash of the request.
+    Entries expire after ttl seconds, and the least recently used entries are
+    evicted once the cache holds more than max_entries.
+
+    Attributes:
+        path (str): Path to the SQLite database file
+        ttl (float | None): Seconds before an entry expires, or None to never expire
+        max_entries (int | None): Maximum number of entries, or None for no limit
+    """
+
+    def __init__(
+        self,
+        path: str = "llm_cache.sqlite",
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = 10000,
+    ) -> None:
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "tokens INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.connection.commit()
+
+    def get(self, key: str) -> Optional[tuple[str, int]]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Request key
+
+        Returns:
+            tuple[str, int] | None: The response and the tokens it originally
+                consumed, or None if the key is missing or expired
+        """
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT response, tokens, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        response, tokens, created = row
+        if self.ttl is not None and created + self.ttl < now:
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.connection.commit()
+            return None
+
+        self.connection.execute(
+            "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+        )
+        self.connection.commit()
+        return response, tokens
+
+    def put(self, key: str, response: str, tokens: int = 0) -> None:
+        """
+        Store a response, evicting the least recently used entries if needed.
+
+        Args:
+            key: Request key
+            response: Serialized response
+            tokens: Tokens consumed to generate the response
+        """
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response, tokens, created, accessed) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, response, tokens, now, now),
+        )
+
+        if self.max_entries is not None:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+        self.connection.commit()
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self.connection.execute("DELETE FROM responses")
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return count
+
+
+class CachedLLMEngine(AsyncLLMEngine):
+    """
+    An LLM engine that serves repeated queries from a ResponseCache.
+
+    Works with any AsyncLLMEngine, including WrapperLLMEngines and MultiEngines.
+    Requests are keyed on the compiled prompt, the API args, and the underlying
+    model, so an identical query only reaches the provider once. Cache hits,
+    misses, and tokens saved are reported through LLMMetrics.
+
+    Attributes:
+        underlying_llm (AsyncLLMEngine): The engine used on cache misses
+        cache (ResponseCache): Storage for cached responses
+        metrics (LLMMetrics): Running totals for this engine
+    """
+
+    def __init__(
+        self, underlying_llm: AsyncLLMEngine, cache: ResponseCache, **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        self.underlying_llm = underlying_llm
+        self.cache = cache
+        self.metrics = LLMMetrics()
+
+    async def query_response(self, metrics: LLMMetrics = None, **kwargs) -> str:
+        key = await self._request_key("query_response", kwargs)
+        return await self._cached(
+            key,
+            metrics,
+            lambda m: self.underlying_llm.query_response(metrics=m, **kwargs),
+        )
+
+    async def query_object(self, response_model: Type[T], **kwargs) -> T:
+        metrics = kwargs.pop("metrics", None)
+        adapter = type_adapter(response_model)
+        key = await self._request_key(
+            "query_object", kwargs, response_model=response_schema(response_model)
+        )
+
+        async def query(m: LLMMetrics) -> str:
+            result = await self.underlying_llm.query_object(
+                response_model, metrics=m, **kwargs
+            )
+            return adapter.dump_json(result).decode("utf-8")
+
+        return adapter.validate_json(await self._cached(key, metrics, query))
+
+    async def query_block(self, block_type: str, **kwargs) -> str:
+        metrics = kwargs.pop("metrics", None)
+        key = await self._request_key("query_block", kwargs, block_type=block_type)
+        return await self._cached(
+            key,
+            metrics,
+            lambda m: self.underlying_llm.query_block(block_type, metrics=m, **kwargs),
+        )
+
+    async def query_continuation(self, prompt: str, **kwargs) -> str:
+        metrics = kwargs.pop("metrics", None)
+        key = await self._request_key("query_continuation", kwargs, prompt=prompt)
+        return await self._cached(
+            key,
+            metrics,
+            lambda m: self.underlying_llm.query_continuation(
+                prompt, metrics=m, **kwargs
+            ),
+        )
+
+    async def query_stream(
+        self, metrics: LLMMetrics = None, **kwargs
+    ) -> AsyncGenerator[str, None]:
+        key = await self._request_key("query_stream", kwargs)
+        cached = self._lookup(key, metrics)
+        if cached is not None:
+            yield cached
+            return
+
+        call_metrics = LLMMetrics()
+        chunks = []
+        async for chunk in self.underlying_llm.query_stream(
+            metrics=call_metrics, **kwargs
+        ):
+            chunks.append(chunk)
+            yield chunk
+
+        # Only complete streams are cached
+        self._store(key, "".join(chunks), call_metrics, metrics)
+
+    async def _cached(
+        self,
+        key: str,
+        metrics: Optional[LLMMetrics],
+        query: Callable[[LLMMetrics], Awaitable[str]],
+    ) -> str:
+        cached = self._lookup(key, metrics)
+        if cached is not None:
+            return cached
+
+        call_metrics = LLMMetrics()
+        response = await query(call_metrics)
+        self._store(key, response, call_metrics, metrics)
+        return response
+
+    def _lookup(self, key: str, metrics: Optional[LLMMetrics]) -> Optional[str]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        response, tokens = entry
+        for m in (self.metrics, metrics):
+            if m is not None:
+                m.cache_hits += 1
+                m.tokens_saved += tokens
+        return response
+
+    def _store(
+        self,
+        key: str,
+        response: str,
+        call_metrics: LLMMetrics,
+        metrics: Optional[LLMMetrics],
+    ) -> None:
+        self.cache.put(key, response, call_metrics.tokens_consumed)
+        for m in (self.metrics, metrics):
+            if m is not None:
+                m.cache_misses += 1
+                m.tokens_consumed += call_metrics.tokens_consumed
+
+    async def _request_key(self, method: str, kwargs: dict[str, Any], **extra) -> str:
+        prompt_args = {k: v for k, v in kwargs.items() if k == k.upper()}
+        api_args = {
+            k: v for k, v in kwargs.items() if k != k.upper() and k != "metrics"
+        }
+
+        # Read fields directly so MultiEngine doesn't route the attribute lookup
+        engine_fields = vars(self.underlying_llm)
+
+        return request_key(
+            method=method,
+            engine=type(self.underlying_llm).__name__,
+            name=engine_fields.get("name"),
+            model=engine_fields.get("model"),
+            prompt=await compile_user_prompt(**prompt_args),
+            api_args=api_args,
+            **extra,
+        )
@@ -1,6 +1,8 @@
 from cerebras.cloud.sdk import AsyncCerebras, AsyncStream
 from cerebras.cloud.sdk.types.chat.chat_completion import CompletionCreateResponse
 
+from horsona.http.pool import get_http_client
+
 from .oai_engine import AsyncOAIEngine
 
 
@@ -21,7 +23,7 @@ class AsyncCerebrasEngine(AsyncOAIEngine):
     def __init__(self, model: str, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.model = model
-        self.client = AsyncCerebras()
+        self.client = AsyncCerebras(http_client=get_http_client())
 
     async def create(
         self, **kwargs
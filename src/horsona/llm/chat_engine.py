@@ -1,11 +1,34 @@
-import json
+import functools
 from abc import ABC, abstractmethod
-from typing import Any, AsyncGenerator, Type, TypeVar, Union
-
-from pydantic import BaseModel, TypeAdapter
-
-from .base_engine import AsyncLLMEngine
-from .engine_utils import compile_user_prompt, parse_block_response, parse_obj_response
+from contextlib import aclosing
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
+
+import httpx
+from pydantic import BaseModel
+
+from .base_engine import BATCH_CONCURRENCY, AsyncLLMEngine, BatchResult, LLMMetrics
+from .engine_utils import (
+    compile_user_prompt,
+    compile_user_prompt_length,
+    order_prompt_args,
+    parse_block_response,
+    parse_obj_response,
+    parse_structured_response,
+    request_key,
+    schema_prompt,
+    validate_obj,
+)
+from .json_stream import JsonStreamParser
+from .single_flight import SingleFlight
 
 __all__ = ["AsyncChatEngine"]
 
@@ -14,9 +37,45 @@ S = TypeVar("S", bound=Union[str, T])
 
 
 class AsyncChatEngine(AsyncLLMEngine, ABC):
-    def __init__(self, conversational=False, **kwargs) -> None:
+    def __init__(
+        self,
+        conversational=False,
+        coalesce_requests=False,
+        structured_output=True,
+        prompt_caching=True,
+        batch_api=False,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            conversational: Whether prompt args are inserted before the chat history
+            coalesce_requests: Whether identical requests that are in flight at the
+                same time share a single API call. Every caller then gets the same
+                response, so only enable this for engines whose requests are
+                deterministic, like temperature 0 lookups. Each caller's metrics
+                get the usage of the shared call.
+            structured_output: Whether query_object uses the provider's native
+                structured output when the engine supports it. Otherwise the
+                schema is sent in the prompt and the JSON is parsed from the text.
+                If the provider rejects a native request and the prompt works
+                instead, this is turned off for the engine.
+            prompt_caching: Whether to mark the end of the stable prompt args as a
+                cache breakpoint for providers that need one. The stable args are
+                named by the stable_prompt_args API arg and always go first in
+                the prompt.
+            batch_api: Whether query_batch and query_object_batch use the
+                provider's batch endpoint when the engine supports it. Batch
+                endpoints are cheaper but can take hours, so this is meant for
+                engines dedicated to offline work.
+            **kwargs: Additional arguments for AsyncLLMEngine
+        """
         super().__init__(**kwargs)
         self.conversational = conversational
+        self.coalesce_requests = coalesce_requests
+        self.structured_output = structured_output
+        self.prompt_caching = prompt_caching
+        self.batch_api = batch_api
+        self.in_flight = SingleFlight()
 
     @abstractmethod
     async def query(self, **kwargs) -> AsyncGenerator[str, None]:
@@ -35,11 +94,43 @@ class AsyncChatEngine(AsyncLLMEngine, ABC):
         ...
 
     async def query_response(self, **kwargs) -> tuple[str, int]:
+        api_args = await self._response_args(kwargs)
+
+        if not self.coalesce_requests:
+            return await self._query_response(api_args)
+
+        # Metrics are per-caller, so they don't distinguish requests
+        metrics = api_args.pop("metrics", None)
+        key = request_key(**api_args)
+        result, call_metrics = await self.in_flight.do(
+            key, lambda: self._shared_response(api_args)
+        )
+        if metrics is not None:
+            metrics.add(call_metrics)
+        return result.unwrap()
+
+    async def _shared_response(
+        self, api_args: dict[str, Any]
+    ) -> tuple[BatchResult[str], LLMMetrics]:
+        # The usage of a coalesced call is recorded separately, so it can be
+        # added to the metrics of every caller that shares it, even on failure
+        call_metrics = LLMMetrics()
+        try:
+            response = await self._query_response({**api_args, "metrics": call_metrics})
+            return BatchResult(value=response), call_metrics
+        except Exception as e:
+            return BatchResult(error=e), call_metrics
+
+    async def _response_args(self, kwargs: dict[str, Any]) -> dict[str, Any]:
+        # API args for a non-streaming call, with the prompt args compiled into
+        # the messages
         prompt_args = {k: v for k, v in kwargs.items() if k == k.upper()}
         api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
 
         await self._update_messages_with_prompt_args(
-            api_args.setdefault("messages", []), prompt_args
+            api_args.setdefault("messages", []),
+            prompt_args,
+            api_args.pop("stable_prompt_args", ()),
         )
 
         if "stream" in api_args:
@@ -47,6 +138,9 @@ class AsyncChatEngine(AsyncLLMEngine, ABC):
         else:
             api_args["stream"] = False
 
+        return api_args
+
+    async def _query_response(self, api_args: dict[str, Any]) -> str:
         result = []
         async for chunk in self.query(**api_args):
             result.append(chunk)
@@ -58,7 +152,9 @@ class AsyncChatEngine(AsyncLLMEngine, ABC):
         api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
 
         await self._update_messages_with_prompt_args(
-            api_args.setdefault("messages", []), prompt_args
+            api_args.setdefault("messages", []),
+            prompt_args,
+            api_args.pop("stable_prompt_args", ()),
         )
 
         if "stream" in api_args:
@@ -66,30 +162,231 @@ class AsyncChatEngine(AsyncLLMEngine, ABC):
         else:
             api_args["stream"] = True
 
-        async for chunk in self.query(**api_args):
-            yield chunk
+        async with aclosing(self.query(**api_args)) as stream:
+            async for chunk in stream:
+                yield chunk
+
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        """
+        Get the API args that make the provider return JSON for a response model.
+
+        Engines whose provider supports structured output (a JSON schema response
+        format or a forced tool call) override this. The response text must then
+        be the JSON object itself.
+
+        Args:
+            response_model: Pydantic model class to generate
+
+        Returns:
+            Optional[dict[str, Any]]: API args to add to the request, or None if
+                the provider doesn't support structured output
+        """
+        return None
+
+    def rejects_structured_output(self, error: Exception) -> bool:
+        """
+        Check whether an error means the provider rejected a structured output
+        request, for example because the model doesn't support it.
+
+        Providers answer requests they can't serve with a 400 or 422 status, so
+        those are treated as rejections by default, whether the status comes
+        from an SDK error or an httpx.HTTPStatusError. Engines whose provider
+        reports it differently override this.
+
+        Args:
+            error: Error raised by a request made with structured_output_args
+
+        Returns:
+            bool: Whether to retry the request with the schema in the prompt
+        """
+        if isinstance(error, httpx.HTTPStatusError):
+            status_code = error.response.status_code
+        else:
+            status_code = getattr(error, "status_code", None)
+        return status_code in (400, 422)
 
     async def query_object(self, response_model: Type[T], **kwargs) -> T:
+        native = self._native_output_args(response_model) is not None
+        if native:
+            # Prompt args are added to the messages in place, so keep the
+            # original ones for a retry
+            retry_kwargs = {**kwargs, "messages": list(kwargs.get("messages", []))}
+
+        api_args, parse = await self._object_args(response_model, kwargs)
+        try:
+            response = await self.query_response(**api_args)
+        except Exception as e:
+            if not native or not self.rejects_structured_output(e):
+                raise
+            api_args, parse = await self._object_args(
+                response_model, retry_kwargs, native=False
+            )
+            response = await self.query_response(**api_args)
+            # The prompt works where the native request didn't, so don't try
+            # the native request again
+            self.structured_output = False
+
+        return parse(response)
+
+    def _native_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        if not self.structured_output or not _is_model(response_model):
+            return None
+        return self.structured_output_args(response_model)
+
+    async def _object_args(
+        self, response_model: Type[T], kwargs: dict[str, Any], native: bool = True
+    ) -> tuple[dict[str, Any], Callable[[str], T]]:
+        # API args for query_object, and the parser for the response
         prompt_args = {k: v for k, v in kwargs.items() if k == k.upper()}
         api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
 
         await self._update_messages_with_prompt_args(
-            api_args.setdefault("messages", []), prompt_args
+            api_args.setdefault("messages", []),
+            prompt_args,
+            api_args.pop("stable_prompt_args", ()),
         )
+
+        native_args = self._native_output_args(response_model) if native else None
+        if native_args is not None:
+            # The schema goes in the request rather than the prompt
+            api_args.update(native_args)
+            return api_args, functools.partial(
+                parse_structured_response, response_model
+            )
+
         api_args.setdefault("messages", []).extend(
             await _generate_obj_query_messages(response_model)
         )
 
-        response = await self.query_response(**api_args)
+        return api_args, functools.partial(parse_obj_response, response_model)
 
-        return parse_obj_response(response_model, response)
+    async def submit_batch(
+        self, requests: list[dict[str, Any]]
+    ) -> Optional[list[BatchResult[str]]]:
+        """
+        Run non-streaming calls through the provider's batch endpoint.
+
+        Engines whose provider has one override this. It's only called when
+        batch_api is enabled.
+
+        Args:
+            requests: API args for each call, with the prompt already in the
+                messages
+
+        Returns:
+            Optional[list[BatchResult[str]]]: Response text for each request in
+                order, or None if the engine has no batch endpoint
+        """
+        return None
+
+    async def query_batch(
+        self,
+        requests: list[dict[str, Any]],
+        max_concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[BatchResult[str]]:
+        if self.batch_api:
+            api_args = [await self._response_args(kwargs) for kwargs in requests]
+            results = await self.submit_batch(api_args)
+            if results is not None:
+                return results
+
+        return await super().query_batch(requests, max_concurrency)
+
+    async def query_object_batch(
+        self,
+        response_model: Type[T],
+        requests: list[dict[str, Any]],
+        max_concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[BatchResult[T]]:
+        if self.batch_api:
+            prepared = [
+                await self._object_args(response_model, kwargs) for kwargs in requests
+            ]
+            results = await self.submit_batch(
+                [await self._response_args(api_args) for api_args, _ in prepared]
+            )
+            if results is not None:
+                return [
+                    _parse_batch_result(parse, result)
+                    for (_, parse), result in zip(prepared, results)
+                ]
+
+        return await super().query_object_batch(
+            response_model, requests, max_concurrency
+        )
+
+    async def query_object_stream(
+        self, response_model: Type[T], **kwargs
+    ) -> AsyncGenerator[T, None]:
+        """
+        Query the LLM for a structured object and yield it as it's generated.
+
+        The JSON is parsed incrementally as chunks arrive. Whenever a top-level
+        field, or an item of a top-level list or dict, is completed and the
+        complete part of the JSON validates as response_model, the partial
+        object is yielded. The stream is closed as soon as the JSON value is
+        complete, without waiting for the rest of the response.
+
+        Args:
+            response_model: Pydantic model class to parse the response into
+            **kwargs: Prompt args (UPPERCASE) and API args (lowercase)
+
+        Yields:
+            T: Increasingly complete objects. The last one is the full response,
+                identical to what query_object returns.
+        """
+        prompt_args = {k: v for k, v in kwargs.items() if k == k.upper()}
+        api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
+
+        await self._update_messages_with_prompt_args(
+            api_args.setdefault("messages", []),
+            prompt_args,
+            api_args.pop("stable_prompt_args", ()),
+        )
+        api_args.setdefault("messages", []).extend(
+            await _generate_obj_query_messages(response_model)
+        )
+
+        parser = JsonStreamParser()
+        response = []
+        last = None
+        async with aclosing(self.query_stream(**api_args)) as stream:
+            async for chunk in stream:
+                if not parser.started:
+                    response.append(chunk)
+                if parser.feed(chunk) and not parser.done:
+                    try:
+                        obj = validate_obj(response_model, parser.partial())
+                    except (ValueError, TypeError):
+                        # Malformed or not yet valid, so wait for more
+                        continue
+                    if obj != last:
+                        last = obj
+                        yield obj
+                if parser.done:
+                    break
+
+        if not parser.started:
+            # No code block, so fall back to the regular parser
+            obj = parse_obj_response(response_model, "".join(response))
+        else:
+            parser.close()
+            obj = validate_obj(response_model, parser.value())
+        if obj != last:
+            yield obj
 
     async def query_block(self, block_type: str, **kwargs) -> str:
         prompt_args = {k: v for k, v in kwargs.items() if k == k.upper()}
         api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
 
         await self._update_messages_with_prompt_args(
-            api_args.setdefault("messages", []), prompt_args
+            api_args.setdefault("messages", []),
+            prompt_args,
+            api_args.pop("stable_prompt_args", ()),
         )
         api_args.setdefault("messages", []).extend(
             await _generate_block_query_messages(block_type, prompt_args)
@@ -104,7 +401,9 @@ class AsyncChatEngine(AsyncLLMEngine, ABC):
         api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
 
         await self._update_messages_with_prompt_args(
-            api_args.setdefault("messages", []), prompt_args
+            api_args.setdefault("messages", []),
+            prompt_args,
+            api_args.pop("stable_prompt_args", ()),
         )
         api_args.setdefault("messages", []).extend(
             [
@@ -118,20 +417,61 @@ class AsyncChatEngine(AsyncLLMEngine, ABC):
 
         return await self.query_response(**api_args)
 
+    def user_prompt_message(self, prompt: str, stable_length: int) -> dict[str, Any]:
+        """
+        Build the message that carries the compiled prompt args.
+
+        Engines whose provider caches prompt prefixes only at explicit
+        breakpoints override this to mark the end of the stable prefix.
+
+        Args:
+            prompt: Compiled prompt args
+            stable_length: Length of the prefix of prompt made up of stable args,
+                or 0 if there are none
+
+        Returns:
+            dict[str, Any]: User message
+        """
+        return {"role": "user", "content": prompt}
+
     async def _update_messages_with_prompt_args(
-        self, messages: list[dict[str, str]], prompt_args: dict[str, Any]
+        self,
+        messages: list[dict[str, str]],
+        prompt_args: dict[str, Any],
+        stable_args: Sequence[str] = (),
     ) -> None:
         if not prompt_args:
             return
 
+        prompt_args = order_prompt_args(prompt_args, stable_args)
+        stable = {k: v for k, v in prompt_args.items() if k in stable_args}
+        prompt = await compile_user_prompt(**prompt_args)
+        stable_length = await compile_user_prompt_length(**stable) if stable else 0
+        message = self.user_prompt_message(prompt, stable_length)
+
         if self.conversational:
-            messages.insert(
-                0, {"role": "user", "content": await compile_user_prompt(**prompt_args)}
-            )
+            messages.insert(0, message)
         else:
-            messages.append(
-                {"role": "user", "content": await compile_user_prompt(**prompt_args)}
-            )
+            messages.append(message)
+
+
+def _parse_batch_result(
+    parse: Callable[[str], T], result: BatchResult[str]
+) -> BatchResult[T]:
+    if not result.ok:
+        return result
+    try:
+        return BatchResult(value=parse(result.value))
+    except Exception as e:
+        return BatchResult(error=e)
+
+
+def _is_model(response_model: Any) -> bool:
+    # Structured output needs an object schema, so other types use the prompt
+    try:
+        return issubclass(response_model, BaseModel)
+    except TypeError:
+        return False
 
 
 async def _generate_block_query_messages(block_type: str, prompt_args):
@@ -181,24 +521,7 @@ async def _generate_obj_query_messages(
         "JSON_SCHEMA. Use only fields specified by the JSON_SCHEMA and nothing else."
     )
 
-    schema = None
-    try:
-        if issubclass(response_model, BaseModel):
-            schema = response_model.model_json_schema()
-    except TypeError:
-        pass
-
-    if schema is None:
-        schema = TypeAdapter(response_model).json_schema()
-
-    system_prompt = (
-        "Your task is to understand the content and provide "
-        "the parsed objects in json that matches the following json_schema:\n\n"
-        f"{json.dumps(schema, indent=2)}\n\n"
-        "Make sure to return an instance of the JSON, not the schema itself."
-    )
-
     return [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": schema_prompt(response_model)},
         {"role": "user", "content": user_prompt},
     ]
@@ -1,112 +1,319 @@
+import functools
+import hashlib
 import json
-from typing import Any, Type, TypeVar, Union
+import re
+import weakref
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+)
 from xml.sax.saxutils import escape as xml_escape
 
 from pydantic import BaseModel, TypeAdapter
 
 T = TypeVar("T")
+V = TypeVar("V")
 
+# Number of distinct response types whose schemas and prompts are kept
+SCHEMA_CACHE_SIZE = 256
 
-def _convert_to_xml(obj, prefix=None, indent=0) -> str:
-    """
-    Serialize an object to a JSON string.
+_fingerprints: "weakref.WeakKeyDictionary[type, Hashable]" = weakref.WeakKeyDictionary()
+_schemas: OrderedDict[Hashable, dict[str, Any]] = OrderedDict()
+_schema_prompts: OrderedDict[Hashable, str] = OrderedDict()
 
-    This function first normalizes the object using _normalize(),
-    then serializes it to a JSON string with indentation.
 
-    Args:
-        obj: The object to serialize.
+# Scalar types that can't change in place, so their serialized form can be
+# memoized for the object that holds them
+_IMMUTABLE_SCALARS = (str, int, float, bool)
 
-    Returns:
-        str: The JSON string representation of the object.
+# Serialized scalars of objects with a json method, keyed by the object. Each
+# entry holds the scalar it was computed from, so a changed value is detected.
+_scalar_fragments: "weakref.WeakKeyDictionary[Any, _Scalar]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class _Scalar:
+    __slots__ = ("source", "text", "length", "blank")
+
+    def __init__(self, source: Any) -> None:
+        self.source = source
+        self.text: Optional[str] = None
+        string = str(source)
+        self.length = (
+            len(string)
+            + 4 * string.count("&")
+            + 3 * (string.count("<") + string.count(">"))
+        )
+        self.blank = not string or string.isspace()
+
+    def escaped(self) -> str:
+        if self.text is None:
+            self.text = xml_escape(str(self.source))
+        return self.text
+
+
+class _PromptWriter:
     """
-    if prefix is None:
-        prefix = []
+    Serializes prompt args into XML-like tags in a single pass.
 
-    indent_str = "  " * indent
-    if isinstance(obj, dict):
-        result = []
-        for key, value in obj.items():
-            if not isinstance(value, (dict, list, set)):
-                single_item = True
-            else:
-                single_item = len(value) == 1
+    Output goes to one list of parts, and nested tags are built by appending to
+    the parent's tag, so the cost is linear in the size of the output. With
+    count_only, only the length of the output is tracked.
+    """
 
-            if single_item and not isinstance(value, (dict, list, set)):
-                value_str = _convert_to_xml(value, prefix + [key], 0)
-                closing_indent = ""
-                newline = ""
+    def __init__(self, count_only: bool = False) -> None:
+        self.count_only = count_only
+        self.parts: list[str] = []
+        self.length = 0
+        self._indents = [""]
+
+    def write(self, text: str) -> None:
+        if self.count_only:
+            self.length += len(text)
+        else:
+            self.parts.append(text)
+
+    def write_scalar(self, scalar: _Scalar) -> None:
+        if self.count_only:
+            self.length += scalar.length
+        else:
+            self.parts.append(scalar.escaped())
+
+    def indent(self, level: int) -> str:
+        while len(self._indents) <= level:
+            self._indents.append("  " * len(self._indents))
+        return self._indents[level]
+
+    async def write_arg(self, key: str, value: Any) -> None:
+        self.write(f"<{key}>\n")
+        value, container, raw = await _resolve(value, False)
+        if container is None:
+            self.write(self.indent(1))
+            self.write_scalar(value)
+        else:
+            await self.write_container(value, container, "", 1, raw)
+        self.write(f"\n</{key}>")
+
+    async def write_container(
+        self, value: Any, container: str, tag: str, level: int, raw: bool
+    ) -> None:
+        indent = self.indent(level)
+        items = value.items() if container == "dict" else enumerate(value)
+        first = True
+        for key, item in items:
+            if not first:
+                self.write("\n")
+            first = False
+
+            item_tag = f"{tag}.{key}" if tag else str(key)
+            item, item_container, item_raw = await _resolve(item, raw)
+
+            if item_container is None:
+                if item.blank:
+                    self.write(f"{indent}<{item_tag}></{item_tag}>")
+                else:
+                    self.write(f"{indent}<{item_tag}>")
+                    self.write_scalar(item)
+                    self.write(f"</{item_tag}>")
+            elif len(item) == 0:
+                self.write(f"{indent}<{item_tag}></{item_tag}>")
             else:
-                value_str = _convert_to_xml(value, prefix + [key], indent + 1)
-                closing_indent = indent_str
-                newline = "\n"
-
-            if value_str.strip():
-                result.append(
-                    (
-                        f"{indent_str}<{'.'.join((prefix + [key]))}>{newline}"
-                        f"{value_str}{newline}"
-                        f"{closing_indent}</{'.'.join((prefix + [key]))}>"
-                    )
+                self.write(f"{indent}<{item_tag}>\n")
+                # Tags inside list items continue from the list's tag
+                await self.write_container(
+                    item,
+                    item_container,
+                    item_tag if container == "dict" else tag,
+                    level + 1,
+                    item_raw,
                 )
-            else:
-                result.append((f"{indent_str}<{prefix}.{key}></{prefix}.{key}>"))
-
-        return "\n".join(result)
-    elif isinstance(obj, (list, set)):
-        result = []
-        for i, value in enumerate(obj):
-            if not isinstance(value, (dict, list, set)):
-                single_item = True
-            else:
-                single_item = len(value) == 1
+                self.write(f"\n{indent}</{item_tag}>")
 
-            if single_item and not isinstance(value, (dict, list, set)):
-                value_str = _convert_to_xml(value, prefix, 0)
-                closing_indent = ""
-                newline = ""
-            else:
-                value_str = _convert_to_xml(value, prefix, indent + 1)
-                closing_indent = indent_str
-                newline = "\n"
-
-            if value_str.strip():
-                result.append(
-                    (
-                        f"{indent_str}<{'.'.join((prefix + [str(i)]))}>{newline}"
-                        f"{value_str}{newline}"
-                        f"{closing_indent}</{'.'.join((prefix + [str(i)]))}>"
-                    )
-                )
-            else:
-                result.append(
-                    (
-                        f"{indent_str}<{'.'.join((prefix + [str(i)]))}></{'.'.join((prefix + [str(i)]))}>"
-                    )
-                )
-        return "\n".join(result)
-    else:
-        return indent_str + xml_escape(str(obj))
 
+async def _resolve(obj: Any, raw: bool) -> tuple[Any, Optional[str], bool]:
+    """
+    Classify a prompt value.
+
+    Returns the value to write, "dict" or "list" for containers (None for
+    scalars, which are returned as _Scalar), and whether nested values are raw.
+    Raw values come from model_dump and are written as-is.
+    """
+    if raw:
+        if isinstance(obj, dict):
+            return obj, "dict", True
+        if isinstance(obj, (list, set)):
+            return obj, "list", True
+        return _Scalar(obj), None, True
 
-async def compile_user_prompt(**kwargs) -> str:
+    if isinstance(obj, BaseModel):
+        return await _resolve(obj.model_dump(), True)
+    if isinstance(obj, dict):
+        return obj, "dict", False
+    if isinstance(obj, (list, tuple, set)):
+        return obj, "list", False
+    if isinstance(obj, _IMMUTABLE_SCALARS):
+        return _Scalar(obj), None, False
+    if obj is None:
+        return _Scalar("None"), None, False
+
+    value = await obj.json()
+    if isinstance(value, _IMMUTABLE_SCALARS):
+        try:
+            scalar = _scalar_fragments.get(obj)
+        except TypeError:
+            # Not weak-referenceable
+            return _Scalar(value), None, False
+        if scalar is None or scalar.source is not value:
+            scalar = _scalar_fragments[obj] = _Scalar(value)
+        return scalar, None, False
+    return await _resolve(value, False)
+
+
+def order_prompt_args(
+    prompt_args: dict[str, Any], stable_args: Sequence[str] = ()
+) -> dict[str, Any]:
+    """
+    Put stable prompt args first.
+
+    Stable args are ones whose values rarely change between calls, like long-lived
+    memory context. Placing them first, always in the same order, gives
+    consecutive prompts a long shared prefix that providers can cache.
+
+    Args:
+        prompt_args: Prompt args in the caller's order.
+        stable_args: Names of stable args, in the order they should appear.
+            Names missing from prompt_args are ignored.
+
+    Returns:
+        dict[str, Any]: The stable args in the given order, followed by the other
+            args in their original order.
+    """
+    if not stable_args:
+        return prompt_args
+
+    ordered = {key: prompt_args[key] for key in stable_args if key in prompt_args}
+    ordered.update(prompt_args)
+    return ordered
+
+
+async def compile_user_prompt(stable_args: Sequence[str] = (), **kwargs) -> str:
     """
     Compile a user prompt from keyword arguments.
 
     Each keyword argument is serialized and wrapped in XML-like tags.
 
     Args:
+        stable_args: Names of args to place first, see order_prompt_args.
         **kwargs: Keyword arguments to include in the prompt.
 
     Returns:
         str: The compiled user prompt.
     """
-    prompt_pieces = []
-    for key, value in kwargs.items():
-        value = _convert_to_xml(await _convert_to_dict(value), None, 1)
-        prompt_pieces.append(f"<{key}>\n{value}\n</{key}>")
+    writer = _PromptWriter()
+    for i, (key, value) in enumerate(order_prompt_args(kwargs, stable_args).items()):
+        if i:
+            writer.write("\n\n")
+        await writer.write_arg(key, value)
+
+    return "".join(writer.parts)
+
+
+async def compile_user_prompt_length(stable_args: Sequence[str] = (), **kwargs) -> int:
+    """
+    Get the length of the prompt compile_user_prompt would return, without
+    building it.
+
+    Args:
+        stable_args: Names of args to place first, see order_prompt_args.
+        **kwargs: Keyword arguments to include in the prompt.
+
+    Returns:
+        int: The length of the compiled user prompt.
+    """
+    writer = _PromptWriter(count_only=True)
+    for i, (key, value) in enumerate(order_prompt_args(kwargs, stable_args).items()):
+        if i:
+            writer.write("\n\n")
+        await writer.write_arg(key, value)
+
+    return writer.length
+
+
+async def compile_item_length(item: Any) -> int:
+    """
+    Get the length an item contributes to a list passed to compile_user_prompt,
+    not counting its index tags.
+
+    Together with list_prompt_length, this lets callers keep running totals of
+    list prompt lengths instead of recompiling the whole list when it changes.
+
+    Args:
+        item: An item of a list prompt arg.
+
+    Returns:
+        int: The length of the item's element, excluding the index in its tags.
+    """
+    writer = _PromptWriter(count_only=True)
+    await writer.write_container([item], "list", "", 1, False)
+    # The element is tagged <0>...</0>
+    return writer.length - 2
 
-    return "\n\n".join(prompt_pieces)
+
+def list_prompt_length(key: str, item_length: int, count: int) -> int:
+    """
+    Get the length of compile_user_prompt for a single list arg.
+
+    Args:
+        key: Name of the prompt arg.
+        item_length: Sum of compile_item_length over the items in the list.
+        count: Number of items in the list.
+
+    Returns:
+        int: The length of compile_user_prompt(**{key: items}).
+    """
+    length = 2 * len(key) + 7
+    if count:
+        # Items are separated by newlines and tagged with their index
+        length += item_length + count - 1 + 2 * _index_digits(count)
+    return length
+
+
+def _index_digits(count: int) -> int:
+    """Total number of digits in the indices 0 through count - 1."""
+    digits = count
+    bound = 10
+    while bound < count:
+        digits += count - bound
+        bound *= 10
+    return digits
+
+
+def request_key(**parts: Any) -> str:
+    """
+    Compute a stable content hash for an LLM request.
+
+    The parts are serialized to canonical JSON (sorted keys, non-JSON values
+    converted with str) and hashed, so identical requests always produce the
+    same key.
+
+    Args:
+        **parts: Components that identify the request (prompt, API args, model, etc.)
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    serialized = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
 
 
 def parse_obj_response(response_model: Type[T], content: str) -> T:
@@ -132,13 +339,27 @@ def parse_obj_response(response_model: Type[T], content: str) -> T:
     cleaned_json = clean_json_string(content[json_start:json_end].strip())
     obj = json.loads(cleaned_json)
 
+    return validate_obj(response_model, obj)
+
+
+def validate_obj(response_model: Type[T], obj: Any) -> T:
+    """
+    Construct an instance of the response model from parsed JSON.
+
+    Args:
+        response_model (BaseModel): The expected response model class.
+        obj: The parsed JSON value.
+
+    Returns:
+        An instance of the response model.
+    """
     try:
         if issubclass(response_model, BaseModel):
             return response_model(**obj)
     except TypeError:
         pass
 
-    return TypeAdapter(response_model).validate_python(obj)
+    return type_adapter(response_model).validate_python(obj)
 
 
 def parse_block_response(block_type: str, content: str) -> str:
@@ -167,29 +388,179 @@ def parse_block_response(block_type: str, content: str) -> str:
     return content[start:end].strip()
 
 
-async def _convert_to_dict(obj: Any) -> dict:
+def model_fingerprint(response_model: Type[BaseModel] | Type[Any]) -> Hashable:
     """
-    Recursively normalize an object for serialization.
+    Get a key that identifies a response type by its structure.
 
-    This function handles Pydantic BaseModel instances, dictionaries, and lists.
-    Other types are returned as-is.
+    Models that are redefined with the same name and fields, like models
+    declared inside a function, get the same fingerprint, so their schemas
+    only have to be generated once. Other classes, like enums and
+    dataclasses, are identified by the class itself.
 
     Args:
-        obj: The object to normalize.
+        response_model (BaseModel): The expected response model class.
 
     Returns:
-        The normalized version of the object.
+        Hashable: The fingerprint.
     """
-    if isinstance(obj, BaseModel):
-        return obj.model_dump()
-    elif isinstance(obj, dict):
-        return {k: await _convert_to_dict(v) for k, v in obj.items()}
-    elif isinstance(obj, (list, tuple, set)):
-        return [await _convert_to_dict(v) for v in obj]
-    elif isinstance(obj, (int, float, str, bool)):
-        return obj
-    else:
-        return await _convert_to_dict(await obj.json() if obj is not None else "None")
+    return _fingerprint(response_model, ())
+
+
+def _fingerprint(tp: Any, seen: tuple[type, ...]) -> Hashable:
+    if isinstance(tp, type) and issubclass(tp, BaseModel):
+        if tp in seen:
+            # Recursive reference
+            return ("ref", tp.__module__, tp.__qualname__)
+        try:
+            return _fingerprints[tp]
+        except KeyError:
+            pass
+
+        fingerprint = (
+            "model",
+            tp.__module__,
+            tp.__qualname__,
+            tp.__doc__,
+            repr(sorted(tp.model_config.items(), key=str)),
+            tuple(
+                (name, repr(field), _fingerprint(field.annotation, seen + (tp,)))
+                for name, field in tp.model_fields.items()
+            ),
+        )
+        if not seen:
+            _fingerprints[tp] = fingerprint
+        return fingerprint
+
+    origin = get_origin(tp)
+    if origin is not None:
+        return (origin, tuple(_fingerprint(arg, seen) for arg in get_args(tp)))
+    if isinstance(tp, type):
+        # Classes with the same name can have different schemas, like enums
+        # with different members. Keying on the class also keeps it alive, so
+        # the key can't match a new class later.
+        return ("type", tp)
+    # Literal values and Annotated metadata
+    return ("value", type(tp), repr(tp))
+
+
+def _cached(
+    cache: OrderedDict[Hashable, V], key: Hashable, build: Callable[[], V]
+) -> V:
+    try:
+        cache.move_to_end(key)
+        return cache[key]
+    except KeyError:
+        pass
+
+    value = cache[key] = build()
+    if len(cache) > SCHEMA_CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+@functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def _cached_type_adapter(response_model: Any) -> TypeAdapter:
+    return TypeAdapter(response_model)
+
+
+def type_adapter(response_model: Type[T]) -> TypeAdapter[T]:
+    """
+    Get a TypeAdapter for a response type.
+
+    Adapters are cached by identity, since they validate into the exact classes
+    they were built with.
+
+    Args:
+        response_model: The expected response type.
+
+    Returns:
+        TypeAdapter: The adapter.
+    """
+    try:
+        return _cached_type_adapter(response_model)
+    except TypeError:
+        # Unhashable types can't be cached
+        return TypeAdapter(response_model)
+
+
+def response_schema(response_model: Type[BaseModel] | Type[Any]) -> dict[str, Any]:
+    """
+    Get the JSON schema of a response model.
+
+    Schemas are cached by the model's fingerprint, and the cached schema is
+    returned on every call, so it must not be modified.
+
+    Args:
+        response_model (BaseModel): The expected response model class.
+
+    Returns:
+        dict[str, Any]: The JSON schema.
+    """
+
+    def build() -> dict[str, Any]:
+        try:
+            if issubclass(response_model, BaseModel):
+                return response_model.model_json_schema()
+        except TypeError:
+            pass
+
+        return type_adapter(response_model).json_schema()
+
+    return _cached(_schemas, model_fingerprint(response_model), build)
+
+
+def schema_prompt(response_model: Type[BaseModel] | Type[Any]) -> str:
+    """
+    Get the system prompt that asks for JSON matching a response model.
+
+    Prompts are cached by the model's fingerprint.
+
+    Args:
+        response_model (BaseModel): The expected response model class.
+
+    Returns:
+        str: The system prompt.
+    """
+    return _cached(
+        _schema_prompts,
+        model_fingerprint(response_model),
+        lambda: (
+            "Your task is to understand the content and provide "
+            "the parsed objects in json that matches the following json_schema:\n\n"
+            f"{json.dumps(response_schema(response_model), indent=2)}\n\n"
+            "Make sure to return an instance of the JSON, not the schema itself."
+        ),
+    )
+
+
+def schema_name(response_model: Type[BaseModel]) -> str:
+    """
+    Get a name for a response model that providers accept as a schema or tool
+    name.
+
+    Args:
+        response_model (BaseModel): The expected response model class.
+
+    Returns:
+        str: The model's name, restricted to letters, digits, _ and -.
+    """
+    return re.sub(r"[^a-zA-Z0-9_-]", "_", response_model.__name__)[:64]
+
+
+def parse_structured_response(response_model: Type[T], content: str) -> T:
+    """
+    Parse a response generated with the provider's native structured output.
+
+    Args:
+        response_model (BaseModel): The expected response model class.
+        content (str): The JSON response from the LLM.
+
+    Returns:
+        An instance of the response model.
+    """
+    if content.lstrip().startswith("```"):
+        return parse_obj_response(response_model, content)
+    return validate_obj(response_model, json.loads(clean_json_string(content)))
 
 
 def clean_json_string(json_str: str) -> str:
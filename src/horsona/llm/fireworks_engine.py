@@ -1,13 +1,15 @@
 import os
 import warnings
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Optional, Type
 
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     from fireworks.client import AsyncFireworks
 
 from fireworks.client.api import ChatCompletionResponse, CompletionStreamResponse
+from pydantic import BaseModel
 
+from horsona.llm.engine_utils import response_schema
 from horsona.llm.oai_engine import AsyncOAIEngine
 
 
@@ -72,3 +74,13 @@ class AsyncFireworksEngine(AsyncOAIEngine):
             return result
         else:
             return await result
+
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        return {
+            "response_format": {
+                "type": "json_object",
+                "schema": response_schema(response_model),
+            }
+        }
@@ -1,8 +1,10 @@
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Optional, Type
 
 from groq import AsyncGroq
 from groq.types.chat import ChatCompletion, ChatCompletionChunk
+from pydantic import BaseModel
 
+from horsona.http.pool import get_http_client
 from horsona.llm.oai_engine import AsyncOAIEngine
 
 
@@ -31,7 +33,7 @@ class AsyncGroqEngine(AsyncOAIEngine):
         """
         super().__init__(*args, **kwargs)
         self.model = model
-        self.client = AsyncGroq()
+        self.client = AsyncGroq(http_client=get_http_client())
 
     async def create(
         self, **kwargs
@@ -52,3 +54,9 @@ class AsyncGroqEngine(AsyncOAIEngine):
             del kwargs["stream_options"]
 
         return await self.client.chat.completions.create(**kwargs)
+
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        # Only a few Groq models accept JSON schemas, so use the prompt
+        return None
@@ -0,0 +1,193 @@
+import json
+from typing import Any, Optional
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+# Values completed at this depth or above are reported by feed. Depth 1 is a
+# field of the top-level object, depth 2 an item of one of its collections.
+REPORT_DEPTH = 2
+
+
+class JsonStreamParser:
+    """
+    Incremental parser for a JSON value in a fenced code block.
+
+    Text is fed in as it streams in. Everything up to the opening ``` fence
+    (and its info string, like json) is skipped, and the JSON after it is
+    scanned one character at a time, so each chunk costs time proportional to
+    its own length. Raw newlines inside strings are escaped the same way
+    clean_json_string does for complete responses.
+
+    The parser remembers the last point where every value so far was complete.
+    partial() closes the open objects and arrays at that point, so it only ever
+    contains complete strings, numbers and literals, and no empty placeholders
+    for objects or arrays that are still being generated.
+
+    Example:
+        >>> parser = JsonStreamParser()
+        >>> parser.feed('```json\\n{"topic": "x", "items": [1, 2')
+        True
+        >>> parser.partial()
+        {'topic': 'x', 'items': [1]}
+    """
+
+    def __init__(self) -> None:
+        self.started = False
+        self.done = False
+        self._prefix = ""
+        self._text: list[str] = []
+        self._length = 0
+        self._stack: list[str] = []
+        self._expect_key = False
+        self._in_string = False
+        self._string_is_key = False
+        self._escaped = False
+        self._in_scalar = False
+        self._safe_length = 0
+        self._safe_closers = ""
+        self._reported = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add the next chunk of the response.
+
+        Args:
+            chunk: Response text
+
+        Returns:
+            bool: Whether a top-level field or an item of a top-level
+                collection was completed by this chunk
+        """
+        self._reported = False
+        if self.done:
+            return False
+
+        if not self.started:
+            self._prefix += chunk
+            fence = self._prefix.find("```")
+            if fence == -1:
+                return False
+            # Skip the info string after the fence, which ends at the first
+            # character that isn't a letter
+            start = fence + 3
+            while start < len(self._prefix) and self._prefix[start].isalpha():
+                start += 1
+            if start == len(self._prefix):
+                return False
+            chunk = self._prefix[start:]
+            self._prefix = ""
+            self.started = True
+
+        for char in chunk:
+            self._consume(char)
+            if self.done:
+                break
+
+        return self._reported
+
+    def close(self) -> None:
+        """Mark the end of the response, completing any trailing scalar."""
+        if self._in_scalar:
+            self._in_scalar = False
+            self._complete_value()
+        self.done = True
+
+    def partial(self) -> Optional[Any]:
+        """
+        Get the value parsed so far.
+
+        Returns:
+            Optional[Any]: The complete part of the value, with open objects and
+                arrays closed, or None if no value has started
+        """
+        if self._safe_length == 0:
+            return None
+        text = "".join(self._text)[: self._safe_length]
+        return json.loads(text + self._safe_closers)
+
+    def value(self) -> Any:
+        """
+        Get the complete value.
+
+        Returns:
+            Any: The parsed value
+
+        Raises:
+            json.JSONDecodeError: If the value is incomplete or invalid
+        """
+        return json.loads("".join(self._text))
+
+    def _append(self, text: str) -> None:
+        self._text.append(text)
+        self._length += len(text)
+
+    def _consume(self, char: str) -> None:
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+                self._append(char)
+            elif char == "\\":
+                self._escaped = True
+                self._append(char)
+            elif char == '"':
+                self._in_string = False
+                self._append(char)
+                if not self._string_is_key:
+                    self._complete_value()
+            elif char == "\n":
+                self._append("\\n")
+            elif char != "\r":
+                self._append(char)
+            return
+
+        if self._in_scalar:
+            if char not in " \t\n\r,]}`":
+                self._append(char)
+                return
+            self._in_scalar = False
+            self._complete_value()
+            if self.done:
+                return
+
+        if char in " \t\n\r":
+            return
+        if char == "`":
+            # Closing fence
+            self.done = True
+        elif char in "{[":
+            self._stack.append(char)
+            self._expect_key = char == "{"
+            self._append(char)
+            # Nested containers only become part of the partial value once
+            # they contain a complete value
+            if len(self._stack) == 1:
+                self._mark_safe()
+        elif char in "}]":
+            if self._stack:
+                self._stack.pop()
+            self._append(char)
+            self._complete_value()
+        elif char == '"':
+            self._in_string = True
+            self._string_is_key = self._expect_key and self._stack[-1:] == ["{"]
+            self._append(char)
+        elif char == ":":
+            self._expect_key = False
+            self._append(char)
+        elif char == ",":
+            self._expect_key = self._stack[-1:] == ["{"]
+            self._append(char)
+        else:
+            self._in_scalar = True
+            self._append(char)
+
+    def _mark_safe(self) -> None:
+        self._safe_length = self._length
+        self._safe_closers = "".join(_CLOSERS[c] for c in reversed(self._stack))
+
+    def _complete_value(self) -> None:
+        self._mark_safe()
+        if len(self._stack) <= REPORT_DEPTH:
+            self._reported = True
+        if not self._stack:
+            self.done = True
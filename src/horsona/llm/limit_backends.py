@@ -0,0 +1,304 @@
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional, TypeVar
+from urllib.parse import unquote, urlparse
+
+R = TypeVar("R")
+
+# Callback for LimitBackend.transact. Takes the stored value (None if there is
+# none) and returns the value to store (None to leave it) and a result.
+Update = Callable[[Optional[float]], tuple[Optional[float], R]]
+
+# Seconds a value is kept after its timestamp has passed, to allow for clock
+# differences between processes
+EXPIRY_MARGIN = 60.0
+
+
+class LimitBackend(ABC):
+    """
+    Shared storage for rate limit state.
+
+    Rate limits are token buckets whose whole state is one timestamp per
+    limit. By default every RateLimits keeps its own. Engines in different
+    processes that use the same account should store theirs in a shared
+    backend instead, under the same key, so they share one budget.
+
+    Backends must run each transaction atomically across every process that
+    uses them. The stored values are timestamps, after which a bucket is full
+    again, so backends may drop values once they've passed. All processes
+    should have synchronized clocks.
+    """
+
+    @abstractmethod
+    def transact(self, key: str, update: Update[R]) -> R:
+        """
+        Atomically read, update and write the value of a key.
+
+        Args:
+            key: Key of the rate limit
+            update: Function from the current value to the new value and a
+                result. It may be called more than once if another process
+                changes the value at the same time.
+
+        Returns:
+            R: The result returned by update
+        """
+        ...
+
+    def get(self, key: str) -> Optional[float]:
+        """
+        Read the value of a key.
+
+        Args:
+            key: Key of the rate limit
+
+        Returns:
+            Optional[float]: The value, or None if it isn't set
+        """
+        return self.transact(key, lambda value: (None, value))
+
+
+class LocalLimitBackend(LimitBackend):
+    """Keeps rate limit state in memory, shared by engines in one process."""
+
+    def __init__(self) -> None:
+        self.values: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def transact(self, key: str, update: Update[R]) -> R:
+        with self._lock:
+            value, result = update(self.values.get(key))
+            if value is not None:
+                self.values[key] = value
+            return result
+
+
+class SqliteLimitBackend(LimitBackend):
+    """
+    Keeps rate limit state in a SQLite database.
+
+    Processes on one machine share limits by using the same database file.
+    SQLite's file locks make each transaction atomic.
+
+    Attributes:
+        path (str): Path of the database file
+    """
+
+    def __init__(self, path: str = "rate_limits.sqlite", timeout: float = 10.0):
+        """
+        Args:
+            path: Path of the database file
+            timeout: Seconds to wait for another process's lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def transact(self, key: str, update: Update[R]) -> R:
+        with self._lock:
+            connection = self._connect()
+            # Take the write lock up front so no other process can change the
+            # value between the read and the write
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT value FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                value, result = update(row[0] if row else None)
+                if value is not None:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO rate_limits (key, value) VALUES (?, ?)",
+                        (key, value),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return result
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections can't be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits "
+                "(key TEXT PRIMARY KEY, value REAL NOT NULL)"
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+
+class RedisError(Exception):
+    """Raised when a Redis server returns an error."""
+
+    pass
+
+
+class RedisLimitBackend(LimitBackend):
+    """
+    Keeps rate limit state in Redis, or any server that speaks its protocol.
+
+    Processes on any number of machines share limits by using the same server.
+    Each transaction uses WATCH, MULTI and EXEC, and is retried if another
+    client changed the value in the meantime. Values expire once they no
+    longer matter.
+
+    Calls block the event loop for one round trip to the server, so the
+    server should be close by.
+
+    Attributes:
+        url (str): Server URL, like redis://:password@localhost:6379/0
+        prefix (str): Prefix for every key
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "horsona:rate_limit:",
+        timeout: float = 5.0,
+    ) -> None:
+        """
+        Args:
+            url: Server URL
+            prefix: Prefix for every key
+            timeout: Socket timeout in seconds
+        """
+        self.url = url
+        self.prefix = prefix
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def transact(self, key: str, update: Update[R]) -> R:
+        key = self.prefix + key
+        with self._lock:
+            try:
+                while True:
+                    self._command("WATCH", key)
+                    stored = self._command("GET", key)
+                    value, result = update(
+                        float(stored) if stored is not None else None
+                    )
+                    if value is None:
+                        self._command("UNWATCH")
+                        return result
+
+                    ttl = max(value - time.time(), 0.0) + EXPIRY_MARGIN
+                    self._command("MULTI")
+                    self._command("SET", key, repr(value), "PX", math.ceil(ttl * 1000))
+                    # EXEC returns nil if the key changed after WATCH
+                    if self._command("EXEC") is not None:
+                        return result
+            except BaseException:
+                # Don't leave a WATCH or MULTI open on the connection
+                self.close()
+                raise
+
+    def get(self, key: str) -> Optional[float]:
+        with self._lock:
+            try:
+                stored = self._command("GET", self.prefix + key)
+            except BaseException:
+                self.close()
+                raise
+        return float(stored) if stored is not None else None
+
+    def close(self) -> None:
+        """Close the connection to the server."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _connect(self) -> None:
+        if self._socket is not None and self._pid == os.getpid():
+            return
+
+        url = urlparse(self.url)
+        self._socket = socket.create_connection(
+            (url.hostname or "localhost", url.port or 6379), timeout=self.timeout
+        )
+        self._reader = self._socket.makefile("rb")
+        self._pid = os.getpid()
+        if url.password:
+            if url.username:
+                self._command("AUTH", unquote(url.username), unquote(url.password))
+            else:
+                self._command("AUTH", unquote(url.password))
+        db = url.path.lstrip("/")
+        if db and db != "0":
+            self._command("SELECT", db)
+
+    def _command(self, *args: Any) -> Any:
+        self._connect()
+        parts = [str(arg).encode() for arg in args]
+        request = [b"*%d\r\n" % len(parts)]
+        for part in parts:
+            request.append(b"$%d\r\n%s\r\n" % (len(part), part))
+        self._socket.sendall(b"".join(request))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise EOFError("Connection closed by Redis server")
+        kind, data = line[:1], line[1:-2]
+        if kind == b"+":
+            return data.decode()
+        elif kind == b"-":
+            raise RedisError(data.decode())
+        elif kind == b":":
+            return int(data)
+        elif kind == b"$":
+            length = int(data)
+            if length == -1:
+                return None
+            return self._reader.read(length + 2)[:-2].decode()
+        elif kind == b"*":
+            length = int(data)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        else:
+            raise RedisError(f"Unexpected reply from Redis server: {line!r}")
+
+
+_default_backend: Optional[LimitBackend] = None
+
+
+def configure_limit_backend(backend: Optional[LimitBackend]) -> None:
+    """
+    Set the backend that engines created from now on store their limits in.
+
+    Engines only use it if they have a rate limit key, which defaults to their
+    name. Engines with the same key share one budget.
+
+    Args:
+        backend: Shared backend, or None to keep limits in each engine
+    """
+    global _default_backend
+    _default_backend = backend
+
+
+def default_limit_backend() -> Optional[LimitBackend]:
+    """
+    Get the backend set with configure_limit_backend.
+
+    Returns:
+        Optional[LimitBackend]: The backend, or None if limits are kept in
+            each engine
+    """
+    return _default_backend
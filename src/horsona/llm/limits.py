@@ -1,92 +1,350 @@
 import asyncio
+import heapq
+import itertools
+import math
 import time
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Optional, TypeVar
 
 from horsona.autodiff.basic import HorseData
+from horsona.llm.scheduler import current_priority
 
+if TYPE_CHECKING:
+    from horsona.llm.limit_backends import LimitBackend
+    from horsona.llm.telemetry import EngineTelemetry
 
-class CallLimit(HorseData):
+R = TypeVar("R")
+
+# Weight of the newest call in the moving average of how long calls hold a slot
+_HOLD_TIME_ALPHA = 0.2
+
+
+class TokenBucket(HorseData):
     """
-    Tracks and enforces rate limits based on number of API calls.
+    Rate limit that allows bursts, using the generic cell rate algorithm (GCRA).
+
+    The bucket holds up to burst units and refills at limit units per interval,
+    which is how providers enforce their limits. Instead of counting what's in
+    the bucket, GCRA tracks the theoretical arrival time (tat): the time at
+    which the bucket would be full again. A request for count units is allowed
+    once taking them wouldn't push tat more than a full bucket past now.
+
+    Requests larger than the bucket are allowed once the bucket is full, and
+    leave it in debt.
+
+    With a backend and a key, tat is stored in the backend, so every bucket
+    with the same key shares one budget, even across processes.
+
+    Attributes:
+        limit (float): Units allowed per interval
+        interval (float): Interval in seconds
+        burst (float): Size of the bucket. Defaults to limit, so a full
+            interval's worth can be used at once.
+        tat (float): Theoretical arrival time, when not stored in a backend
+        key (Optional[str]): Key of the bucket in the backend
     """
 
-    def __init__(self, limit: float, interval: float) -> None:
+    def __init__(
+        self,
+        limit: float,
+        interval: float,
+        burst: Optional[float] = None,
+        tat: Optional[float] = None,
+        key: Optional[str] = None,
+        backend: Optional["LimitBackend"] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
         """
         Args:
-            limit: Maximum number of calls allowed per interval
+            limit: Units allowed per interval
             interval: Time interval in seconds
+            burst: Size of the bucket
+            tat: Initial theoretical arrival time. Defaults to a full bucket.
+            key: Key of the bucket in the backend
+            backend: Shared storage for tat. Only used with a key.
+            clock: Function that returns the current time in seconds
         """
-        assert limit is not None and limit > 0, "Call limit must be a positive float"
+        assert limit is not None and limit > 0, "Rate limit must be a positive float"
         assert interval >= 0, "Rate interval must be a non-negative float"
+        assert burst is None or burst > 0, "Burst must be a positive float"
 
         self.limit = limit
         self.interval = interval
-        self.last_blocked = time.time() - self.interval / self.limit
+        self.burst = burst if burst is not None else limit
+        self.key = key
+        self.backend = backend if key is not None else None
+        self.clock = clock
+        self.tat = tat if tat is not None else clock()
+
+    @property
+    def emission_interval(self) -> float:
+        """Seconds it takes the bucket to refill by one unit."""
+        return self.interval / self.limit
+
+    def next_allowed(self, count: int = 1) -> float:
+        """
+        Get the time when count units will be allowed.
+
+        Args:
+            count: Units to take
+
+        Returns:
+            float: Timestamp, or the current time if they're allowed now
+        """
+        now = self.clock()
+        if self.backend is None:
+            tat = self.tat
+        else:
+            tat = self.backend.get(self.key)
+        return self._allowed_at(tat if tat is not None else now, count, now)
 
-    async def consume(self) -> None:
-        """Record consumption of one call and wait if needed."""
-        if self.limit is None:
-            return
+    def reserve(self, count: int = 1, at: Optional[float] = None) -> float:
+        """
+        Take count units at the earliest time they're allowed.
+
+        Reservations are made in call order, so callers that wait until their
+        reserved time are served first come, first served and never overshoot
+        the limit.
 
-        await self.wait_for()
-        self.last_blocked = max(
-            self.last_blocked, time.time() - self.interval / self.limit
+        Args:
+            count: Units to take
+            at: Don't take them before this time
+
+        Returns:
+            float: Time the units were taken at
+        """
+
+        def update(tat: float, now: float) -> tuple[float, float]:
+            allowed = max(self._allowed_at(tat, count, now), at or 0.0)
+            return max(tat, allowed) + count * self.emission_interval, allowed
+
+        return self._update(update)
+
+    def report_consumed(self, count: int) -> None:
+        """Take count units now. Negative counts return unused units."""
+
+        def update(tat: float, now: float) -> tuple[float, None]:
+            return max(max(tat, now) + count * self.emission_interval, now), None
+
+        self._update(update)
+
+    async def consume(self, count: int = 1) -> None:
+        """Take count units, waiting until they're allowed."""
+        await sleep_until(self.reserve(count), self.clock)
+
+    async def wait_for(self, count: Optional[int] = 1) -> None:
+        """Wait until count units are allowed, without taking them."""
+        await sleep_until(self.next_allowed(count or 1), self.clock)
+
+    def _allowed_at(self, tat: float, count: int, now: float) -> float:
+        count = min(count, self.burst)
+        return max(tat + (count - self.burst) * self.emission_interval, now)
+
+    def _update(self, update: Callable[[float, float], tuple[float, R]]) -> R:
+        now = self.clock()
+        if self.backend is None:
+            self.tat, result = update(self.tat, now)
+            return result
+
+        # A missing key is a full bucket
+        return self.backend.transact(
+            self.key, lambda tat: update(tat if tat is not None else now, now)
         )
-        self.last_blocked += self.interval / self.limit
 
-    def next_allowed(self) -> float:
-        """Return timestamp when next call will be allowed."""
-        return max(self.last_blocked + self.interval / self.limit, time.time())
 
-    async def wait_for(self) -> None:
-        """Wait until next call is allowed."""
-        next_allowed = self.next_allowed()
-        now = time.time()
-        if next_allowed > now:
-            await asyncio.sleep(next_allowed - now)
+class CallLimit(TokenBucket):
+    """
+    Tracks and enforces rate limits based on number of API calls.
+    """
 
 
-class TokenLimit(HorseData):
+class TokenLimit(TokenBucket):
     """
     Tracks and enforces rate limits based on number of tokens.
     """
 
-    def __init__(self, limit: float, interval: float) -> None:
+
+async def sleep_until(deadline: float, clock: Callable[[], float] = time.time) -> None:
+    """
+    Sleep until the clock reaches deadline.
+
+    Args:
+        deadline: Timestamp to wake up at
+        clock: Clock the deadline is measured on
+    """
+    delay = deadline - clock()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class QueueFullException(Exception):
+    """Raised when an engine's queue of calls waiting for a free slot is full."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Too many queued LLM calls, retry after {retry_after:g}s")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimit:
+    """
+    Caps the number of calls an engine has in flight.
+
+    Calls beyond max_in_flight wait for a free slot. Freed slots go to waiting
+    calls in priority order (see request_priority), and in arrival order within
+    a priority class. If max_queued calls are already waiting, further calls
+    fail right away with a QueueFullException instead of queueing without
+    bound.
+
+    Attributes:
+        max_in_flight (Optional[int]): Maximum calls in flight, or None for no
+            limit
+        max_queued (Optional[int]): Maximum calls waiting for a slot, or None
+            for no limit. Only applies when max_in_flight is set.
+        in_flight (int): Calls currently holding a slot
+        rejected (int): Calls rejected because the queue was full
+        hold_time (Optional[float]): Moving average of the seconds a call holds
+            its slot
+    """
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        telemetry: Optional["EngineTelemetry"] = None,
+    ) -> None:
         """
         Args:
-            limit: Maximum number of tokens allowed per interval
-            interval: Time interval in seconds
+            max_in_flight: Maximum calls in flight
+            max_queued: Maximum calls waiting for a slot
+            telemetry: Telemetry to publish the queue depth to
         """
-        assert limit is not None and limit > 0, "Token limit must be a positive float"
-        assert interval >= 0, "Rate interval must be a non-negative float"
+        assert (
+            max_in_flight is None or max_in_flight > 0
+        ), "Concurrency limit must be a positive int"
+        assert (
+            max_queued is None or max_queued >= 0
+        ), "Queue limit must be a non-negative int"
 
-        self.limit = limit
-        self.interval = interval
-        self.last_blocked = time.time() - self.interval / self.limit
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.telemetry = telemetry
+        self.in_flight = 0
+        self.rejected = 0
+        self.hold_time: Optional[float] = None
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._acquired_at: dict[int, float] = {}
 
-    def report_consumed(self, count: int) -> None:
-        """Record consumption of tokens."""
-        self.last_blocked = max(
-            self.last_blocked, time.time() - self.interval + self.interval / self.limit
-        )
-        self.last_blocked += self.interval / self.limit * count
+    @property
+    def queued(self) -> int:
+        """Number of calls waiting for a slot."""
+        return len(self._waiters)
 
-    def next_allowed(self, count: int) -> float:
-        """Return timestamp when consuming given number of tokens will be allowed."""
-        if self.limit is None:
-            return time.time()
+    def full(self) -> bool:
+        """
+        Check whether a new call would be rejected.
 
-        return max(
-            self.last_blocked + self.interval / self.limit * count,
-            time.time() + self.interval / self.limit * (count - 1),
+        Returns:
+            bool: Whether every slot is taken and the queue is full
+        """
+        return (
+            self.max_in_flight is not None
+            and self.max_queued is not None
+            and self.in_flight >= self.max_in_flight
+            and self.queued >= self.max_queued
         )
 
-    async def wait_for(self, count: Optional[int]) -> None:
-        """Wait until consuming given number of tokens is allowed."""
-        if count is None:
-            count = 1
+    def retry_after(self) -> float:
+        """
+        Estimate how long until a new call could queue again.
+
+        Returns:
+            float: Whole seconds, at least 1
+        """
+        if self.hold_time is None or self.max_in_flight is None:
+            return 1.0
+        waves = (self.queued + 1) / self.max_in_flight
+        return float(max(1, math.ceil(self.hold_time * waves)))
+
+    def check(self) -> None:
+        """
+        Reject a new call early if it couldn't queue.
+
+        Raises:
+            QueueFullException: If every slot is taken and the queue is full
+        """
+        if self.full():
+            self.rejected += 1
+            self._publish()
+            raise QueueFullException(self.retry_after())
+
+    async def acquire(self) -> int:
+        """
+        Wait for a free slot and take it.
+
+        Returns:
+            int: Token to pass to release
+
+        Raises:
+            QueueFullException: If max_queued calls are already waiting
+        """
+        token = next(self._seq)
+        if self.max_in_flight is None or (
+            self.in_flight < self.max_in_flight and not self._waiters
+        ):
+            self.in_flight += 1
+            self._acquired_at[token] = time.monotonic()
+            self._publish()
+            return token
+
+        self.check()
+
+        priority, _ = current_priority()
+        entry = (priority, token, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        self._publish()
+        try:
+            await entry[2]
+        except BaseException:
+            if entry[2].done() and not entry[2].cancelled():
+                # The slot was handed over just as the wait was cancelled
+                self._acquired_at[token] = time.monotonic()
+                self.release(token)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._publish()
+            raise
+
+        # release already counted this call as in flight when it handed over
+        # the slot
+        self._acquired_at[token] = time.monotonic()
+        return token
+
+    def release(self, token: int) -> None:
+        """
+        Give up a slot, handing it to the next waiting call.
+
+        Args:
+            token: Token returned by acquire
+        """
+        held = time.monotonic() - self._acquired_at.pop(token)
+        if self.hold_time is None:
+            self.hold_time = held
+        else:
+            self.hold_time += _HOLD_TIME_ALPHA * (held - self.hold_time)
+
+        self.in_flight -= 1
+        while self._waiters and (
+            self.max_in_flight is None or self.in_flight < self.max_in_flight
+        ):
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                self.in_flight += 1
+        self._publish()
 
-        next_allowed = self.next_allowed(count)
-        now = time.time()
-        if next_allowed > now:
-            await asyncio.sleep(next_allowed - now)
+    def _publish(self) -> None:
+        if self.telemetry is not None:
+            self.telemetry.in_flight = self.in_flight
+            self.telemetry.queued = self.queued
+            self.telemetry.rejected = self.rejected
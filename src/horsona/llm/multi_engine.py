@@ -1,14 +1,73 @@
 import asyncio
 import inspect
 import sys
+import time
+from contextlib import aclosing
 from random import random
-from typing import Any, Generic, Type, TypeVar
+from typing import Any, Generic, Optional, Type, TypeVar
 
 from horsona.autodiff.basic import HorseData
-from horsona.llm.base_engine import AsyncLLMEngine, llms, load_llms
+from horsona.llm.base_engine import (
+    BATCH_CONCURRENCY,
+    AsyncLLMEngine,
+    BatchResult,
+    llms,
+    load_llms,
+    run_batch,
+)
+from horsona.llm.engine_utils import compile_user_prompt
+from horsona.llm.routing import CircuitState, EngineRouter
 
 T = TypeVar("T", bound=AsyncLLMEngine)
 
+# Recent latencies needed before an engine's calls are hedged
+MIN_HEDGE_SAMPLES = 10
+
+
+def _telemetry(engine: Any, counter: str) -> None:
+    telemetry = vars(engine).get("telemetry")
+    if telemetry is not None:
+        setattr(telemetry, counter, getattr(telemetry, counter) + 1)
+
+
+def _call_kwargs(kwargs: dict) -> dict:
+    # Chat engines append prompt args to the messages list they're given, so
+    # every attempt needs its own copy
+    if isinstance(kwargs.get("messages"), list):
+        return {**kwargs, "messages": list(kwargs["messages"])}
+    return kwargs
+
+
+async def _continuation_kwargs(engine: Any, kwargs: dict, partial: str) -> dict:
+    # Same messages query_continuation sends. Prompt args are folded into the
+    # messages first so that they stay ahead of the partial response.
+    prompt_args = {k: v for k, v in kwargs.items() if k == k.upper()}
+    api_args = {k: v for k, v in kwargs.items() if k != k.upper()}
+
+    messages = list(api_args.get("messages", []))
+    if prompt_args:
+        prompt = {
+            "role": "user",
+            "content": await compile_user_prompt(
+                api_args.get("stable_prompt_args", ()), **prompt_args
+            ),
+        }
+        if vars(engine).get("conversational", False):
+            messages.insert(0, prompt)
+        else:
+            messages.append(prompt)
+    messages.extend(
+        [
+            {"role": "assistant", "content": partial},
+            {
+                "role": "user",
+                "content": "Please continue. Just the continuation, nothing else.",
+            },
+        ]
+    )
+    api_args["messages"] = messages
+    return api_args
+
 
 def get_mro_hierarchy(cls: Type) -> tuple[Type, ...]:
     """Returns the Method Resolution Order (MRO) for a class"""
@@ -64,6 +123,44 @@ def find_greatest_common_ancestor(objects: list[Any]) -> Type:
 
 
 class MultiEngine(HorseData, Generic[T]):
+    """
+    Spreads calls across several engines.
+
+    Each call is routed by an EngineRouter, which prefers engines that can take a
+    call right now and have the least outstanding work relative to their
+    observed latency and weight. Failed calls are retried on the next best
+    engine. An engine that fails more than max_retries times in a row is
+    paused by a circuit breaker and probed again after a cooldown.
+
+    Async generator methods like query_stream are routed the same way. Streams
+    that fail before their first chunk are retried like any other call.
+
+    Hedging is opt-in. The second engine is only used if its rate limits allow
+    a call immediately, and the slower call is cancelled once one succeeds.
+
+    Attributes:
+        engines (list[T]): Engines to route between
+        max_retries (int): Retries per call
+        backoff_exp (float): Base of the exponential backoff before calling an
+            engine that recently failed
+        backoff_multiplier (float): Scale of the backoff in seconds
+        name (str): Optional name for the engine
+        weights (list[float]): Relative capacity of each engine
+        cooldown (float): Seconds a failing engine is paused at first. Doubles
+            with every failed probe.
+        max_cooldown (float): Upper bound for the cooldown
+        hedge_percentile (Optional[float]): Enables hedging. If a call takes
+            longer than this percentile (between 0 and 1) of the engine's recent
+            latencies, the same call is sent to a second engine and whichever
+            answers first wins.
+        hedge_min_delay (float): Minimum seconds to wait before hedging
+        resume_streams (bool): Whether a stream that fails after its first chunk
+            is continued on another engine. The new engine is given the partial
+            response and asked to continue it. Only applies to streams of text.
+            Otherwise the error is raised to the caller, since chunks that were
+            already yielded can't be retried.
+    """
+
     def __init__(
         self,
         engines: list[T],
@@ -71,6 +168,12 @@ class MultiEngine(HorseData, Generic[T]):
         backoff_exp: float = 2,
         backoff_multiplier: float = 1,
         name: str = None,
+        weights: Optional[list[float]] = None,
+        cooldown: float = 5.0,
+        max_cooldown: float = 300.0,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_delay: float = 0.0,
+        resume_streams: bool = False,
     ):
         super().__init__()
         self.engines = engines
@@ -78,6 +181,12 @@ class MultiEngine(HorseData, Generic[T]):
         self.backoff_exp = backoff_exp
         self.backoff_multiplier = backoff_multiplier
         self.name = name
+        self.weights = weights
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.resume_streams = resume_streams
 
     def __new__(
         cls,
@@ -86,55 +195,229 @@ class MultiEngine(HorseData, Generic[T]):
         backoff_exp: float = 2,
         backoff_multiplier: float = 1,
         name: str = None,
+        weights: Optional[list[float]] = None,
+        cooldown: float = 5.0,
+        max_cooldown: float = 300.0,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_delay: float = 0.0,
+        resume_streams: bool = False,
     ):
         self = super().__new__(cls)
 
-        _engines = list(engines)
-        _max_retries = max_retries
-        _backoffs = {engine: -1 for engine in _engines}
+        router = EngineRouter(
+            engines,
+            weights=weights,
+            failure_threshold=max_retries + 1,
+            cooldown=cooldown,
+            max_cooldown=max_cooldown,
+        )
 
         def select_engine():
-            if len(_engines) == 0:
+            if len(router.engines) == 0:
                 raise Exception("No engines available")
-            return sorted(_engines, key=lambda x: x.rate_limit.next_allowed())[0]
+            return router.peek() or router.engines[0]
+
+        async def backoff(selection):
+            failures = router.health_of(selection).failures
+            if failures > 0:
+                await asyncio.sleep(
+                    random() * backoff_multiplier * (backoff_exp ** (failures - 1))
+                )
+
+        def record_failure(selection):
+            router.finish(selection, False)
+            health = router.health_of(selection)
+            if health.state == CircuitState.OPEN:
+                sys.stderr.write(
+                    f"Engine {selection.__class__.__name__} failed too many times, pausing it for {health.cooldown:g}s\n"
+                )
+
+        def record_retry(selection, kwargs):
+            telemetry = vars(selection).get("telemetry")
+            if telemetry is not None:
+                telemetry.record_retry()
+            metrics = kwargs.get("metrics")
+            if metrics is not None:
+                metrics.retries += 1
+
+        async def call_engine(selection, name, args, kwargs):
+            telemetry = vars(selection).get("telemetry")
+            if telemetry is not None:
+                ttft = telemetry.time_to_first_token
+                ttft_before = (ttft.sum, ttft.count)
+
+            try:
+                await backoff(selection)
+                start = time.perf_counter()
+                result = await getattr(selection, name)(*args, **_call_kwargs(kwargs))
+            except Exception:
+                record_failure(selection)
+                raise
+            except BaseException:
+                router.finish(selection, None)
+                raise
+
+            time_to_first_token = None
+            if telemetry is not None and ttft.count > ttft_before[1]:
+                time_to_first_token = (ttft.sum - ttft_before[0]) / (
+                    ttft.count - ttft_before[1]
+                )
+            router.finish(
+                selection,
+                True,
+                latency=time.perf_counter() - start,
+                time_to_first_token=time_to_first_token,
+            )
+            return result
+
+        async def hedged_call(selection, name, args, kwargs):
+            delay = None
+            if hedge_percentile is not None:
+                health = router.health_of(selection)
+                if len(health.latencies) >= MIN_HEDGE_SAMPLES:
+                    delay = max(
+                        health.latency_percentile(hedge_percentile), hedge_min_delay
+                    )
+            if delay is None:
+                return await call_engine(selection, name, args, kwargs)
+
+            # Engines whose call started running. call_engine finishes those
+            # with the router, so the rest must be finished when cancelled.
+            started = set()
+
+            def start(engine):
+                async def run():
+                    started.add(id(engine))
+                    return await call_engine(engine, name, args, kwargs)
+
+                return asyncio.ensure_future(run())
+
+            primary = start(selection)
+            tasks = {primary: selection}
+            try:
+                done, _ = await asyncio.wait([primary], timeout=delay)
+                if not done:
+                    # Only hedge on engines that can take the call right away,
+                    # so hedging never waits on or exceeds a rate limit
+                    backup = router.select(exclude=selection, ready_only=True)
+                    if backup is not None:
+                        _telemetry(selection, "hedges")
+                        tasks[start(backup)] = backup
+
+                # Keep the first successful result
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            if task is not primary:
+                                _telemetry(tasks[task], "hedge_wins")
+                            return task.result()
+
+                raise primary.exception()
+            finally:
+                for task, engine in tasks.items():
+                    task.cancel()
+                    if id(engine) not in started:
+                        # Cancelled before its first step, so it never runs
+                        router.finish(engine, None)
 
         def async_wrapper(name):
             async def wrapper(*args, **kwargs):
                 last_exception = None
 
-                for _ in range(_max_retries + 1):
-                    selection = select_engine()
-                    if _backoffs[selection] >= 0:
-                        await asyncio.sleep(
-                            random()
-                            * backoff_multiplier
-                            * (backoff_exp ** _backoffs[selection])
-                        )
-
-                    fn = getattr(selection, name)
+                for attempt in range(max_retries + 1):
+                    selection = await router.acquire()
 
                     try:
-                        result = await fn(*args, **kwargs)
-                        _backoffs[selection] = -1
-                        return result
+                        return await hedged_call(selection, name, args, kwargs)
                     except Exception as e:
                         last_exception = e
 
-                        if selection in _backoffs:
-                            _backoffs[selection] += 1
-                            if _backoffs[selection] == max_retries:
-                                sys.stderr.write(
-                                    f"Engine {selection.__class__.__name__} failed too many times, removing it\n"
-                                )
-                                _engines.remove(selection)
-                                del _backoffs[selection]
+                        if attempt < max_retries:
+                            record_retry(selection, kwargs)
+
+                raise last_exception
+
+            return wrapper
+
+        def stream_wrapper(name):
+            async def wrapper(*args, **kwargs):
+                received = []
+                # Only text streams can be continued from a partial response
+                resumable = resume_streams
+                last_exception = None
+                failed = None
+
+                for attempt in range(max_retries + 1):
+                    # Move away from the engine that just failed if there's
+                    # another one to use
+                    selection = None
+                    if failed is not None and len(router.engines) > 1:
+                        selection = router.select(exclude=failed)
+                    if selection is None:
+                        selection = await router.acquire()
+
+                    call_kwargs = _call_kwargs(kwargs)
+                    if received:
+                        call_kwargs = await _continuation_kwargs(
+                            selection, kwargs, "".join(received)
+                        )
+
+                    time_to_first_token = None
+                    try:
+                        await backoff(selection)
+                        start = time.perf_counter()
+                        async with aclosing(
+                            getattr(selection, name)(*args, **call_kwargs)
+                        ) as stream:
+                            async for chunk in stream:
+                                if time_to_first_token is None:
+                                    time_to_first_token = time.perf_counter() - start
+                                    if received:
+                                        _telemetry(selection, "stream_resumes")
+                                if not isinstance(chunk, str):
+                                    resumable = False
+                                received.append(chunk)
+                                yield chunk
+                    except Exception as e:
+                        record_failure(selection)
+                        last_exception = e
+                        failed = selection
+
+                        if time_to_first_token is None:
+                            _telemetry(selection, "stream_failures")
+                        else:
+                            _telemetry(selection, "stream_interruptions")
+                        # Chunks that were already sent can't be taken back
+                        if received and not resumable:
+                            raise
+
+                        if attempt < max_retries:
+                            record_retry(selection, kwargs)
+                        continue
+                    except BaseException:
+                        router.finish(selection, None)
+                        raise
+
+                    router.finish(
+                        selection,
+                        True,
+                        latency=time.perf_counter() - start,
+                        time_to_first_token=time_to_first_token,
+                    )
+                    return
 
                 raise last_exception
 
             return wrapper
 
+        self.router = router
         self.select_engine = select_engine
         self.async_wrapper = async_wrapper
+        self.stream_wrapper = stream_wrapper
         return self
 
     def __getattr__(self, name: str):
@@ -145,9 +428,37 @@ class MultiEngine(HorseData, Generic[T]):
         result = getattr(selection, name)
         if inspect.iscoroutinefunction(result):
             return getattr(self, "async_wrapper")(name)
+        elif inspect.isasyncgenfunction(result):
+            return getattr(self, "stream_wrapper")(name)
         else:
             return result
 
+    async def query_batch(
+        self,
+        requests: list[dict[str, Any]],
+        max_concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[BatchResult[str]]:
+        """
+        Route each request of a batch separately, so the batch is spread across
+        the engines and failed requests are retried individually.
+        """
+        return await run_batch(
+            lambda kwargs: self.query_response(**kwargs), requests, max_concurrency
+        )
+
+    async def query_object_batch(
+        self,
+        response_model: Type[Any],
+        requests: list[dict[str, Any]],
+        max_concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[BatchResult[Any]]:
+        """Route each request of a batch separately, like query_batch."""
+        return await run_batch(
+            lambda kwargs: self.query_object(response_model, **kwargs),
+            requests,
+            max_concurrency,
+        )
+
     def get_type(self) -> Type[T]:
         return find_greatest_common_ancestor(self.engines)
 
@@ -179,6 +490,28 @@ class MultiEngine(HorseData, Generic[T]):
 
 
 def create_multi_engine(
-    *engines: T, max_retries: int = 3, backoff_exp=2, backoff_multiplier=1, name=None
+    *engines: T,
+    max_retries: int = 3,
+    backoff_exp=2,
+    backoff_multiplier=1,
+    name=None,
+    weights=None,
+    cooldown=5.0,
+    max_cooldown=300.0,
+    hedge_percentile=None,
+    hedge_min_delay=0.0,
+    resume_streams=False,
 ) -> MultiEngine:
-    return MultiEngine(engines, max_retries, backoff_exp, backoff_multiplier, name)
+    return MultiEngine(
+        engines,
+        max_retries,
+        backoff_exp,
+        backoff_multiplier,
+        name,
+        weights,
+        cooldown,
+        max_cooldown,
+        hedge_percentile,
+        hedge_min_delay,
+        resume_streams,
+    )
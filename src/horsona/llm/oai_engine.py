@@ -1,12 +1,14 @@
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Optional, Type
 
+from openai.types import CompletionUsage
 from openai.types.chat.chat_completion import ChatCompletion
+from pydantic import BaseModel
 
 from horsona.llm.base_engine import LLMMetrics, tracks_metrics
 
 from .chat_engine import AsyncChatEngine
-from .engine_utils import compile_user_prompt
+from .engine_utils import compile_user_prompt, response_schema, schema_name
 
 
 class AsyncOAIEngine(AsyncChatEngine, ABC):
@@ -16,6 +18,20 @@ class AsyncOAIEngine(AsyncChatEngine, ABC):
     @abstractmethod
     async def create(self, **kwargs) -> ChatCompletion: ...
 
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        # OpenAI-compatible APIs take the schema as a response format
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": schema_name(response_model),
+                    "schema": response_schema(response_model),
+                },
+            }
+        }
+
     @tracks_metrics
     async def query(
         self, *, metrics: LLMMetrics, **kwargs
@@ -34,25 +50,12 @@ class AsyncOAIEngine(AsyncChatEngine, ABC):
         if not api_args.get("stream", False):
             response: ChatCompletion = await self.create(**api_args)
 
-            tokens_consumed = response.usage.total_tokens
-
-            # Check if the conversation was too long for the context window
-            finish_reason = response.choices[0].finish_reason
-            if finish_reason == "length":
-                raise Exception("The conversation was too long for the context window.")
-
-            # Check if the model's output included copyright material (or similar)
-            if finish_reason == "content_filter":
-                raise Exception("Content was filtered due to policy violations.")
-
-            # Else the model is responding directly to the user
-            if finish_reason in ("stop", "eos"):
-                metrics.tokens_consumed += tokens_consumed
-                yield response.choices[0].message.content
-
-            # Catch any other case, this is unexpected
-            else:
-                raise Exception("Unexpected API finish_reason:", finish_reason)
+            content = completion_text(response)
+            metrics.tokens_consumed += response.usage.total_tokens
+            metrics.prompt_tokens += response.usage.prompt_tokens or 0
+            metrics.completion_tokens += response.usage.completion_tokens or 0
+            metrics.cached_tokens += cached_tokens(response.usage)
+            yield content
         else:
             api_args["stream_options"] = {"include_usage": True}
 
@@ -62,6 +65,9 @@ class AsyncOAIEngine(AsyncChatEngine, ABC):
                         # With include_usage, the final chunk object should include the total tokens consumed
                         # So we can override our default assumption of 1 token on the final chunk
                         metrics.tokens_consumed = chunk.usage.total_tokens
+                        metrics.prompt_tokens = chunk.usage.prompt_tokens or 0
+                        metrics.completion_tokens = chunk.usage.completion_tokens or 0
+                        metrics.cached_tokens = cached_tokens(chunk.usage)
                     else:
                         # By default, assume 1 token per chunk
                         metrics.tokens_consumed += 1
@@ -69,3 +75,48 @@ class AsyncOAIEngine(AsyncChatEngine, ABC):
                 if chunk.choices:
                     if chunk.choices[0].delta.content:
                         yield chunk.choices[0].delta.content
+
+
+def cached_tokens(usage: CompletionUsage) -> int:
+    """
+    Get the number of prompt tokens read from the provider's prompt cache.
+
+    Args:
+        usage: Usage reported by the API
+
+    Returns:
+        int: Cached prompt tokens, or 0 if the provider doesn't report them
+    """
+    # Only some OpenAI-compatible providers report prompt token details
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+
+def completion_text(response: ChatCompletion) -> str:
+    """
+    Get the response text of a chat completion.
+
+    Args:
+        response: Completion returned by the API
+
+    Returns:
+        str: Content of the first choice
+
+    Raises:
+        Exception: If the completion didn't finish normally
+    """
+    # Check if the conversation was too long for the context window
+    finish_reason = response.choices[0].finish_reason
+    if finish_reason == "length":
+        raise Exception("The conversation was too long for the context window.")
+
+    # Check if the model's output included copyright material (or similar)
+    if finish_reason == "content_filter":
+        raise Exception("Content was filtered due to policy violations.")
+
+    # Else the model is responding directly to the user
+    if finish_reason in ("stop", "eos"):
+        return response.choices[0].message.content
+
+    # Catch any other case, this is unexpected
+    raise Exception("Unexpected API finish_reason:", finish_reason)
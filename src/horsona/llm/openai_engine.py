@@ -1,7 +1,19 @@
+import asyncio
+import json
+import time
+from typing import Any, Optional
+
 from openai import AsyncOpenAI, AsyncStream
+from openai.types import Batch
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
-from .oai_engine import AsyncOAIEngine
+from horsona.http.pool import get_http_client
+
+from .base_engine import BatchResult, LLMMetrics
+from .oai_engine import AsyncOAIEngine, cached_tokens, completion_text
+from .telemetry import RequestRecord
+
+_BATCH_DONE = ("completed", "failed", "expired", "cancelled")
 
 
 class AsyncOpenAIEngine(AsyncOAIEngine):
@@ -18,13 +30,105 @@ class AsyncOpenAIEngine(AsyncOAIEngine):
         AsyncOAIEngine: Base class for OpenAI-compatible API engines
     """
 
+    # Seconds between status checks of a submitted batch
+    batch_poll_interval = 30.0
+
     def __init__(self, model: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.model = model
-        self.client = AsyncOpenAI()
+        self.client = AsyncOpenAI(http_client=get_http_client())
 
     async def create(
         self, **kwargs
     ) -> AsyncStream[ChatCompletionChunk] | ChatCompletion:
         kwargs["model"] = self.model
         return await self.client.chat.completions.create(**kwargs)
+
+    async def submit_batch(
+        self, requests: list[dict[str, Any]]
+    ) -> Optional[list[BatchResult[str]]]:
+        # The requests are uploaded as a JSONL file, run by the Batch API within
+        # its 24h completion window, and matched back up by custom_id
+        metrics: list[Optional[LLMMetrics]] = []
+        lines = []
+        for i, api_args in enumerate(requests):
+            metrics.append(api_args.get("metrics"))
+            body = {k: v for k, v in api_args.items() if k not in ("metrics", "stream")}
+            body["model"] = self.model
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": str(i),
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": body,
+                    }
+                )
+            )
+
+        start = time.time()
+        input_file = await self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+        )
+        batch: Batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        while batch.status not in _BATCH_DONE:
+            await asyncio.sleep(self.batch_poll_interval)
+            batch = await self.client.batches.retrieve(batch.id)
+
+        results = [
+            BatchResult(
+                error=Exception(f"Batch {batch.id} {batch.status} without a result")
+            )
+            for _ in requests
+        ]
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                i = int(item["custom_id"])
+                results[i] = self._batch_item_result(item, start, metrics[i])
+
+        return results
+
+    def _batch_item_result(
+        self, item: dict[str, Any], start: float, metrics: Optional[LLMMetrics]
+    ) -> BatchResult[str]:
+        record = RequestRecord(
+            engine=self.telemetry.engine,
+            timestamp=start,
+            latency=time.time() - start,
+        )
+        try:
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                raise Exception(
+                    "Batch request failed:", item.get("error") or response.get("body")
+                )
+
+            completion = ChatCompletion.model_validate(response["body"])
+            record.prompt_tokens = completion.usage.prompt_tokens or 0
+            record.completion_tokens = completion.usage.completion_tokens or 0
+            record.cached_tokens = cached_tokens(completion.usage)
+            return BatchResult(value=completion_text(completion))
+        except Exception as e:
+            record.error = type(e).__name__
+            return BatchResult(error=e)
+        finally:
+            self.telemetry.record(record)
+            if metrics is not None:
+                metrics.tokens_consumed += record.prompt_tokens
+                metrics.tokens_consumed += record.completion_tokens
+                metrics.prompt_tokens += record.prompt_tokens
+                metrics.completion_tokens += record.completion_tokens
+                metrics.cached_tokens += record.cached_tokens
+                metrics.requests += 1
+                metrics.errors += record.error is not None
+                metrics.latency += record.latency
@@ -3,6 +3,8 @@ import os
 from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
+from horsona.http.pool import get_http_client
+
 from .oai_engine import AsyncOAIEngine
 
 
@@ -26,6 +28,7 @@ class AsyncOpenRouterEngine(AsyncOAIEngine):
         self.client = AsyncOpenAI(
             base_url=url,
             api_key=os.environ.get("OPENROUTER_API_KEY"),
+            http_client=get_http_client(),
         )
 
     async def create(
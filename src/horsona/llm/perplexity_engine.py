@@ -1,13 +1,14 @@
 import json
 import os
-from typing import Any, AsyncGenerator
+from typing import Any, AsyncGenerator, Optional, Type
 
-import httpx
+from pydantic import BaseModel
 
+from horsona.http.pool import get_http_client
 from horsona.llm.base_engine import LLMMetrics, tracks_metrics
 
 from .chat_engine import AsyncChatEngine
-from .engine_utils import clean_json_string
+from .engine_utils import clean_json_string, response_schema
 
 
 class AsyncPerplexityEngine(AsyncChatEngine):
@@ -56,10 +57,10 @@ class AsyncPerplexityEngine(AsyncChatEngine):
             "authorization": f"Bearer {self.apikey}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url, json=payload, headers=headers, timeout=None
-            )
+        response = await get_http_client().post(
+            url, json=payload, headers=headers, timeout=None
+        )
+        response.raise_for_status()
 
         raw_content = clean_json_string(response.content.decode("utf-8"))
         response_json = json.loads(raw_content)
@@ -67,9 +68,21 @@ class AsyncPerplexityEngine(AsyncChatEngine):
         total_tokens = response_json["usage"]["total_tokens"]
 
         metrics.tokens_consumed = total_tokens
+        metrics.prompt_tokens = response_json["usage"].get("prompt_tokens", 0)
+        metrics.completion_tokens = response_json["usage"].get("completion_tokens", 0)
 
         yield content
 
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"schema": response_schema(response_model)},
+            }
+        }
+
 
 def _clean_messages(messages: list[dict[str, str]]) -> list[dict[str, str]]:
     new_messages = []
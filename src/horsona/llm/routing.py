@@ -0,0 +1,420 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Generic, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Number of recent latencies kept per engine for percentiles
+LATENCY_WINDOW = 100
+
+
+class CircuitState(str, Enum):
+    """
+    State of an engine's circuit breaker.
+
+    CLOSED engines take traffic normally. OPEN engines failed too many times in a
+    row and are skipped until their cooldown ends. After that they're HALF_OPEN:
+    a single probe request is let through, which either closes the circuit or
+    opens it again with a longer cooldown.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class EngineHealth:
+    """
+    Routing state for one engine.
+
+    Attributes:
+        weight (float): Relative capacity of the engine. Higher weights get more
+            traffic.
+        ewma_latency (Optional[float]): Smoothed latency of successful calls
+        ewma_time_to_first_token (Optional[float]): Smoothed time to first token
+        outstanding (int): Calls currently in flight
+        state (CircuitState): Circuit breaker state
+        failures (int): Consecutive failed calls
+        open_until (float): When an open circuit becomes half-open
+        cooldown (float): Length of the current open period
+        probing (bool): Whether a half-open probe is in flight
+        selected (int): Number of times the engine was selected
+        latencies (deque[float]): Latencies of the most recent successful calls
+    """
+
+    def __init__(self, weight: float) -> None:
+        assert weight > 0, "Engine weights must be positive"
+        self.weight = weight
+        self.ewma_latency: Optional[float] = None
+        self.ewma_time_to_first_token: Optional[float] = None
+        self.outstanding = 0
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = 0.0
+        self.probing = False
+        self.selected = 0
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        # Heap entries with an older version are stale
+        self.version = 0
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """
+        Get a percentile of the engine's recent latencies.
+
+        Args:
+            percentile: Percentile between 0 and 1
+
+        Returns:
+            Optional[float]: The latency in seconds, or None if there are no
+                observations
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(percentile * len(ordered)), len(ordered) - 1)]
+
+
+class EngineRouter(Generic[T]):
+    """
+    Picks which engine serves each call of a MultiEngine.
+
+    Engines whose rate limits allow a call right now are ranked by weighted
+    least outstanding work: (outstanding + 1) * ewma_latency / weight, so fast,
+    idle engines are preferred. If none are available, the engine whose rate
+    limits free up first is used. Engines that fail repeatedly are taken out of
+    rotation by a circuit breaker and probed again after a cooldown that
+    doubles with every failed probe.
+
+    Selection uses heaps with lazy invalidation. Every change the router knows
+    about pushes a fresh entry and orphans the old one, and entries are
+    re-checked against the engine's current state when they reach the top, so
+    a selection costs O(log n) amortized instead of a sort.
+
+    Attributes:
+        engines (list[T]): Engines to route between
+        health (list[EngineHealth]): Routing state, parallel to engines
+        failure_threshold (int): Consecutive failures that open a circuit
+        cooldown (float): Seconds an opened circuit stays open at first
+        max_cooldown (float): Upper bound for the doubling cooldown
+        ewma_alpha (float): Weight of each new latency observation
+    """
+
+    def __init__(
+        self,
+        engines: Sequence[T],
+        weights: Optional[Sequence[float]] = None,
+        failure_threshold: int = 3,
+        cooldown: float = 5.0,
+        max_cooldown: float = 300.0,
+        ewma_alpha: float = 0.2,
+    ) -> None:
+        if weights is None:
+            weights = [1.0] * len(engines)
+        assert len(weights) == len(engines), "Need one weight per engine"
+        assert failure_threshold > 0, "failure_threshold must be positive"
+
+        self.engines = list(engines)
+        self._indices = {id(engine): i for i, engine in enumerate(self.engines)}
+        self.health = [EngineHealth(weight) for weight in weights]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.ewma_alpha = ewma_alpha
+
+        self._seq = itertools.count()
+        # (cost, seq, version, index) for engines that can take a call now
+        self._ready: list[tuple[float, int, int, int]] = []
+        # (next_allowed, seq, version, index) for rate limited engines
+        self._waiting: list[tuple[float, int, int, int]] = []
+        # (open_until, seq, version, index) for engines with open circuits
+        self._open: list[tuple[float, int, int, int]] = []
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+        now = time.time()
+        for index in range(len(self.engines)):
+            self._push(index, now)
+            self._publish(index)
+
+    def select(
+        self, exclude: Optional[T] = None, ready_only: bool = False
+    ) -> Optional[T]:
+        """
+        Pick an engine for a call and count the call as outstanding on it.
+
+        Every selected engine must later be passed to finish.
+
+        Args:
+            exclude: Engine that must not be picked
+            ready_only: Only pick engines whose rate limits allow a call now
+
+        Returns:
+            Optional[T]: The selected engine, or None if no engine qualifies
+        """
+        exclude_index = None if exclude is None else self._indices[id(exclude)]
+        index = self._best(time.time(), exclude_index, ready_only)
+        if index is None:
+            return None
+
+        health = self.health[index]
+        health.outstanding += 1
+        health.selected += 1
+        if health.state == CircuitState.HALF_OPEN:
+            health.probing = True
+        self._push(index, time.time())
+        self._publish(index)
+        return self.engines[index]
+
+    def peek(self) -> Optional[T]:
+        """
+        Get the engine that select would pick, without selecting it.
+
+        Returns:
+            Optional[T]: The best engine, or None if every circuit is open
+        """
+        index = self._best(time.time())
+        return None if index is None else self.engines[index]
+
+    async def acquire(self) -> T:
+        """
+        Select an engine, waiting for a circuit to become half-open if every
+        circuit is open.
+
+        Returns:
+            T: The selected engine
+        """
+        if not self.engines:
+            raise Exception("No engines available")
+
+        while True:
+            engine = self.select()
+            if engine is not None:
+                return engine
+
+            reopen = min(
+                (h.open_until for h in self.health if h.state == CircuitState.OPEN),
+                default=time.time(),
+            )
+            await asyncio.sleep(max(reopen - time.time(), 0.01))
+
+    def finish(
+        self,
+        engine: T,
+        success: Optional[bool],
+        latency: Optional[float] = None,
+        time_to_first_token: Optional[float] = None,
+    ) -> None:
+        """
+        Record the outcome of a call to a selected engine.
+
+        Args:
+            engine: Engine returned by select
+            success: Whether the call succeeded, or None if it was cancelled
+            latency: Seconds the call took, if it succeeded
+            time_to_first_token: Seconds until the first chunk, if known
+        """
+        index = self._indices[id(engine)]
+        health = self.health[index]
+        health.outstanding -= 1
+        was_probing = health.probing
+        health.probing = False
+        now = time.time()
+
+        if success:
+            health.failures = 0
+            health.state = CircuitState.CLOSED
+            health.cooldown = 0.0
+            if latency is not None:
+                health.latencies.append(latency)
+                if health.ewma_latency is None:
+                    self._latency_sum += latency
+                    self._latency_count += 1
+                    health.ewma_latency = latency
+                else:
+                    updated = health.ewma_latency + self.ewma_alpha * (
+                        latency - health.ewma_latency
+                    )
+                    self._latency_sum += updated - health.ewma_latency
+                    health.ewma_latency = updated
+            if time_to_first_token is not None:
+                if health.ewma_time_to_first_token is None:
+                    health.ewma_time_to_first_token = time_to_first_token
+                else:
+                    health.ewma_time_to_first_token += self.ewma_alpha * (
+                        time_to_first_token - health.ewma_time_to_first_token
+                    )
+        elif success is not None:
+            health.failures += 1
+            if was_probing or health.state == CircuitState.HALF_OPEN:
+                self._open_circuit(
+                    health,
+                    now,
+                    min(max(health.cooldown * 2, self.cooldown), self.max_cooldown),
+                )
+            elif (
+                health.state == CircuitState.CLOSED
+                and health.failures >= self.failure_threshold
+            ):
+                self._open_circuit(health, now, self.cooldown)
+
+        self._push(index, now)
+        self._publish(index)
+
+    def health_of(self, engine: T) -> EngineHealth:
+        """
+        Get the routing state of an engine.
+
+        Args:
+            engine: One of the router's engines
+
+        Returns:
+            EngineHealth: The engine's routing state
+        """
+        return self.health[self._indices[id(engine)]]
+
+    def stats(self) -> list[dict[str, Any]]:
+        """
+        Get the routing state of every engine.
+
+        Returns:
+            list[dict[str, Any]]: One entry per engine, in engine order
+        """
+        return [
+            {
+                "engine": _engine_name(engine),
+                "weight": health.weight,
+                "state": health.state.value,
+                "outstanding": health.outstanding,
+                "failures": health.failures,
+                "selected": health.selected,
+                "ewma_latency": health.ewma_latency,
+                "ewma_time_to_first_token": health.ewma_time_to_first_token,
+            }
+            for engine, health in zip(self.engines, self.health)
+        ]
+
+    def _open_circuit(self, health: EngineHealth, now: float, cooldown: float) -> None:
+        health.state = CircuitState.OPEN
+        health.cooldown = cooldown
+        health.open_until = now + cooldown
+
+    def _default_latency(self) -> float:
+        # Engines without observations are assumed to be average
+        if self._latency_count == 0:
+            return 1.0
+        return self._latency_sum / self._latency_count
+
+    def _cost(self, health: EngineHealth) -> float:
+        latency = health.ewma_latency
+        if latency is None:
+            latency = self._default_latency()
+        return (health.outstanding + 1) * latency / health.weight
+
+    def _next_allowed(self, index: int) -> float:
+        rate_limit = vars(self.engines[index]).get("rate_limit")
+        if rate_limit is None:
+            return 0.0
+        # next_allowed returns the current time when a call is allowed
+        next_allowed = rate_limit.next_allowed()
+        return next_allowed if next_allowed > time.time() else 0.0
+
+    def _push(self, index: int, now: float) -> None:
+        health = self.health[index]
+        health.version += 1
+        entry_base = (next(self._seq), health.version, index)
+
+        if health.state == CircuitState.OPEN:
+            heapq.heappush(self._open, (health.open_until, *entry_base))
+            return
+        if health.probing:
+            # Half-open engines only take one probe at a time
+            return
+
+        next_allowed = self._next_allowed(index)
+        if next_allowed <= now:
+            heapq.heappush(self._ready, (self._cost(health), *entry_base))
+        else:
+            heapq.heappush(self._waiting, (next_allowed, *entry_base))
+
+    def _valid(self, entry: tuple[float, int, int, int]) -> bool:
+        return self.health[entry[3]].version == entry[2]
+
+    def _best(
+        self, now: float, exclude: Optional[int] = None, ready_only: bool = False
+    ) -> Optional[int]:
+        # Circuits whose cooldown ended become half-open
+        while self._open and self._open[0][0] <= now:
+            entry = heapq.heappop(self._open)
+            if self._valid(entry):
+                self.health[entry[3]].state = CircuitState.HALF_OPEN
+                self._push(entry[3], now)
+                self._publish(entry[3])
+
+        # Rate limited engines whose limits freed up become ready
+        while self._waiting and self._waiting[0][0] <= now:
+            entry = heapq.heappop(self._waiting)
+            if self._valid(entry):
+                self._push(entry[3], now)
+
+        best = None
+        held = None
+        while self._ready:
+            cost, _, _, index = entry = self._ready[0]
+            if not self._valid(entry):
+                heapq.heappop(self._ready)
+                continue
+
+            # The entry may be out of date if the engine was used elsewhere
+            health = self.health[index]
+            if self._next_allowed(index) > now or self._cost(health) > cost + 1e-9:
+                self._push(index, now)
+                continue
+
+            if index == exclude:
+                held = heapq.heappop(self._ready)
+                continue
+
+            best = index
+            break
+
+        if held is not None:
+            heapq.heappush(self._ready, held)
+            held = None
+        if best is not None or ready_only:
+            return best
+
+        while self._waiting:
+            entry = self._waiting[0]
+            if not self._valid(entry):
+                heapq.heappop(self._waiting)
+            elif entry[3] == exclude:
+                held = heapq.heappop(self._waiting)
+            else:
+                best = entry[3]
+                break
+
+        if held is not None:
+            heapq.heappush(self._waiting, held)
+        return best
+
+    def _publish(self, index: int) -> None:
+        telemetry = vars(self.engines[index]).get("telemetry")
+        if telemetry is None:
+            return
+
+        health = self.health[index]
+        telemetry.routed = health.selected
+        telemetry.outstanding = health.outstanding
+        telemetry.circuit_state = health.state.value
+        telemetry.ewma_latency = health.ewma_latency
+        telemetry.ewma_time_to_first_token = health.ewma_time_to_first_token
+
+
+def _engine_name(engine: Any) -> str:
+    name = vars(engine).get("name")
+    return name if name is not None else type(engine).__name__
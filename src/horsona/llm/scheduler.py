@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from horsona.llm.base_engine import RateLimits
+
+
+class Priority(IntEnum):
+    """
+    Priority classes for LLM requests. Lower values are admitted first.
+
+    INTERACTIVE is for requests a user is waiting on, BACKGROUND for work like
+    ingesting documents, and BATCH for bulk jobs that should only use capacity
+    nothing else needs.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    BATCH = 2
+
+
+_current_priority: ContextVar[tuple[Priority, Optional[str]]] = ContextVar(
+    "horsona_request_priority", default=(Priority.INTERACTIVE, None)
+)
+
+
+@contextmanager
+def request_priority(
+    priority: Priority, session: Optional[str] = None
+) -> Iterator[None]:
+    """
+    Set the priority of every LLM request made within the block.
+
+    The priority is stored in a context variable, so it also applies to tasks
+    created within the block.
+
+    Args:
+        priority: Priority class of the requests
+        session: Requests from different sessions in the same priority class
+            share capacity fairly. Defaults to the enclosing session.
+
+    Example:
+        >>> with request_priority(Priority.BACKGROUND):
+        ...     await wiki.add_file("notes/ponies.txt", Value("Ponies", content))
+    """
+    if session is None:
+        session = _current_priority.get()[1]
+
+    token = _current_priority.set((Priority(priority), session))
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> tuple[Priority, Optional[str]]:
+    """
+    Get the priority that applies to requests made from the current context.
+
+    Returns:
+        tuple[Priority, Optional[str]]: Priority class and session
+    """
+    return _current_priority.get()
+
+
+class _Request:
+    __slots__ = ("key", "priority", "session", "tag", "wake")
+
+    def __init__(
+        self, priority: Priority, session: Optional[str], tag: int, seq: int
+    ) -> None:
+        self.key = (priority, tag, seq)
+        self.priority = priority
+        self.session = session
+        self.tag = tag
+        self.wake = asyncio.Event()
+
+    def __lt__(self, other: "_Request") -> bool:
+        return self.key < other.key
+
+
+class RequestScheduler:
+    """
+    Admits requests to an engine in priority order.
+
+    Requests wait in a single queue per engine. Only the request at the head of
+    the queue waits on the rate limits, so whenever capacity frees up it goes to
+    the most important waiting request rather than to whichever caller happens
+    to wake first. Within a priority class, sessions are served round-robin
+    using start-time fair queuing, so one session with many queued requests
+    can't starve another.
+
+    Attributes:
+        rate_limit (RateLimits): Limits that admitted requests consume
+        admitted (dict[Priority, int]): Number of requests admitted per class
+    """
+
+    def __init__(self, rate_limit: "RateLimits") -> None:
+        self.rate_limit = rate_limit
+        self.admitted = {priority: 0 for priority in Priority}
+        self._queue: list[_Request] = []
+        self._seq = itertools.count()
+        # Virtual start tag of the most recently admitted request in each class
+        self._virtual_time = {priority: 0 for priority in Priority}
+        # Virtual start tag of the last queued request of each session
+        self._session_tags: dict[tuple[Priority, Optional[str]], int] = {}
+
+    def queued(self, priority: Optional[Priority] = None) -> int:
+        """
+        Get the number of requests waiting to be admitted.
+
+        Args:
+            priority: Only count requests in this class
+
+        Returns:
+            int: Number of waiting requests
+        """
+        if priority is None:
+            return len(self._queue)
+        return sum(1 for request in self._queue if request.priority == priority)
+
+    async def admit(self, expected_tokens: int) -> None:
+        """
+        Wait for this request's turn, then consume one call and reserve the
+        expected tokens from the rate limits.
+
+        The request's priority and session come from request_priority.
+
+        Args:
+            expected_tokens: Estimated prompt tokens to reserve
+        """
+        priority, session = current_priority()
+        session_key = (priority, session)
+        tag = max(self._session_tags.get(session_key, 0), self._virtual_time[priority])
+        self._session_tags[session_key] = tag + 1
+
+        request = _Request(priority, session, tag, next(self._seq))
+        overtaken = self._queue[0] if self._queue else None
+        heapq.heappush(self._queue, request)
+        if overtaken is not None and self._queue[0] is request:
+            # Let the previous head know it has to wait for its turn again
+            overtaken.wake.set()
+
+        ready_at = None
+        try:
+            while True:
+                request.wake.clear()
+                if self._queue[0] is not request:
+                    ready_at = None
+                    await request.wake.wait()
+                    continue
+
+                # The deadline is fixed once this request reaches the head so
+                # that wakeups don't restart its wait
+                if ready_at is None:
+                    ready_at = self.rate_limit.next_allowed(expected_tokens)
+                delay = ready_at - self.rate_limit.clock()
+                if delay <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(request.wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._queue.remove(request)
+            heapq.heapify(self._queue)
+            self._wake_head()
+            raise
+
+        heapq.heappop(self._queue)
+        self.admitted[priority] += 1
+        self._virtual_time[priority] = tag
+        if self._session_tags.get(session_key) == tag + 1:
+            # Nothing else from this session is queued
+            del self._session_tags[session_key]
+
+        try:
+            # The limits were checked above, so these don't wait unless another
+            # caller bypassed the scheduler
+            await self.rate_limit.consume_call()
+            await self.rate_limit.reserve_tokens(expected_tokens)
+        finally:
+            self._wake_head()
+
+    def _wake_head(self) -> None:
+        if self._queue:
+            self._queue[0].wake.set()
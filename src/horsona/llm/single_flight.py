@@ -0,0 +1,62 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls into a single call.
+
+    While a call for a key is in flight, later calls with the same key await the
+    original call's result instead of starting their own. The shared call is only
+    cancelled once every caller waiting on it has been cancelled.
+
+    Attributes:
+        coalesced (int): Number of calls that were served by another in-flight call
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, _Call] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn, or join an in-flight call with the same key.
+
+        Args:
+            key: Identifies the call. Calls with equal keys must be interchangeable.
+            fn: Starts the call if none is in flight
+
+        Returns:
+            T: The result of the (possibly shared) call
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def in_flight(self) -> int:
+        """Return the number of distinct calls currently in flight."""
+        return len(self._calls)
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,397 @@
+import json
+import weakref
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+@dataclass
+class RequestRecord:
+    """
+    Telemetry for a single LLM API call.
+
+    Attributes:
+        engine (str): Name of the engine that served the call
+        timestamp (float): Unix time when the call started
+        prompt_tokens (int): Prompt tokens reported by the provider
+        completion_tokens (int): Completion tokens reported by the provider
+        cached_tokens (int): Prompt tokens the provider read from its prompt cache
+        time_to_first_token (Optional[float]): Seconds from sending the request to
+            the first response chunk, or None if no chunk arrived
+        latency (float): Seconds from the start of the call to its end, including
+            rate limit waits
+        rate_limit_wait (float): Seconds spent waiting for a concurrency slot and
+            on rate limits
+        error (Optional[str]): Exception type name if the call failed
+    """
+
+    engine: str
+    timestamp: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    time_to_first_token: Optional[float] = None
+    latency: float = 0.0
+    rate_limit_wait: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class Histogram:
+    """Cumulative histogram in the Prometheus style."""
+
+    buckets: tuple[float, ...] = LATENCY_BUCKETS
+    counts: list[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    count: int = 0
+    sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class EngineTelemetry:
+    """
+    Aggregated telemetry for one engine.
+
+    Every engine owns one of these as its telemetry attribute. Completed calls are
+    recorded here and forwarded to all registered exporters.
+
+    Attributes:
+        engine (str): Name of the engine
+        requests (int): Number of completed calls, including failed ones
+        errors (int): Number of failed calls
+        retries (int): Number of times a call to this engine was retried
+        prompt_tokens (int): Total prompt tokens
+        completion_tokens (int): Total completion tokens
+        cached_tokens (int): Total prompt tokens read from the provider's prompt
+            cache
+        rate_limit_wait (float): Total seconds spent waiting on rate limits
+        latency (Histogram): Distribution of call latencies
+        time_to_first_token (Histogram): Distribution of time to first token
+        routed (int): Times a MultiEngine router selected this engine
+        hedges (int): Times a slow call to this engine was hedged on another
+        hedge_wins (int): Times this engine answered a hedged call first
+        stream_failures (int): Routed streams that failed before their first chunk
+        stream_interruptions (int): Routed streams that failed after their first
+            chunk
+        stream_resumes (int): Interrupted streams this engine continued
+        outstanding (int): Routed calls currently in flight
+        in_flight (int): Calls currently holding one of the engine's
+            concurrency slots
+        queued (int): Calls waiting for a concurrency slot
+        rejected (int): Calls rejected because the engine's queue was full
+        circuit_state (str): State of the router's circuit breaker
+        ewma_latency (Optional[float]): Latency estimate used for routing
+        ewma_time_to_first_token (Optional[float]): Time to first token estimate
+            used for routing
+    """
+
+    def __init__(self, engine: str, track: bool = True) -> None:
+        self.engine = engine
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.rate_limit_wait = 0.0
+        self.latency = Histogram()
+        self.time_to_first_token = Histogram()
+        self.routed = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.stream_failures = 0
+        self.stream_interruptions = 0
+        self.stream_resumes = 0
+        self.outstanding = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.circuit_state = "closed"
+        self.ewma_latency: Optional[float] = None
+        self.ewma_time_to_first_token: Optional[float] = None
+        if track:
+            _telemetry.add(self)
+
+    def record(self, record: RequestRecord) -> None:
+        """
+        Add a completed call to the totals and send it to the exporters.
+
+        Args:
+            record: Telemetry for the call
+        """
+        self.requests += 1
+        if record.error is not None:
+            self.errors += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_tokens += record.cached_tokens
+        self.rate_limit_wait += record.rate_limit_wait
+        self.latency.observe(record.latency)
+        if record.time_to_first_token is not None:
+            self.time_to_first_token.observe(record.time_to_first_token)
+
+        for exporter in list(_exporters):
+            exporter.export(record)
+
+    def record_retry(self) -> None:
+        """Count a retry of a call that failed on this engine."""
+        self.retries += 1
+
+    def merge(self, other: "EngineTelemetry") -> None:
+        """
+        Add another engine's totals to this one.
+
+        Args:
+            other: Telemetry to add
+        """
+        self.requests += other.requests
+        self.errors += other.errors
+        self.retries += other.retries
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.rate_limit_wait += other.rate_limit_wait
+        self.routed += other.routed
+        self.hedges += other.hedges
+        self.hedge_wins += other.hedge_wins
+        self.stream_failures += other.stream_failures
+        self.stream_interruptions += other.stream_interruptions
+        self.stream_resumes += other.stream_resumes
+        self.outstanding += other.outstanding
+        self.in_flight += other.in_flight
+        self.queued += other.queued
+        self.rejected += other.rejected
+        if other.circuit_state != "closed":
+            self.circuit_state = other.circuit_state
+        if other.ewma_latency is not None:
+            self.ewma_latency = other.ewma_latency
+        if other.ewma_time_to_first_token is not None:
+            self.ewma_time_to_first_token = other.ewma_time_to_first_token
+        for mine, theirs in (
+            (self.latency, other.latency),
+            (self.time_to_first_token, other.time_to_first_token),
+        ):
+            mine.count += theirs.count
+            mine.sum += theirs.sum
+            mine.counts = [a + b for a, b in zip(mine.counts, theirs.counts)]
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Get the current totals.
+
+        Returns:
+            dict[str, Any]: Counters, with latency and time to first token
+                summarized as means
+        """
+        return {
+            "engine": self.engine,
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "rate_limit_wait": self.rate_limit_wait,
+            "mean_latency": _mean(self.latency),
+            "mean_time_to_first_token": _mean(self.time_to_first_token),
+            "routed": self.routed,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "stream_failures": self.stream_failures,
+            "stream_interruptions": self.stream_interruptions,
+            "stream_resumes": self.stream_resumes,
+            "outstanding": self.outstanding,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "circuit_state": self.circuit_state,
+            "ewma_latency": self.ewma_latency,
+            "ewma_time_to_first_token": self.ewma_time_to_first_token,
+        }
+
+
+class MetricsExporter(ABC):
+    """
+    Receives a record for every completed LLM API call.
+
+    Register exporters with add_exporter. Exporters are called synchronously from
+    the engine's event loop, so they should not block for long.
+    """
+
+    @abstractmethod
+    def export(self, record: RequestRecord) -> None:
+        """
+        Handle a completed call.
+
+        Args:
+            record: Telemetry for the call
+        """
+        ...
+
+
+class InMemoryExporter(MetricsExporter):
+    """
+    Keeps the most recent records in memory.
+
+    Attributes:
+        records (deque[RequestRecord]): Recorded calls, oldest first
+    """
+
+    def __init__(self, max_records: Optional[int] = 10000) -> None:
+        self.records: deque[RequestRecord] = deque(maxlen=max_records)
+
+    def export(self, record: RequestRecord) -> None:
+        self.records.append(record)
+
+
+class JsonlExporter(MetricsExporter):
+    """
+    Appends each record as a line of JSON to a file.
+
+    Attributes:
+        path (str): Path of the JSONL file
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def export(self, record: RequestRecord) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(asdict(record)) + "\n")
+
+
+_exporters: list[MetricsExporter] = []
+_telemetry: "weakref.WeakSet[EngineTelemetry]" = weakref.WeakSet()
+
+
+def add_exporter(exporter: MetricsExporter) -> None:
+    """
+    Send records for every subsequent LLM API call to an exporter.
+
+    Args:
+        exporter: Exporter to register
+    """
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter: MetricsExporter) -> None:
+    """
+    Stop sending records to an exporter.
+
+    Args:
+        exporter: Previously registered exporter
+    """
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+def all_telemetry() -> list[EngineTelemetry]:
+    """
+    Get the telemetry of every live engine.
+
+    Returns:
+        list[EngineTelemetry]: Telemetry sorted by engine name
+    """
+    return sorted(_telemetry, key=lambda t: t.engine)
+
+
+def render_prometheus() -> str:
+    """
+    Render the telemetry of every live engine in the Prometheus text format.
+
+    Engines that share a name are merged into a single series.
+
+    Returns:
+        str: Prometheus exposition text
+    """
+    merged: dict[str, EngineTelemetry] = {}
+    for telemetry in all_telemetry():
+        if telemetry.engine not in merged:
+            merged[telemetry.engine] = EngineTelemetry(telemetry.engine, track=False)
+        merged[telemetry.engine].merge(telemetry)
+
+    lines = []
+    counters = [
+        ("requests", "Completed LLM API calls"),
+        ("errors", "Failed LLM API calls"),
+        ("retries", "Retried LLM API calls"),
+        ("prompt_tokens", "Prompt tokens consumed"),
+        ("completion_tokens", "Completion tokens generated"),
+        ("cached_tokens", "Prompt tokens read from the provider's prompt cache"),
+        ("rate_limit_wait", "Seconds spent waiting on rate limits"),
+        ("routed", "Calls routed to the engine by a MultiEngine"),
+        ("hedges", "Slow calls to the engine that were hedged on another"),
+        ("hedge_wins", "Hedged calls the engine answered first"),
+        ("stream_failures", "Routed streams that failed before the first chunk"),
+        ("stream_interruptions", "Routed streams that failed mid-response"),
+        ("stream_resumes", "Interrupted streams the engine continued"),
+        ("rejected", "Calls rejected because the engine's queue was full"),
+    ]
+    for attr, help_text in counters:
+        metric = f"horsona_llm_{attr}"
+        if attr == "rate_limit_wait":
+            metric += "_seconds"
+        lines.append(f"# HELP {metric}_total {help_text}")
+        lines.append(f"# TYPE {metric}_total counter")
+        for engine, telemetry in merged.items():
+            lines.append(
+                f'{metric}_total{{engine="{_escape(engine)}"}} {getattr(telemetry, attr)}'
+            )
+
+    gauges = [
+        ("outstanding", "Routed calls in flight"),
+        ("in_flight", "Calls holding one of the engine's concurrency slots"),
+        ("queued", "Calls waiting for a concurrency slot"),
+        ("circuit_open", "1 if the engine's circuit breaker is open, else 0"),
+        ("ewma_latency_seconds", "Smoothed latency used for routing"),
+        ("ewma_time_to_first_token_seconds", "Smoothed time to first token"),
+    ]
+    for name, help_text in gauges:
+        metric = f"horsona_llm_{name}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for engine, telemetry in merged.items():
+            if name == "circuit_open":
+                value = int(telemetry.circuit_state == "open")
+            else:
+                value = getattr(telemetry, name.removesuffix("_seconds"))
+            if value is not None:
+                lines.append(f'{metric}{{engine="{_escape(engine)}"}} {value}')
+
+    histograms = [
+        ("latency", "LLM API call latency"),
+        ("time_to_first_token", "Time to the first response chunk"),
+    ]
+    for attr, help_text in histograms:
+        metric = f"horsona_llm_{attr}_seconds"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for engine, telemetry in merged.items():
+            histogram: Histogram = getattr(telemetry, attr)
+            label = f'engine="{_escape(engine)}"'
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum{{{label}}} {histogram.sum}")
+            lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _mean(histogram: Histogram) -> Optional[float]:
+    if histogram.count == 0:
+        return None
+    return histogram.sum / histogram.count
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
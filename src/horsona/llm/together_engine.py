@@ -1,8 +1,10 @@
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Optional, Type
 
+from pydantic import BaseModel
 from together import AsyncTogether
 from together.types import ChatCompletionChunk, ChatCompletionResponse
 
+from horsona.llm.engine_utils import response_schema
 from horsona.llm.oai_engine import AsyncOAIEngine
 
 
@@ -48,3 +50,13 @@ class AsyncTogetherEngine(AsyncOAIEngine):
         """
         kwargs["model"] = self.model
         return await self.client.chat.completions.create(**kwargs)
+
+    def structured_output_args(
+        self, response_model: Type[BaseModel]
+    ) -> Optional[dict[str, Any]]:
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "schema": response_schema(response_model),
+            }
+        }
@@ -0,0 +1,134 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Any
+
+from horsona.autodiff.basic import HorseData
+
+# Approximate per-message formatting overhead added by chat APIs
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenEstimator(HorseData, ABC):
+    """
+    Estimates how many tokens a prompt will consume before it is sent.
+
+    Estimates are used to reserve token budget against rate limits. After a call
+    completes, engines report the actual prompt token count through calibrate so
+    estimators can correct themselves.
+    """
+
+    @abstractmethod
+    def estimate(self, text: str) -> int:
+        """
+        Estimate the number of tokens in a piece of text.
+
+        Args:
+            text: Text to estimate
+
+        Returns:
+            int: Estimated token count
+        """
+        ...
+
+    def calibrate(self, text: str, actual_tokens: int) -> None:
+        """
+        Update the estimator using the actual token count for a prompt.
+
+        Args:
+            text: Text that was sent
+            actual_tokens: Token count reported by the provider
+        """
+        pass
+
+    def estimate_messages(self, messages: list[dict[str, Any]]) -> int:
+        """
+        Estimate the number of prompt tokens for a list of chat messages.
+
+        Args:
+            messages: Chat messages
+
+        Returns:
+            int: Estimated token count
+        """
+        return self.estimate(messages_text(messages)) + MESSAGE_OVERHEAD_TOKENS * len(
+            messages
+        )
+
+
+class CharsPerTokenEstimator(TokenEstimator):
+    """
+    Estimates tokens from character counts.
+
+    The characters-per-token ratio is calibrated from actual usage using an
+    exponential moving average, so it converges to the provider's tokenizer.
+
+    Attributes:
+        chars_per_token (float): Current characters-per-token ratio
+        smoothing (float): Weight given to each new observation
+    """
+
+    def __init__(self, chars_per_token: float = 4.0, smoothing: float = 0.1) -> None:
+        super().__init__()
+        assert chars_per_token > 0, "chars_per_token must be positive"
+        assert 0 <= smoothing <= 1, "smoothing must be between 0 and 1"
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+
+    def estimate(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def calibrate(self, text: str, actual_tokens: int) -> None:
+        if actual_tokens <= 0 or not text:
+            return
+
+        observed = len(text) / actual_tokens
+        self.chars_per_token += self.smoothing * (observed - self.chars_per_token)
+
+
+class TiktokenEstimator(TokenEstimator):
+    """
+    Estimates tokens with a local tiktoken encoding.
+
+    Requires the optional tiktoken package.
+
+    Attributes:
+        encoding (str): Name of the tiktoken encoding
+    """
+
+    def __init__(self, encoding: str = "o200k_base") -> None:
+        super().__init__()
+        try:
+            import tiktoken
+        except ImportError:
+            raise ImportError(
+                "TiktokenEstimator requires tiktoken. Install it with `pip install tiktoken`."
+            )
+
+        self.encoding = encoding
+        self.tokenizer = tiktoken.get_encoding(encoding)
+
+    def estimate(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, disallowed_special=()))
+
+
+def messages_text(messages: list[dict[str, Any]]) -> str:
+    """
+    Concatenate the text content of chat messages.
+
+    Args:
+        messages: Chat messages with string or content-block contents
+
+    Returns:
+        str: All text content joined by newlines
+    """
+    pieces = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            pieces.append(content)
+        elif isinstance(content, list):
+            for block in content:
+                if isinstance(block, dict) and isinstance(block.get("text"), str):
+                    pieces.append(block["text"])
+
+    return "\n".join(pieces)
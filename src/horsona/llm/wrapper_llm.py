@@ -11,10 +11,20 @@ S = TypeVar("S", bound=Union[str, T])
 
 
 class WrapperLLMEngine(AsyncLLMEngine):
+    # Prompt args added by hook_prompt_args that rarely change between calls.
+    # They're passed down as stable_prompt_args, so chat engines put them first
+    # in the prompt where providers can cache them.
+    stable_prompt_args: tuple[str, ...] = ()
+
     def __init__(self, underlying_llm: AsyncLLMEngine, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.underlying_llm = underlying_llm
 
+    def check_capacity(self) -> None:
+        # Calls end up queued on the underlying engine
+        super().check_capacity()
+        self.underlying_llm.check_capacity()
+
     async def query_response(self, metrics: LLMMetrics = None, **kwargs) -> str:
         if "TASK" not in kwargs:
             kwargs["TASK"] = (
@@ -114,6 +124,13 @@ class WrapperLLMEngine(AsyncLLMEngine):
         if added_history:
             prompt_args.pop("CHAT_HISTORY")
 
+        if self.stable_prompt_args:
+            stable_args = list(api_args.get("stable_prompt_args", ()))
+            stable_args.extend(
+                k for k in self.stable_prompt_args if k not in stable_args
+            )
+            api_args["stable_prompt_args"] = stable_args
+
         return {**prompt_args, **api_args}
 
 
@@ -14,6 +14,10 @@ T = TypeVar("T", bound=BaseModel)
 S = TypeVar("S", bound=Union[str, T])
 
 
+class Search(BaseModel):
+    queries: dict[str, int]
+
+
 class EmbeddingLLMEngine(WrapperLLMEngine):
     def __init__(
         self,
@@ -35,11 +39,13 @@ class EmbeddingLLMEngine(WrapperLLMEngine):
             predecessors=[],
         )
 
-        # Look up responses for each search query
+        # Look up responses for all search queries in one batch
+        results = await self.database.query_many_with_weights(
+            [q.value for q in search_queries.value], **self.database_query_kwargs
+        )
         search_results = defaultdict(lambda: [])
-        for q in search_queries.value:
-            result = await self.database.query(q.value, **self.database_query_kwargs)
-            for key, value in result.items():
+        for result in results:
+            for key, (value, _) in result.items():
                 search_results[key].append(value)
 
         return search_results
@@ -55,9 +61,6 @@ class EmbeddingLLMEngine(WrapperLLMEngine):
 
 async def get_relevant_queries(llm: AsyncLLMEngine, **kwargs) -> dict[str, int]:
     # Convert prompt into search queries
-    class Search(BaseModel):
-        queries: dict[str, int]
-
     assert "TASK" in kwargs
     kwargs["EMBEDDING_TASK"] = kwargs.pop("TASK")
 
@@ -1,7 +1,13 @@
+from bisect import bisect_left
+
 from horsona.autodiff.basic import HorseModule
 from horsona.autodiff.variables import Value
 from horsona.llm.base_engine import AsyncLLMEngine
-from horsona.llm.engine_utils import compile_user_prompt
+from horsona.llm.engine_utils import (
+    compile_item_length,
+    compile_user_prompt_length,
+    list_prompt_length,
+)
 
 
 class GistModule(HorseModule):
@@ -25,6 +31,8 @@ class GistModule(HorseModule):
         available_gists: list[Value[str]] = None,
         available_pages: list[Value[str]] = None,
         page_lengths: list[int] = None,
+        page_offsets: list[int] = None,
+        gist_offsets: list[int] = None,
         **kwargs,
     ):
         """
@@ -47,6 +55,10 @@ class GistModule(HorseModule):
         self.available_gists = available_gists if available_gists is not None else []
         self.available_pages = available_pages if available_pages is not None else []
         self.page_lengths = page_lengths if page_lengths is not None else []
+        # Prefix sums of compile_item_length over the pages and gists, so the
+        # prompt length of any run of them can be computed without serializing
+        self.page_offsets = page_offsets if page_offsets is not None else [0]
+        self.gist_offsets = gist_offsets if gist_offsets is not None else [0]
         self.max_gist_chars = max_gist_chars
         self.max_page_chars = max_page_chars
 
@@ -62,27 +74,15 @@ class GistModule(HorseModule):
             Value[str]: Gist of the provided page
         """
 
-        page_context = []
-        i = len(self.available_pages) - 1
-        while i > 0:
-            if len(await compile_user_prompt(ITEMS=page_context)) > self.max_page_chars:
-                if page_context:
-                    page_context.pop()
-                break
-            page_context.append(self.available_pages[i])
-            i -= 1
-
-        page_context.reverse()
-
-        gist_context = []
-        for j in range(i, 0, -1):
-            if len(await compile_user_prompt(ITEMS=gist_context)) > self.max_gist_chars:
-                if gist_context:
-                    gist_context.pop()
-                break
-            gist_context.append(self.available_gists[j])
+        await self._sync_offsets()
 
-        gist_context.reverse()
+        # The most recent pages that fit, preceded by gists of the pages before
+        # them
+        end = len(self.available_pages)
+        page_start = _fitting_start(self.page_offsets, end, self.max_page_chars)
+        gist_start = _fitting_start(self.gist_offsets, page_start, self.max_gist_chars)
+        page_context = self.available_pages[page_start:end]
+        gist_context = self.available_gists[gist_start:page_start]
 
         page_summary = await self.llm.query_block(
             "text",
@@ -96,10 +96,43 @@ class GistModule(HorseModule):
 
         self.available_gists.append(page_summary)
         self.available_pages.append(page)
-        self.page_lengths.append(len(await compile_user_prompt(ITEM=page)))
+        self.page_lengths.append(await compile_user_prompt_length(ITEM=page))
+        self.page_offsets.append(
+            self.page_offsets[-1] + await compile_item_length(page)
+        )
+        self.gist_offsets.append(
+            self.gist_offsets[-1] + await compile_item_length(page_summary)
+        )
 
         return Value("Summary", page_summary, predecessors=[page])
 
+    async def _sync_offsets(self) -> None:
+        """Rebuild the prefix sums if they don't match the stored pages."""
+        for items, offsets in [
+            (self.available_pages, self.page_offsets),
+            (self.available_gists, self.gist_offsets),
+        ]:
+            if len(offsets) != len(items) + 1:
+                offsets[:] = [0]
+                for item in items:
+                    offsets.append(offsets[-1] + await compile_item_length(item))
+
+
+def _fitting_start(offsets: list[int], end: int, max_chars: int) -> int:
+    """
+    Find the earliest start such that items[start:end], passed as a list to
+    compile_user_prompt, is at most max_chars long.
+
+    The prompt length only grows as the start moves back, so the start is found
+    by binary search over the prefix sums.
+    """
+
+    def fits(start: int) -> bool:
+        length = offsets[end] - offsets[start]
+        return list_prompt_length("ITEMS", length, end - start) <= max_chars
+
+    return bisect_left(range(end), True, key=fits)
+
 
 def paginate(
     text: str, max_chars_per_page: int, paragraph_split: str = "\n\n"
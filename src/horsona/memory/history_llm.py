@@ -11,6 +11,8 @@ S = TypeVar("S", bound=Union[str, T])
 
 
 class HistoryLLMEngine(WrapperLLMEngine):
+    stable_prompt_args = ("HISTORY_CONTEXT",)
+
     def __init__(
         self,
         underlying_llm: AsyncLLMEngine,
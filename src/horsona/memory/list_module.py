@@ -2,7 +2,11 @@ from typing import Generic, TypeVar
 
 from horsona.autodiff.basic import HorseData, HorseModule
 from horsona.autodiff.variables import ListValue
-from horsona.llm.engine_utils import compile_user_prompt
+from horsona.llm.engine_utils import (
+    compile_item_length,
+    compile_user_prompt_length,
+    list_prompt_length,
+)
 
 T = TypeVar("T", bound=HorseData)
 
@@ -26,6 +30,9 @@ class ListModule(HorseModule, Generic[T]):
         min_item_length: int = 256,
         item_lengths: list[int] = None,
         pending_items: list[T] = None,
+        pending_lengths: list[int] = None,
+        total_length: int = None,
+        pending_total: int = None,
         **kwargs,
     ):
         """
@@ -33,12 +40,28 @@ class ListModule(HorseModule, Generic[T]):
 
         Args:
             items (list[T], optional): Initial list of items to store
+            max_length (int): Maximum prompt length of the stored items
+            min_item_length (int): Prompt length at which pending items are
+                aggregated into a single stored item
+            item_lengths (list[int], optional): Prompt length of each stored item
+            pending_items (list[T], optional): Items not yet aggregated
+            pending_lengths (list[int], optional): Length each pending item adds
+                to the pending list's prompt, from compile_item_length
+            total_length (int, optional): Sum of item_lengths
+            pending_total (int, optional): Sum of pending_lengths
             **kwargs: Additional keyword arguments for parent HorseModule
         """
         super().__init__(**kwargs)
         self.items = items if items is not None else []
         self.pending_items = pending_items if pending_items is not None else []
         self.item_lengths = item_lengths if item_lengths is not None else []
+        self.pending_lengths = pending_lengths if pending_lengths is not None else []
+        self.total_length = (
+            total_length if total_length is not None else sum(self.item_lengths)
+        )
+        self.pending_total = (
+            pending_total if pending_total is not None else sum(self.pending_lengths)
+        )
         self.max_length = max_length
         self.min_item_length = min(max_length, min_item_length)
 
@@ -46,6 +69,10 @@ class ListModule(HorseModule, Generic[T]):
         """
         Add an item to the list cache.
 
+        Lengths are cached per item and kept as running totals, so an append
+        only serializes the new item, and each stored item is evicted at most
+        once.
+
         Args:
             item (T): The item to append to the cache
             **kwargs: Additional context when appending the item
@@ -57,14 +84,25 @@ class ListModule(HorseModule, Generic[T]):
             not self.item_lengths or len(self.item_lengths) != len(self.items)
         ):
             self.item_lengths = [
-                len(await compile_user_prompt(ITEM=item)) for item in self.items
+                await compile_user_prompt_length(ITEM=item) for item in self.items
+            ]
+            self.total_length = sum(self.item_lengths)
+
+        if len(self.pending_lengths) != len(self.pending_items):
+            self.pending_lengths = [
+                await compile_item_length(item) for item in self.pending_items
             ]
+            self.pending_total = sum(self.pending_lengths)
 
+        item_length = await compile_item_length(item)
         self.pending_items.append(item)
+        self.pending_lengths.append(item_length)
+        self.pending_total += item_length
 
         # Aggregate items if minimum length is reached
-        pending_str = await compile_user_prompt(ITEM=self.pending_items)
-        pending_length = len(pending_str)
+        pending_length = list_prompt_length(
+            "ITEM", self.pending_total, len(self.pending_items)
+        )
         result = None
         if pending_length >= self.min_item_length:
             if len(self.pending_items) == 1:
@@ -73,15 +111,22 @@ class ListModule(HorseModule, Generic[T]):
                 new_item = ListValue("Item list", self.pending_items)
             self.items.append(new_item)
             self.item_lengths.append(pending_length)
+            self.total_length += pending_length
             self.pending_items = []
+            self.pending_lengths = []
+            self.pending_total = 0
             result = new_item
 
         # Remove oldest items until under max length
-        while self.items and (
-            sum(self.item_lengths) + pending_length > self.max_length
+        evicted = 0
+        while evicted < len(self.items) and (
+            self.total_length + pending_length > self.max_length
         ):
-            self.items.pop(0)
-            self.item_lengths.pop(0)
+            self.total_length -= self.item_lengths[evicted]
+            evicted += 1
+        if evicted:
+            del self.items[:evicted]
+            del self.item_lengths[:evicted]
 
         return result
 
@@ -99,3 +144,6 @@ class ListModule(HorseModule, Generic[T]):
         self.items = []
         self.pending_items = []
         self.item_lengths = []
+        self.pending_lengths = []
+        self.total_length = 0
+        self.pending_total = 0
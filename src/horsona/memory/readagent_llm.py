@@ -11,7 +11,13 @@ T = TypeVar("T", bound=BaseModel)
 S = TypeVar("S", bound=Union[str, T])
 
 
+class RelevantPages(BaseModel):
+    pages: list[int | str | None] | None
+
+
 class ReadAgentLLMEngine(WrapperLLMEngine):
+    stable_prompt_args = ("GIST_CONTEXT",)
+
     def __init__(
         self,
         underlying_llm: AsyncLLMEngine,
@@ -46,10 +52,6 @@ async def get_relevant_pages(
     assert "TASK" in kwargs
     kwargs["READAGENT_TASK"] = kwargs.pop("TASK")
     # Retrieve relevant pages from gists
-
-    class RelevantPages(BaseModel):
-        pages: list[int | str | None] | None
-
     relevant_pages = await llm.query_object(
         RelevantPages,
         GISTS=gists,
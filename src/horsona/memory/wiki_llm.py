@@ -52,12 +52,13 @@ class WikiLLMEngine(WrapperLLMEngine):
         # Generate semantic search queries based on the user's prompt
         relevant_queries = await get_relevant_queries(self.underlying_llm, **kwargs)
 
-        # Search the embedding database with each query and combine results with weights
+        # Search the embedding database with all queries in one batch and
+        # combine results with weights
         all_results = defaultdict(lambda: [None, 0])
-        for query, weight in relevant_queries.items():
-            results = await self.wiki_module.embedding_db.query_with_weights(
-                query, topk=100
-            )
+        query_results = await self.wiki_module.embedding_db.query_many_with_weights(
+            list(relevant_queries), topk=100
+        )
+        for weight, results in zip(relevant_queries.values(), query_results):
             for weighted_file in results.values():
                 file, distance = weighted_file
                 for file in file:
@@ -8,7 +8,8 @@ from horsona.autodiff.basic import HorseModule
 from horsona.autodiff.variables import Value
 from horsona.database.embedding_database import EmbeddingDatabase
 from horsona.llm.base_engine import AsyncLLMEngine
-from horsona.llm.engine_utils import compile_user_prompt
+from horsona.llm.engine_utils import compile_user_prompt_length
+from horsona.llm.scheduler import Priority, request_priority
 from horsona.memory.gist_module import GistModule, paginate
 
 
@@ -143,19 +144,23 @@ class WikiModule(HorseModule):
                         "content": page,
                         "gist": gist.value,
                         "path": page_path,
-                        "gist_length": len(await compile_user_prompt(ITEM=gist.value)),
-                        "content_length": len(await compile_user_prompt(ITEM=page)),
+                        "gist_length": await compile_user_prompt_length(
+                            ITEM=gist.value
+                        ),
+                        "content_length": await compile_user_prompt_length(ITEM=page),
                     }
                 }
             )
 
-        # Process each page of the file separately
-        for i, page in enumerate(paginate(content.value, self.page_size)):
-            gist = await gist_module.append(page, **kwargs)
-            index_task = asyncio.create_task(exec_index_file(page, gist, i))
-            tasks.append(index_task)
+        # Ingestion shouldn't hold up interactive requests to the same engines
+        with request_priority(Priority.BACKGROUND):
+            # Process each page of the file separately
+            for i, page in enumerate(paginate(content.value, self.page_size)):
+                gist = await gist_module.append(page, **kwargs)
+                index_task = asyncio.create_task(exec_index_file(page, gist, i))
+                tasks.append(index_task)
 
-        await asyncio.gather(*tasks)
+            await asyncio.gather(*tasks)
 
         return gist_module
 
@@ -2,7 +2,7 @@ import asyncio
 import json
 from collections import defaultdict
 
-from anthropic import BaseModel
+from pydantic import BaseModel
 
 from horsona.config import get_llm
 from horsona.llm.base_engine import AsyncLLMEngine
@@ -21,6 +21,21 @@ class InferenceOutcome(BaseModel):
     uncertainty: str
 
 
+class Outcome(BaseModel):
+    prediction: str
+    uncertainty: str
+
+
+class Aggregate(BaseModel):
+    aggregate_prediction: str
+    aggregate_uncertainty: str
+
+
+class Effect(BaseModel):
+    effect: str
+    uncertainty: str
+
+
 class LLMEstimator(CausalEstimator[str]):
     def __init__(self) -> None:
         self.llm = get_llm("reasoning_llm")
@@ -57,12 +72,16 @@ class LLMEstimator(CausalEstimator[str]):
     async def predict(
         self, features: dict[str, str], outcome_node: str
     ) -> InferenceOutcome:
-        class Outcome(BaseModel):
-            prediction: str
-            uncertainty: str
-
         inference = await self.llm.query_object(
-            Outcome,
+            Outcome, **self._predict_args(features, outcome_node)
+        )
+
+        return InferenceOutcome(
+            mean=inference.prediction, uncertainty=inference.uncertainty
+        )
+
+    def _predict_args(self, features: dict[str, str], outcome_node: str) -> dict:
+        return dict(
             MODEL=self.model,
             DATAPOINT=_clean_features(features),
             OUTCOME_NODE=outcome_node,
@@ -79,17 +98,9 @@ class LLMEstimator(CausalEstimator[str]):
             ),
         )
 
-        return InferenceOutcome(
-            mean=inference.prediction, uncertainty=inference.uncertainty
-        )
-
     async def aggregate(
         self, inferences: list[InferenceOutcome], outcome_node: str
     ) -> InferenceOutcome:
-        class Aggregate(BaseModel):
-            aggregate_prediction: str
-            aggregate_uncertainty: str
-
         aggregate_inference = await self.llm.query_object(
             Aggregate,
             PREDICTIONS=inferences,
@@ -120,10 +131,6 @@ class LLMEstimator(CausalEstimator[str]):
         control_predictions: dict[str, InferenceOutcome],
         outcome_node: str,
     ) -> InferenceOutcome:
-        class Effect(BaseModel):
-            effect: str
-            uncertainty: str
-
         effect_inference = await self.llm.query_object(
             Effect,
             TREATMENT_PREDICTIONS=treatment_predictions,
@@ -161,14 +168,22 @@ class LLMEstimator(CausalEstimator[str]):
         aggregate_treatment_predictions: InferenceOutcome = None
         aggregate_control_predictions: InferenceOutcome = None
 
-        tasks = []
+        requests = []
         for treatment_datapoint, control_datapoint in zip(
             treatment_features, control_features
         ):
-            tasks.append(self.predict(treatment_datapoint, outcome))
-            tasks.append(self.predict(control_datapoint, outcome))
-
-        results = await asyncio.gather(*tasks)
+            requests.append(self._predict_args(treatment_datapoint, outcome))
+            requests.append(self._predict_args(control_datapoint, outcome))
+
+        # Every datapoint is predicted independently, so they go out as a batch
+        results = []
+        for result in await self.llm.query_object_batch(Outcome, requests):
+            inference = result.unwrap()
+            results.append(
+                InferenceOutcome(
+                    mean=inference.prediction, uncertainty=inference.uncertainty
+                )
+            )
         n_datapoints = len(treatment_features)
         for i in range(n_datapoints):
             treatment_inferences.append(results[i * 2])
@@ -7,8 +7,6 @@ from dataclasses import dataclass
 from itertools import chain
 from typing import Dict, Generator, List, Optional, Set, Tuple, Union
 
-import networkx as nx
-
 from horsona.llm.base_engine import AsyncLLMEngine
 
 from .models import (
@@ -57,6 +55,8 @@ class MultiCausalModel:
     """Wrapper for managing multiple causal models and analyzing effects across them."""
 
     def __init__(self, llm: AsyncLLMEngine, name: str):
+        import networkx as nx
+
         self.llm = llm
         self.name = name
         self.models: Dict[str, SimpleCausalModel] = {}
@@ -316,6 +316,8 @@ class MultiCausalModel:
     def computation_graph(
         self, treatment_nodes: set[str], outcome_node: str
     ) -> Generator[CausalComputation, None, None]:
+        import networkx as nx
+
         def decompose(
             outcome: str, exclude_models: set[SimpleCausalModel] = set()
         ) -> set[CausalComputation]:
@@ -1,19 +1,19 @@
 import asyncio
 import json
 import re
-from typing import Annotated, Literal, Optional
+from typing import TYPE_CHECKING, Annotated, Literal, Optional
 
-import matplotlib.pyplot as plt
-import networkx as nx
-from anthropic import BaseModel
 from dotenv import load_dotenv
-from pydantic import Field
+from pydantic import BaseModel, Field
 
 from horsona.config import load_indices, load_llms
 from horsona.database.embedding_database import EmbeddingDatabase
 from horsona.index.hnsw_index import HnswEmbeddingIndex
 from horsona.llm.base_engine import AsyncLLMEngine
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 load_dotenv()
 engines = load_llms()
 indices = load_indices()
@@ -91,7 +91,7 @@ class GraphExtraction(BaseModel):
 
 class SimpleCausalGraph:
     def __init__(
-        self, llm: AsyncLLMEngine, graph: nx.DiGraph, definitions: dict[str, str]
+        self, llm: AsyncLLMEngine, graph: "nx.DiGraph", definitions: dict[str, str]
     ):
         self.llm = llm
         self.graph = graph
@@ -272,7 +272,9 @@ async def generate_simple_graph(
     return SimpleCausalGraph(reasoning_llm, graph, relevant_definitions)
 
 
-def mermaid_to_nx(mermaid_str: str) -> nx.DiGraph:
+def mermaid_to_nx(mermaid_str: str) -> "nx.DiGraph":
+    import networkx as nx
+
     graph = nx.DiGraph()
     nodes = {}
     node_pattern = r"([^\[]+)\s*(?:\[([^\]]+)\])?"
@@ -305,7 +307,9 @@ def mermaid_to_nx(mermaid_str: str) -> nx.DiGraph:
     return graph
 
 
-def fill_graph(graph: nx.DiGraph, data: dict[str, str]) -> nx.DiGraph:
+def fill_graph(graph: "nx.DiGraph", data: dict[str, str]) -> "nx.DiGraph":
+    import networkx as nx
+
     new_graph = nx.DiGraph()
     for edge in graph.edges():
         source = data.get(edge[0]) or f"Unknown: {edge[0]}"
@@ -315,7 +319,7 @@ def fill_graph(graph: nx.DiGraph, data: dict[str, str]) -> nx.DiGraph:
     return new_graph
 
 
-def nx_to_mermaid(graph: nx.DiGraph) -> str:
+def nx_to_mermaid(graph: "nx.DiGraph") -> str:
     result = ["graph"]
     used_nodes = []
 
@@ -3,20 +3,21 @@ import json
 import logging
 import traceback
 import warnings
-from typing import Any, Collection, Generic, Optional, TypeVar
-
-import networkx as nx
+from typing import TYPE_CHECKING, Any, Collection, Generic, Optional, TypeVar
 
 from .data_manager import DataManager
 from .models import CausalEstimand, CausalEstimate, CausalEstimator
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 T = TypeVar("T")
 
 
 class SimpleCausalModel(Generic[T]):
     def __init__(
         self,
-        graph: nx.DiGraph,
+        graph: "nx.DiGraph",
         estimator: CausalEstimator[T],
         data_manager: DataManager,
         name: str = None,
@@ -86,6 +87,8 @@ class SimpleCausalModel(Generic[T]):
         outcome_node: str,
         observed_nodes: set[str],
     ):
+        import networkx as nx
+
         backdoor_sets = []
         bdoor_graph = None
         observed_nodes = set(observed_nodes)
@@ -137,6 +140,8 @@ class SimpleCausalModel(Generic[T]):
         observed_nodes: set[str],
     ):
         """Find a valid frontdoor variable set if it exists."""
+        import networkx as nx
+
         frontdoor_var = None
 
         eligible_variables = set()
@@ -216,10 +221,12 @@ class SimpleCausalModel(Generic[T]):
         action_nodes: set[str],
         outcome_node: str,
         observed_nodes: set[str],
-        bdoor_graph: nx.DiGraph,
+        bdoor_graph: "nx.DiGraph",
         backdoor_sets: list[set[str]],
         filt_eligible_variables: list[str],
     ):
+        import networkx as nx
+
         is_all_observed = set(self.graph.nodes) == set(observed_nodes)
 
         def _find(size_candidate_set):
@@ -250,6 +257,8 @@ class SimpleCausalModel(Generic[T]):
                 return
 
     def _get_instruments(self, treatment_nodes, outcome_node):
+        import networkx as nx
+
         parents_treatment = set()
         for node in treatment_nodes:
             parents_treatment = parents_treatment.union(
@@ -373,6 +382,8 @@ class SimpleCausalModel(Generic[T]):
         return features
 
     def _get_effect_modifiers(self, treatment, outcome):
+        import networkx as nx
+
         # Return effect modifiers according to the graph
         modifiers = set()
         modifiers.update(nx.ancestors(self.graph, outcome))
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from horsona.autodiff.checkpoint import CheckpointStore
+from horsona.autodiff.variables import ListValue, Value
+from horsona.database.embedding_database import EmbeddingDatabase
+from horsona.index.embedding_model import EmbeddingModel
+from horsona.index.hnsw_index import HnswEmbeddingIndex
+
+
+class LetterEmbeddingModel(EmbeddingModel):
+    async def get_data_embeddings(self, sentences):
+        return [
+            [sentence.count(c) + 0.1 for c in "abcdeghlmnprty"]
+            for sentence in sentences
+        ]
+
+    async def get_query_embeddings(self, sentences):
+        return await self.get_data_embeddings(sentences)
+
+
+def count_objects(path):
+    return sum(len(files) for _, _, files in os.walk(os.path.join(path, "objects")))
+
+
+def test_only_changes_are_written(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    values = ListValue("Notes", [Value("Note", f"note {i}") for i in range(5)])
+
+    store.save(values)
+    assert store.objects_written == 6
+    assert store.load().value[3].value == "note 3"
+
+    # Nothing changed, so nothing is written
+    store.save(values)
+    assert store.objects_written == 0
+
+    # Only the changed Value and the list that holds it are written
+    values.value[3].value = "changed"
+    store.save(values)
+    assert store.objects_written == 2
+    assert [v.value for v in store.load().value] == [
+        "note 0",
+        "note 1",
+        "note 2",
+        "changed",
+        "note 4",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_binary_fields_and_compaction(tmp_path):
+    store = CheckpointStore(str(tmp_path), compact_every=None)
+    index = HnswEmbeddingIndex(LetterEmbeddingModel())
+    database = EmbeddingDatabase(None, index)
+    await database.insert({"apple": "red", "banana": "yellow"})
+
+    store.save(database)
+    store.save(database)
+    assert store.objects_written == 0
+
+    await database.insert({"cherry": "red"})
+    store.save(database)
+    assert store.objects_written > 0
+    assert count_objects(tmp_path) > 3
+
+    # Only the latest checkpoint's objects are kept
+    removed = store.compact()
+    assert removed > 0
+    assert store.compact() == 0
+
+    restored = store.load(args={"index": {"model": LetterEmbeddingModel()}})
+    assert await restored.query("cherry") == {"cherry": ["red"]}
+    assert restored.data["banana"] == ["yellow"]
+
+
+@pytest.mark.asyncio
+async def test_unchanged_persist_dir_isnt_saved_again(tmp_path):
+    persist_dir = str(tmp_path / "index")
+    index = HnswEmbeddingIndex(LetterEmbeddingModel(), persist_dir=persist_dir)
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+    await index.extend(["apple", "banana"])
+
+    store.save(index)
+    files = set(os.listdir(persist_dir))
+    store.save(index)
+    assert set(os.listdir(persist_dir)) == files
+    assert store.objects_written == 0
+
+    await index.extend(["cherry"])
+    store.save(index)
+    assert set(os.listdir(persist_dir)) != files
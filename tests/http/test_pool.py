@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from horsona.http import pool
+from horsona.http.pool import (
+    close_http_clients,
+    configure_http_pool,
+    get_http_client,
+    get_http_transport,
+)
+
+
+@pytest.fixture
+async def http_server():
+    connections = []
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections.append(writer)
+        while True:
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n"
+                b"Connection: keep-alive\r\n\r\nok"
+            )
+            await writer.drain()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}", connections
+
+    await close_http_clients()
+    for writer in connections:
+        writer.close()
+    server.close()
+
+
+@pytest.fixture
+def pool_config():
+    config = dict(pool._config)
+    host_config = {k: dict(v) for k, v in pool._host_config.items()}
+    yield
+    pool._config.clear()
+    pool._config.update(config)
+    pool._host_config.clear()
+    pool._host_config.update(host_config)
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused(http_server):
+    url, connections = http_server
+
+    for _ in range(5):
+        response = await get_http_client().get(url)
+        assert response.text == "ok"
+
+    assert len(connections) == 1
+
+    # Closing drops the pooled connections, but the client stays usable
+    await close_http_clients()
+    response = await get_http_client().get(url)
+    assert response.text == "ok"
+    assert len(connections) == 2
+
+
+@pytest.mark.asyncio
+async def test_per_host_limits(pool_config):
+    configure_http_pool(
+        max_connections=7, hosts={"api.example.com": {"max_connections": 3}}
+    )
+
+    transport = get_http_transport()
+    default_pool = transport._pool_for("other.example.com")
+    host_pool = transport._pool_for("api.example.com")
+
+    assert default_pool._pool._max_connections == 7
+    assert host_pool._pool._max_connections == 3
+    assert transport._pool_for("api.example.com") is host_pool
+
+    await close_http_clients()
+
+
+def test_unknown_settings_rejected(pool_config):
+    with pytest.raises(ValueError):
+        configure_http_pool(max_conections=10)
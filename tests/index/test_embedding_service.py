@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from horsona.autodiff.basic import load_state_dict, state_dict
+from horsona.index.embedding_model import EmbeddingModel
+from horsona.index.embedding_service import EmbeddingCache, EmbeddingService
+from horsona.index.hnsw_index import HnswEmbeddingIndex
+
+
+class RecordingEmbeddingModel(EmbeddingModel):
+    def __init__(self, model: str = "test", **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_data_embeddings(self, sentences):
+        self.calls.append(list(sentences))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if "fail" in sentences:
+            raise RuntimeError("Embedding failed")
+        return [[float(len(s)), float(sum(map(ord, s)) % 97), 1.0] for s in sentences]
+
+    async def get_query_embeddings(self, sentences):
+        return await self.get_data_embeddings(sentences)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_are_batched():
+    model = RecordingEmbeddingModel()
+    service = EmbeddingService(model)
+    index = HnswEmbeddingIndex(service)
+    await index.extend(["apple pie", "banana split", "cherry tart", "date loaf"])
+    model.calls.clear()
+
+    queries = ["apple", "banana", "cherry", "apple"]
+    results = await asyncio.gather(*[index.query(q, topk=1) for q in queries])
+
+    # One call for all queries, with the duplicate sent once
+    assert model.calls == [["apple", "banana", "cherry"]]
+    assert results[0] == results[3]
+
+    # Repeated queries are served from memory
+    await index.query("banana", topk=1)
+    assert len(model.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_disk_cache(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    model = RecordingEmbeddingModel()
+    service = EmbeddingService(model, EmbeddingCache(path), memory_entries=1)
+
+    first = await service.get_data_embeddings(["a", "bb", "ccc"])
+    assert await service.get_data_embeddings(["ccc", "a"]) == [first[2], first[0]]
+    assert len(model.calls) == 1
+
+    # A new service with the same cache file doesn't call the model
+    new_model = RecordingEmbeddingModel()
+    restored = load_state_dict(state_dict(service), {"underlying_model": new_model})
+    assert restored.cache.path == path
+    assert await restored.get_data_embeddings(["bb"]) == [first[1]]
+    assert len(new_model.calls) == 0
+
+    # Query embeddings are cached separately from data embeddings
+    await restored.get_query_embeddings(["bb"])
+    assert new_model.calls == [["bb"]]
+
+
+def test_cache_key_includes_the_endpoint(tmp_path, monkeypatch):
+    from horsona.index.ollama_model import OllamaEmbeddingModel
+    from horsona.index.openai_embedding_model import OpenAIEmbeddingModel
+
+    # The same model on different servers doesn't share cached embeddings
+    openai_keys = {
+        OpenAIEmbeddingModel("embed", api_key="secret").cache_key(),
+        OpenAIEmbeddingModel(
+            "embed", api_key="secret", base_url="http://localhost:8000/v1"
+        ).cache_key(),
+        OpenAIEmbeddingModel("embed", api_key="secret", organization="org").cache_key(),
+    }
+    assert len(openai_keys) == 3
+    assert not any("secret" in key for key in openai_keys)
+
+    monkeypatch.delenv("OLLAMA_HOST", raising=False)
+    local = OllamaEmbeddingModel("embed").cache_key()
+    assert OllamaEmbeddingModel("embed", url="http://gpu:11434").cache_key() != local
+    monkeypatch.setenv("OLLAMA_HOST", "http://gpu:11434")
+    assert OllamaEmbeddingModel("embed").cache_key() != local
+
+    # A model with nothing to identify it by can't use the disk cache
+    with pytest.raises(ValueError):
+        EmbeddingService(
+            RecordingEmbeddingModel(model=None), EmbeddingCache(str(tmp_path / "db"))
+        )
+
+
+@pytest.mark.asyncio
+async def test_bounded_concurrency_and_errors():
+    model = RecordingEmbeddingModel()
+    service = EmbeddingService(model, max_batch_size=2, max_concurrency=2)
+
+    texts = [str(i) for i in range(10)]
+    embeddings = await service.get_data_embeddings(texts)
+    assert len(embeddings) == 10
+    assert [len(call) for call in model.calls] == [2] * 5
+    assert model.max_in_flight == 2
+
+    # Failures reach every caller waiting on the batch, and aren't cached
+    results = await asyncio.gather(
+        service.get_data_embeddings(["fail"]),
+        service.get_data_embeddings(["other"]),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    with pytest.raises(RuntimeError):
+        await service.get_data_embeddings(["fail"])
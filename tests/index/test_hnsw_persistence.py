@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from horsona.autodiff.basic import load_state_dict, state_dict, unzip, zip
+from horsona.index.embedding_model import EmbeddingModel
+from horsona.index.hnsw_index import METADATA_FILE, HnswEmbeddingIndex
+
+WORDS = ["apple", "banana", "cherry", "grape", "melon", "peach", "plum", "lemon"]
+
+
+class LetterEmbeddingModel(EmbeddingModel):
+    async def get_data_embeddings(self, sentences):
+        return [
+            [sentence.count(c) + 0.1 for c in "abcdeghlmnprty"]
+            for sentence in sentences
+        ]
+
+    async def get_query_embeddings(self, sentences):
+        return await self.get_data_embeddings(sentences)
+
+
+@pytest.mark.asyncio
+async def test_persist_dir(tmp_path):
+    persist_dir = str(tmp_path / "index")
+    index = HnswEmbeddingIndex(LetterEmbeddingModel(), persist_dir=persist_dir)
+    await index.extend(WORDS)
+    await index.delete(["plum"])
+
+    # The state_dict only refers to the directory
+    saved = unzip(zip(state_dict(index)))
+    assert saved["data"]["embeddings"]["data"] is None
+    assert saved["data"]["index_to_value"]["data"] is None
+    (index_file,) = set(os.listdir(persist_dir)) - {METADATA_FILE}
+    assert index_file.startswith("index-")
+
+    restored = load_state_dict(saved)
+    assert restored.index_to_value == index.index_to_value
+    assert restored.deleted_indices == {WORDS.index("plum")}
+    assert await restored.query("cherry", topk=2) == await index.query("cherry", topk=2)
+    assert "plum" not in (await restored.query("plum", topk=3)).values()
+
+    # Opening the directory directly works too, and saves replace each other
+    await restored.extend(["kiwi"])
+    restored.save()
+    reopened = HnswEmbeddingIndex(LetterEmbeddingModel(), persist_dir=persist_dir)
+    assert "kiwi" in (await reopened.query("kiwi", topk=1)).values()
+    assert len([f for f in os.listdir(persist_dir) if f.startswith("index-")]) == 1
+
+
+@pytest.mark.asyncio
+async def test_interrupted_save_keeps_previous_index(tmp_path, monkeypatch):
+    persist_dir = str(tmp_path / "index")
+    index = HnswEmbeddingIndex(LetterEmbeddingModel(), persist_dir=persist_dir)
+    await index.extend(WORDS[:4])
+    index.save()
+
+    def fail(src, dst):
+        raise OSError("Disk full")
+
+    await index.extend(WORDS[4:])
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        index.save()
+    monkeypatch.undo()
+
+    # The partial save is cleaned up
+    assert len(os.listdir(persist_dir)) == 2
+
+    reopened = HnswEmbeddingIndex(LetterEmbeddingModel(), persist_dir=persist_dir)
+    assert sorted(reopened.value_to_index) == sorted(WORDS[:4])
+    assert len(await reopened.query("melon", topk=8)) == 4
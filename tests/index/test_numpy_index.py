@@ -0,0 +1,118 @@
+import asyncio
+import zlib
+
+import numpy as np
+import pytest
+
+from horsona.autodiff.basic import load_state_dict, state_dict, unzip, zip
+from horsona.index.embedding_model import EmbeddingModel
+from horsona.index.numpy_index import NumpyEmbeddingIndex
+
+
+class RandomEmbeddingModel(EmbeddingModel):
+    """Gives each text a fixed random embedding."""
+
+    def __init__(self, dim: int = 16, **kwargs):
+        super().__init__(**kwargs)
+        self.dim = dim
+
+    async def get_data_embeddings(self, sentences):
+        return [self.embed(sentence).tolist() for sentence in sentences]
+
+    async def get_query_embeddings(self, sentences):
+        return await self.get_data_embeddings(sentences)
+
+    def embed(self, sentence: str) -> np.ndarray:
+        return np.random.default_rng(zlib.crc32(sentence.encode())).standard_normal(
+            self.dim
+        )
+
+
+def exact_topk(model, values, query, topk):
+    embeddings = np.array([model.embed(v) for v in values])
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    query_emb = model.embed(query) / np.linalg.norm(model.embed(query))
+    return [values[i] for i in np.argsort(-(embeddings @ query_emb))[:topk]]
+
+
+@pytest.mark.asyncio
+async def test_exact_results():
+    model = RandomEmbeddingModel()
+    index = NumpyEmbeddingIndex(model)
+    values = [f"value {i}" for i in range(3000)]
+    await index.extend(values)
+
+    assert len(index.embeddings) == 4096
+    queries = ["value 12", "something else", ""]
+    results = await index.query_many_with_weights(queries, topk=5)
+
+    assert list(results[0].values())[0] == ("value 12", pytest.approx(0, abs=1e-5))
+    for i, query in enumerate(queries[:2]):
+        assert [value for value, _ in results[i].values()] == exact_topk(
+            model, values, query, 5
+        )
+        distances = [distance for _, distance in results[i].values()]
+        assert distances == sorted(distances)
+    assert results[2] == {}
+
+
+@pytest.mark.asyncio
+async def test_delete_and_restore():
+    index = NumpyEmbeddingIndex(RandomEmbeddingModel())
+    await index.extend(["apple", "banana", "cherry", "grape"])
+
+    assert await index.delete(["banana", 2, "missing"]) == ["banana", "cherry"]
+    assert sorted((await index.query("banana", topk=10)).values()) == [
+        "apple",
+        "grape",
+    ]
+
+    restored = load_state_dict(
+        unzip(zip(state_dict(index))), {"model": RandomEmbeddingModel()}
+    )
+    assert restored.deleted_indices == {1, 2}
+    assert await restored.query("grape", topk=3) == await index.query("grape", topk=3)
+
+    # Adding a deleted value again reuses its row
+    await restored.extend(["banana"])
+    assert restored.next_index == 4
+    assert await restored.query("banana", topk=1) == {1: "banana"}
+
+
+class BlockingEmbeddingModel(RandomEmbeddingModel):
+    """Holds data embeddings until released, so other calls can run meanwhile."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = asyncio.Event()
+
+    async def get_data_embeddings(self, sentences):
+        await self.release.wait()
+        return await super().get_data_embeddings(sentences)
+
+    async def get_query_embeddings(self, sentences):
+        return [self.embed(sentence).tolist() for sentence in sentences]
+
+
+@pytest.mark.asyncio
+async def test_query_during_extend():
+    model = BlockingEmbeddingModel()
+    index = NumpyEmbeddingIndex(model)
+    model.release.set()
+    await index.extend(["apple", "banana", "cherry"])
+
+    model.release.clear()
+    extending = asyncio.create_task(index.extend(["grape", "melon"]))
+    await asyncio.sleep(0)
+
+    # Values still being embedded aren't returned yet
+    assert sorted((await index.query("grape", topk=10)).values()) == [
+        "apple",
+        "banana",
+        "cherry",
+    ]
+
+    model.release.set()
+    await extending
+    assert list((await index.query("grape", topk=1)).values()) == ["grape"]
+    assert len(await index.query("grape", topk=10)) == 5
@@ -0,0 +1,55 @@
+import pytest
+
+from horsona.database.embedding_database import EmbeddingDatabase
+from horsona.index.embedding_model import EmbeddingModel
+from horsona.index.hnsw_index import HnswEmbeddingIndex
+
+WORDS = ["apple", "banana", "cherry", "grape", "melon", "peach", "plum", "lemon"]
+
+
+class LetterEmbeddingModel(EmbeddingModel):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+
+    async def get_data_embeddings(self, sentences):
+        self.calls.append(list(sentences))
+        return [
+            [sentence.count(c) + 0.1 for c in "abcdeghlmnprty"]
+            for sentence in sentences
+        ]
+
+    async def get_query_embeddings(self, sentences):
+        return await self.get_data_embeddings(sentences)
+
+
+@pytest.mark.asyncio
+async def test_query_many_with_weights():
+    model = LetterEmbeddingModel()
+    index = HnswEmbeddingIndex(model)
+    await index.extend(WORDS)
+    model.calls.clear()
+
+    queries = ["banana", "", "plum", "lemon"]
+    results = await index.query_many_with_weights(queries, topk=3)
+
+    # All queries are embedded in one call, and empty queries are skipped
+    assert model.calls == [["banana", "plum", "lemon"]]
+    assert results[1] == {}
+    for query, result in zip(queries, results):
+        if query:
+            assert result == await index.query_with_weights(query, topk=3)
+            assert query in [value for value, _ in result.values()]
+
+
+@pytest.mark.asyncio
+async def test_database_query_many_with_weights():
+    index = HnswEmbeddingIndex(LetterEmbeddingModel())
+    database = EmbeddingDatabase(None, index)
+    await database.insert({word: word.upper() for word in WORDS})
+
+    results = await database.query_many_with_weights(["cherry", "peach"], topk=2)
+
+    assert [len(result) for result in results] == [2, 2]
+    assert results[0]["cherry"][0] == ["CHERRY"]
+    assert results[1]["peach"][0] == ["PEACH"]
@@ -0,0 +1,171 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+from horsona.llm.base_engine import LLMMetrics
+from horsona.llm.oai_engine import AsyncOAIEngine
+from horsona.llm.openai_engine import AsyncOpenAIEngine
+
+
+class Pony(BaseModel):
+    name: str
+
+
+def completion(content: str) -> dict:
+    return {
+        "id": "test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "test",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def reply(request: dict) -> str:
+    prompt = request["messages"][0]["content"]
+    if "Fail" in prompt:
+        raise ValueError("Bad request")
+    if "Garbled" in prompt:
+        return "not json"
+    name = prompt.split("\n")[1].strip()
+    return f"```json\n{json.dumps({'name': name})}\n```"
+
+
+class SlowOAIEngine(AsyncOAIEngine):
+    def __init__(self, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+        self.in_flight_now = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        self.in_flight_now += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight_now)
+        try:
+            await asyncio.sleep(0.01)
+            return ChatCompletion.model_validate(completion(reply(kwargs)))
+        finally:
+            self.in_flight_now -= 1
+
+
+class FakeBatchClient:
+    """Stands in for the files and batches endpoints of AsyncOpenAI."""
+
+    def __init__(self):
+        self.files = SimpleNamespace(create=self.create_file, content=self.content)
+        self.batches = SimpleNamespace(create=self.create_batch, retrieve=self.retrieve)
+        self.uploads = {}
+        self.polls = 0
+
+    async def create_file(self, file, purpose):
+        assert purpose == "batch"
+        self.uploads["input"] = file[1].decode()
+        return SimpleNamespace(id="input")
+
+    async def create_batch(self, input_file_id, endpoint, completion_window):
+        return self.batch("in_progress")
+
+    async def retrieve(self, batch_id):
+        self.polls += 1
+        return self.batch("completed")
+
+    def batch(self, status):
+        return SimpleNamespace(
+            id="batch", status=status, output_file_id="output", error_file_id="errors"
+        )
+
+    async def content(self, file_id):
+        output, errors = [], []
+        for line in self.uploads["input"].splitlines():
+            request = json.loads(line)
+            try:
+                body = completion(reply(request["body"]))
+                output.append(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": body},
+                    }
+                )
+            except ValueError as e:
+                errors.append(
+                    {"custom_id": request["custom_id"], "error": {"message": str(e)}}
+                )
+        lines = output if file_id == "output" else errors
+        return SimpleNamespace(text="\n".join(json.dumps(line) for line in lines))
+
+
+REQUESTS = [
+    {"NAME": "Rarity"},
+    {"NAME": "Fail"},
+    {"NAME": "Garbled"},
+    {"NAME": "Spike"},
+]
+
+
+@pytest.mark.asyncio
+async def test_query_object_batch_concurrent():
+    engine = SlowOAIEngine(structured_output=False)
+    requests = REQUESTS * 5
+
+    results = await engine.query_object_batch(Pony, requests, max_concurrency=3)
+
+    assert engine.max_in_flight == 3
+    for request, result in zip(requests, results):
+        if request["NAME"] in ("Fail", "Garbled"):
+            assert not result.ok
+        else:
+            assert result.unwrap() == Pony(name=request["NAME"])
+
+    with pytest.raises(ValueError):
+        results[1].unwrap()
+
+
+@pytest.mark.asyncio
+async def test_query_batch_uses_batch_api():
+    engine = AsyncOpenAIEngine(model="test", batch_api=True, structured_output=False)
+    engine.client = FakeBatchClient()
+    engine.batch_poll_interval = 0
+    metrics = LLMMetrics()
+
+    results = await engine.query_batch(
+        [{**request, "metrics": metrics} for request in REQUESTS]
+    )
+
+    assert engine.client.polls == 1
+    assert [result.ok for result in results] == [True, False, True, True]
+    assert '"name": "Rarity"' in results[0].value
+    assert results[2].value == "not json"
+    assert metrics.requests == 4
+    assert metrics.errors == 1
+    assert metrics.prompt_tokens == 30
+
+    uploaded = [
+        json.loads(line) for line in engine.client.uploads["input"].splitlines()
+    ]
+    assert uploaded[0]["body"]["model"] == "test"
+    assert "stream" not in uploaded[0]["body"]
+
+
+@pytest.mark.asyncio
+async def test_query_object_batch_uses_batch_api():
+    engine = AsyncOpenAIEngine(model="test", batch_api=True, structured_output=False)
+    engine.client = FakeBatchClient()
+    engine.batch_poll_interval = 0
+
+    results = await engine.query_object_batch(Pony, REQUESTS)
+
+    assert engine.client.polls == 1
+    assert results[0].unwrap() == Pony(name="Rarity")
+    assert not results[1].ok
+    assert not results[2].ok
+    assert results[3].unwrap() == Pony(name="Spike")
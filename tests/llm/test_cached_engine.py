@@ -0,0 +1,107 @@
+import pytest
+from pydantic import BaseModel
+
+from horsona.llm.base_engine import AsyncLLMEngine, LLMMetrics
+from horsona.llm.cached_engine import CachedLLMEngine, ResponseCache
+
+
+class CountingEngine(AsyncLLMEngine):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    async def query_response(self, metrics: LLMMetrics = None, **kwargs) -> str:
+        self.calls += 1
+        if metrics is not None:
+            metrics.tokens_consumed += 10
+        return f"response {self.calls}"
+
+    async def query_stream(self, metrics: LLMMetrics = None, **kwargs):
+        self.calls += 1
+        if metrics is not None:
+            metrics.tokens_consumed += 10
+        for chunk in ["streamed ", f"response {self.calls}"]:
+            yield chunk
+
+    async def query_object(self, response_model, metrics=None, **kwargs):
+        self.calls += 1
+        if metrics is not None:
+            metrics.tokens_consumed += 10
+        return response_model(name=kwargs["NAME"])
+
+    async def query_block(self, block_type, metrics=None, **kwargs) -> str:
+        return await self.query_response(metrics=metrics, **kwargs)
+
+    async def query_continuation(self, prompt, metrics=None, **kwargs) -> str:
+        return await self.query_response(metrics=metrics, **kwargs)
+
+
+class Response(BaseModel):
+    name: str
+
+
+@pytest.mark.asyncio
+async def test_cache_hits(tmp_path):
+    engine = CountingEngine()
+    cached = CachedLLMEngine(engine, ResponseCache(str(tmp_path / "cache.sqlite")))
+
+    first = await cached.query_block("text", TASK="say hello")
+    second = await cached.query_block("text", TASK="say hello")
+    third = await cached.query_block("text", TASK="say goodbye")
+
+    assert first == second
+    assert third != first
+    assert engine.calls == 2
+    assert cached.metrics.cache_hits == 1
+    assert cached.metrics.cache_misses == 2
+    assert cached.metrics.tokens_saved == 10
+
+
+@pytest.mark.asyncio
+async def test_cache_objects_and_streams(tmp_path):
+    engine = CountingEngine()
+    cached = CachedLLMEngine(engine, ResponseCache(str(tmp_path / "cache.sqlite")))
+
+    metrics = LLMMetrics()
+    obj1 = await cached.query_object(Response, NAME="Celestia", metrics=metrics)
+    obj2 = await cached.query_object(Response, NAME="Celestia", metrics=metrics)
+    assert obj1 == obj2 == Response(name="Celestia")
+    assert metrics.cache_hits == 1
+    assert metrics.tokens_saved == 10
+
+    stream1 = [chunk async for chunk in cached.query_stream(TASK="story")]
+    stream2 = [chunk async for chunk in cached.query_stream(TASK="story")]
+    assert "".join(stream1) == "".join(stream2)
+    assert engine.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_persistence_and_eviction(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    engine = CountingEngine()
+    cached = CachedLLMEngine(engine, ResponseCache(path, max_entries=2))
+
+    for task in ["a", "b", "c"]:
+        await cached.query_response(TASK=task)
+    assert len(cached.cache) == 2
+
+    # A new cache on the same file sees the surviving entries
+    reopened = CachedLLMEngine(engine, ResponseCache(path, max_entries=2))
+    await reopened.query_response(TASK="c")
+    assert reopened.metrics.cache_hits == 1
+
+    await reopened.query_response(TASK="a")
+    assert reopened.metrics.cache_misses == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl(tmp_path):
+    engine = CountingEngine()
+    cached = CachedLLMEngine(
+        engine, ResponseCache(str(tmp_path / "cache.sqlite"), ttl=-1)
+    )
+
+    await cached.query_response(TASK="a")
+    await cached.query_response(TASK="a")
+    assert engine.calls == 2
+    assert cached.metrics.cache_hits == 0
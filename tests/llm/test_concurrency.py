@@ -0,0 +1,143 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from horsona.interface import oai
+from horsona.llm.base_engine import LLMMetrics, tracks_metrics
+from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.limits import QueueFullException
+from horsona.llm.scheduler import Priority, request_priority
+from horsona.llm.wrapper_llm import WrapperLLMEngine
+
+
+class GatedChatEngine(AsyncChatEngine):
+    def __init__(self, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+        self.gate = asyncio.Event()
+        self.running = []
+        self.max_running = 0
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, **kwargs):
+        label = kwargs["messages"][-1]["content"]
+        self.running.append(label)
+        self.max_running = max(self.max_running, len(self.running))
+        try:
+            await self.gate.wait()
+            yield label
+        finally:
+            self.running.remove(label)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight():
+    engine = GatedChatEngine(max_in_flight=2)
+
+    tasks = [
+        asyncio.create_task(
+            engine.query_response(messages=[{"role": "user", "content": str(i)}])
+        )
+        for i in range(6)
+    ]
+    await settle()
+
+    assert len(engine.running) == 2
+    assert engine.telemetry.in_flight == 2
+    assert engine.telemetry.queued == 4
+
+    engine.gate.set()
+    assert await asyncio.gather(*tasks) == [str(i) for i in range(6)]
+    assert engine.max_running == 2
+    assert engine.telemetry.in_flight == 0
+    assert engine.telemetry.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_slots_go_to_higher_priority():
+    engine = GatedChatEngine(max_in_flight=1)
+    order = []
+
+    async def query(label, priority):
+        with request_priority(priority):
+            await engine.query_response(messages=[{"role": "user", "content": label}])
+        order.append(label)
+
+    tasks = [asyncio.create_task(query("first", Priority.INTERACTIVE))]
+    await settle()
+    for label, priority in [
+        ("batch", Priority.BATCH),
+        ("background", Priority.BACKGROUND),
+        ("interactive", Priority.INTERACTIVE),
+    ]:
+        tasks.append(asyncio.create_task(query(label, priority)))
+        await settle()
+
+    # A cancelled waiter gives up its place in the queue
+    tasks[1].cancel()
+    await settle()
+    assert engine.concurrency.queued == 2
+
+    engine.gate.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert order == ["first", "interactive", "background"]
+    assert engine.concurrency.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    engine = GatedChatEngine(max_in_flight=1, max_queued=1)
+    messages = [{"role": "user", "content": "hi"}]
+
+    tasks = [
+        asyncio.create_task(engine.query_response(messages=messages)) for _ in range(2)
+    ]
+    await settle()
+
+    with pytest.raises(QueueFullException) as e:
+        await engine.query_response(messages=messages)
+    assert e.value.retry_after >= 1
+    assert engine.telemetry.rejected == 1
+
+    engine.gate.set()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("wrapped", [False, True])
+async def test_oai_api_returns_429(wrapped):
+    engine = GatedChatEngine(max_in_flight=1, max_queued=0)
+    name = "wrapped_gated_llm" if wrapped else "gated_llm"
+    # Wrappers queue their calls on the engine they wrap
+    oai.add_llm_engine(WrapperLLMEngine(engine) if wrapped else engine, name=name)
+    app = FastAPI()
+    app.include_router(oai.api_router)
+    request = {
+        "model": name,
+        "messages": [{"role": "user", "content": "hi"}],
+    }
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        first = asyncio.create_task(
+            client.post("/api/v1/chat/completions", json=request)
+        )
+        while not engine.running:
+            await asyncio.sleep(0.01)
+
+        for stream in (False, True):
+            response = await client.post(
+                "/api/v1/chat/completions", json={**request, "stream": stream}
+            )
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+
+        engine.gate.set()
+        assert (await first).status_code == 200
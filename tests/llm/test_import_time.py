@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+
+PROVIDER_SDKS = ("anthropic", "cerebras", "fireworks", "groq", "together")
+
+
+def import_times(code, cwd):
+    """Run code with -X importtime and get the cumulative microseconds per module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd,
+        env={**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "x")},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_load_llms_imports_only_configured_providers(tmp_path):
+    (tmp_path / "llm_config.json").write_text(
+        json.dumps([{"gpt": {"type": "AsyncOpenAIEngine", "model": "gpt-4o"}}])
+    )
+
+    times = import_times("from horsona.config import load_llms; load_llms()", tmp_path)
+
+    imported = {module.split(".")[0] for module in times}
+    assert "openai" in imported
+    assert not imported.intersection(PROVIDER_SDKS)
+    assert "horsona.llm.cached_engine" not in times
+
+
+def test_core_imports_skip_heavy_packages(tmp_path):
+    times = import_times(
+        "import horsona.llm.chat_engine, horsona.smarts.causal.llm_estimator, "
+        "horsona.smarts.causal.multi_causal_model",
+        tmp_path,
+    )
+
+    imported = {module.split(".")[0] for module in times}
+    assert not imported.intersection(
+        PROVIDER_SDKS + ("openai", "pandas", "matplotlib", "networkx")
+    )
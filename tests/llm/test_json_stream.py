@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from horsona.llm.base_engine import LLMMetrics, tracks_metrics
+from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.json_stream import JsonStreamParser
+
+
+class Category(BaseModel):
+    name: str
+    description: str
+
+
+class Structure(BaseModel):
+    topic: str
+    categories: list[Category]
+
+
+RESPONSE = (
+    "Here you go:\n```json\n"
+    + json.dumps(
+        {
+            "topic": "Fruit",
+            "categories": [
+                {"name": "Citrus", "description": "Sour\nand sweet"},
+                {"name": "Berries", "description": "Small"},
+            ],
+        }
+    )
+    + "\n```\nLet me know if you need anything else."
+)
+
+
+class ChunkedChatEngine(AsyncChatEngine):
+    def __init__(self, response, chunk_size=5, **kwargs):
+        super().__init__(**kwargs)
+        self.response = response
+        self.chunk_size = chunk_size
+        self.sent = 0
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, **kwargs):
+        for i in range(0, len(self.response), self.chunk_size):
+            self.sent = i + self.chunk_size
+            yield self.response[i : i + self.chunk_size]
+
+
+def test_partial_values():
+    parser = JsonStreamParser()
+    assert not parser.feed("Sure!\n```js")
+    assert not parser.started
+
+    assert parser.feed('on\n{"topic": "Fr\nuit", "tags": ["a", "b')
+    assert parser.started
+    assert parser.partial() == {"topic": "Fr\nuit", "tags": ["a"]}
+
+    assert parser.feed('"]')
+
+    # Only values near the top level are reported
+    assert not parser.feed(', "nested": {"deep": {"x": 1, "')
+    assert parser.partial() == {
+        "topic": "Fr\nuit",
+        "tags": ["a", "b"],
+        "nested": {"deep": {"x": 1}},
+    }
+
+    assert parser.feed('y": 2}}, "count": 3}')
+    assert parser.done
+    assert parser.value()["count"] == 3
+
+
+def test_scalar_value():
+    parser = JsonStreamParser()
+    parser.feed("```\n42")
+    assert not parser.done
+
+    parser.feed("\n``")
+    assert parser.done
+    assert parser.value() == 42
+
+
+@pytest.mark.asyncio
+async def test_query_object_stream():
+    engine = ChunkedChatEngine(RESPONSE)
+
+    objects = [obj async for obj in engine.query_object_stream(Structure)]
+
+    assert [len(obj.categories) for obj in objects] == [1, 2]
+    assert objects[-1] == await engine.query_object(Structure)
+
+
+@pytest.mark.asyncio
+async def test_query_object_stream_stops_at_end_of_json():
+    engine = ChunkedChatEngine(RESPONSE)
+
+    async for _ in engine.query_object_stream(Structure):
+        pass
+
+    # The trailing text after the code block is never read
+    assert engine.sent < RESPONSE.index("Let me know")
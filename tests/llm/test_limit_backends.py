@@ -0,0 +1,231 @@
+import multiprocessing
+import socketserver
+import threading
+import time
+
+import pytest
+
+from horsona.llm.base_engine import RateLimits
+from horsona.llm.limit_backends import (
+    LocalLimitBackend,
+    RedisLimitBackend,
+    SqliteLimitBackend,
+)
+from horsona.llm.openai_engine import AsyncOpenAIEngine
+
+LIMITS = [{"interval": 10, "max_calls": 6}]
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """Stand-in for a Redis server with the commands RedisLimitBackend uses."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.lock = threading.Lock()
+        self.values = {}
+        self.versions = {}
+        self.commands = []
+
+    @property
+    def url(self):
+        return f"redis://:secret@127.0.0.1:{self.server_address[1]}/0"
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        watched = {}
+        queued = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode())
+            command = args[0].upper()
+            server = self.server
+            server.commands.append(command)
+
+            with server.lock:
+                if queued is not None and command != "EXEC":
+                    queued.append(args)
+                    reply = b"+QUEUED\r\n"
+                elif command in ("AUTH", "PING"):
+                    reply = b"+OK\r\n"
+                elif command == "WATCH":
+                    watched[args[1]] = server.versions.get(args[1], 0)
+                    reply = b"+OK\r\n"
+                elif command == "UNWATCH":
+                    watched = {}
+                    reply = b"+OK\r\n"
+                elif command == "GET":
+                    reply = self.bulk(server.values.get(args[1]))
+                elif command == "SET":
+                    self.set(args[1], args[2])
+                    reply = b"+OK\r\n"
+                elif command == "MULTI":
+                    queued = []
+                    reply = b"+OK\r\n"
+                elif command == "EXEC":
+                    if any(server.versions.get(k, 0) != v for k, v in watched.items()):
+                        reply = b"*-1\r\n"
+                    else:
+                        for queued_args in queued:
+                            self.set(queued_args[1], queued_args[2])
+                        reply = b"*%d\r\n" % len(queued) + b"+OK\r\n" * len(queued)
+                    queued = None
+                    watched = {}
+                else:
+                    reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+    def set(self, key, value):
+        self.server.values[key] = value
+        self.server.versions[key] = self.server.versions.get(key, 0) + 1
+
+    def bulk(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value.encode())
+
+
+@pytest.fixture
+def resp_server():
+    server = RespServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def assert_shared_budget(times):
+    # One bucket of 6 calls, refilling every 10 / 6 seconds, no matter how many
+    # clients took from it
+    times = sorted(times)
+    start = times[0]
+    assert [t - start for t in times[:6]] == pytest.approx([0] * 6, abs=0.5)
+    for i, t in enumerate(times[6:], start=1):
+        assert t - start == pytest.approx(i * 10 / 6, abs=0.5)
+
+
+def reserve_calls(path, count):
+    limits = RateLimits(LIMITS, key="shared", backend=SqliteLimitBackend(path))
+    return [limits.call_limits[0].reserve() for _ in range(count)]
+
+
+def test_sqlite_backend_shared_across_processes(tmp_path):
+    path = str(tmp_path / "rate_limits.sqlite")
+    with multiprocessing.get_context("spawn").Pool(3) as pool:
+        results = pool.starmap(reserve_calls, [(path, 4)] * 3)
+
+    assert_shared_budget([t for times in results for t in times])
+
+
+def test_redis_backend_shared(resp_server):
+    clients = [
+        RateLimits(LIMITS, key="shared", backend=RedisLimitBackend(resp_server.url))
+        for _ in range(3)
+    ]
+
+    times = [client.call_limits[0].reserve() for _ in range(4) for client in clients]
+
+    assert_shared_budget(times)
+    assert list(resp_server.values) == ["horsona:rate_limit:shared:10s:calls"]
+
+
+def test_redis_backend_retries_on_conflict(resp_server):
+    backend = RedisLimitBackend(resp_server.url)
+    other = RedisLimitBackend(resp_server.url)
+    calls = []
+
+    def update(value):
+        calls.append(value)
+        if len(calls) == 1:
+            # Another client writes between this client's WATCH and EXEC
+            other.transact("key", lambda value: (1.0, None))
+        return (value or 0) + 1, value
+
+    assert backend.transact("key", update) == 1.0
+    assert calls == [None, 1.0]
+    assert backend.get("key") == 2.0
+
+
+def test_engines_share_limits_by_key():
+    backend = LocalLimitBackend()
+    engines = [
+        AsyncOpenAIEngine(
+            model="test",
+            name=f"engine{i}",
+            rate_limits=LIMITS,
+            rate_limit_key="account",
+            rate_limit_backend=backend,
+        )
+        for i in range(2)
+    ]
+    other = AsyncOpenAIEngine(
+        model="test", name="other", rate_limits=LIMITS, rate_limit_backend=backend
+    )
+
+    now = time.time()
+    for _ in range(3):
+        for engine in engines:
+            engine.rate_limit.call_limits[0].reserve()
+
+    assert engines[0].rate_limit.next_allowed() > now + 1
+    assert other.rate_limit.next_allowed() < now + 1
+
+
+class InterleavingBackend(LocalLimitBackend):
+    """Lets another client take from the bucket right after the first read."""
+
+    def __init__(self):
+        super().__init__()
+        self.before_first_read = None
+
+    def get(self, key):
+        value = super().get(key)
+        if self.before_first_read is not None:
+            interleave, self.before_first_read = self.before_first_read, None
+            interleave()
+        return value
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit", ["max_calls", "max_tokens"])
+async def test_interleaved_clients_wait_for_granted_time(monkeypatch, limit):
+    now = 1000.0
+    backend = InterleavingBackend()
+    clients = [
+        RateLimits(
+            [{"interval": 10, limit: 1}],
+            key="shared",
+            backend=backend,
+            clock=lambda: now,
+        )
+        for _ in range(2)
+    ]
+    waits = []
+
+    async def sleep_until(ready_at, clock):
+        waits.append(ready_at)
+
+    monkeypatch.setattr("horsona.llm.base_engine.sleep_until", sleep_until)
+
+    async def consume(client):
+        if limit == "max_calls":
+            await client.consume_call()
+        else:
+            await client.reserve_tokens(1)
+
+    # The second client takes the only slot between the first client's read
+    # and its reservation
+    buckets = clients[1].call_limits + clients[1].token_limits
+    backend.before_first_read = buckets[0].reserve
+    await consume(clients[0])
+
+    assert waits == [now + 10]
@@ -0,0 +1,151 @@
+import pytest
+from groq.types.chat import ChatCompletion as GroqChatCompletion
+from groq.types.chat import ChatCompletionChunk as GroqChatCompletionChunk
+from openai.types.chat import ChatCompletion
+
+from horsona.llm.anthropic_engine import AsyncAnthropicEngine
+from horsona.llm.base_engine import LLMMetrics
+from horsona.llm.engine_utils import compile_user_prompt
+from horsona.llm.oai_engine import AsyncOAIEngine
+from horsona.memory.history_llm import HistoryLLMEngine
+from horsona.memory.list_module import ListModule
+
+
+class RecordingOAIEngine(AsyncOAIEngine):
+    def __init__(self, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+        self.requests = []
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        self.requests.append(kwargs)
+        return ChatCompletion.model_validate(
+            {
+                "id": "test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "test",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Hello!"},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 2000,
+                    "completion_tokens": 5,
+                    "total_tokens": 2005,
+                    "prompt_tokens_details": {"cached_tokens": 1536},
+                },
+            }
+        )
+
+
+@pytest.mark.asyncio
+async def test_stable_args_go_first():
+    prompt = await compile_user_prompt(
+        ["B_CONTEXT", "A_CONTEXT", "MISSING"], TASK="t", A_CONTEXT="a", B_CONTEXT="b"
+    )
+
+    assert prompt == await compile_user_prompt(B_CONTEXT="b", A_CONTEXT="a", TASK="t")
+
+
+@pytest.mark.asyncio
+async def test_wrapper_passes_stable_args():
+    engine = RecordingOAIEngine()
+    history = ListModule(min_item_length=0)
+    await history.append("Earlier message")
+    llm = HistoryLLMEngine(engine, history)
+
+    metrics = LLMMetrics()
+    await llm.query_response(TASK="Say hello", CONTEXT="Ponyville", metrics=metrics)
+
+    (request,) = engine.requests
+    assert "stable_prompt_args" not in request
+    assert request["messages"][0]["content"].startswith("<HISTORY_CONTEXT>")
+    assert metrics.prompt_tokens == 2000
+    assert metrics.cached_tokens == 1536
+    assert engine.telemetry.cached_tokens == 1536
+
+
+GROQ_USAGE = {"prompt_tokens": 20, "completion_tokens": 5, "total_tokens": 25}
+
+
+class GroqResponseEngine(AsyncOAIEngine):
+    """Returns responses typed like the Groq SDK's, whose usage has no details."""
+
+    def __init__(self, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+
+    async def create(self, **kwargs):
+        fields = {"id": "test", "created": 0, "model": "test"}
+        if not kwargs.get("stream"):
+            return GroqChatCompletion.model_validate(
+                {
+                    **fields,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": "Hello!"},
+                        }
+                    ],
+                    "usage": GROQ_USAGE,
+                }
+            )
+
+        async def stream():
+            for delta, usage in [({"content": "Hello!"}, None), ({}, GROQ_USAGE)]:
+                yield GroqChatCompletionChunk.model_validate(
+                    {
+                        **fields,
+                        "object": "chat.completion.chunk",
+                        "choices": [{"index": 0, "delta": delta}],
+                        "usage": usage,
+                        "x_groq": None,
+                    }
+                )
+
+        return stream()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_usage_without_prompt_token_details(stream):
+    engine = GroqResponseEngine()
+    metrics = LLMMetrics()
+    messages = [{"role": "user", "content": "Say hello"}]
+
+    if stream:
+        chunks = [
+            c async for c in engine.query_stream(messages=messages, metrics=metrics)
+        ]
+        assert "".join(chunks) == "Hello!"
+    else:
+        assert (
+            await engine.query_response(messages=messages, metrics=metrics) == "Hello!"
+        )
+    assert metrics.prompt_tokens == 20
+    assert metrics.cached_tokens == 0
+
+
+def test_anthropic_cache_breakpoint():
+    engine = AsyncAnthropicEngine(model="test")
+    prompt = "<HISTORY_CONTEXT>\n  ...\n</HISTORY_CONTEXT>\n\n<TASK>\n  t\n</TASK>"
+    stable_length = prompt.index("\n\n<TASK>")
+
+    message = engine.user_prompt_message(prompt, stable_length)
+    assert message["content"] == [
+        {
+            "type": "text",
+            "text": prompt[:stable_length],
+            "cache_control": {"type": "ephemeral"},
+        },
+        {"type": "text", "text": prompt[stable_length:]},
+    ]
+
+    # Without stable args, or with caching off, the message is plain text
+    assert engine.user_prompt_message(prompt, 0)["content"] == prompt
+    engine.prompt_caching = False
+    assert engine.user_prompt_message(prompt, stable_length)["content"] == prompt
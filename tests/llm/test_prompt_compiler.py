@@ -0,0 +1,70 @@
+import pytest
+from pydantic import BaseModel
+
+from horsona.autodiff.variables import ListValue, Value
+from horsona.llm.engine_utils import compile_user_prompt, compile_user_prompt_length
+
+
+class Character(BaseModel):
+    name: str
+    traits: list[str]
+    notes: dict
+
+
+@pytest.mark.asyncio
+async def test_nested_args():
+    prompt = await compile_user_prompt(
+        CHARACTER=Character(name="Pinkie & Co", traits=["<loud>", " "], notes={}),
+        EVENTS=[{"who": ["a", "b"]}, "party"],
+        COUNT=3,
+    )
+
+    assert prompt == (
+        "<CHARACTER>\n"
+        "  <name>Pinkie &amp; Co</name>\n"
+        "  <traits>\n"
+        "    <traits.0>&lt;loud&gt;</traits.0>\n"
+        "    <traits.1></traits.1>\n"
+        "  </traits>\n"
+        "  <notes></notes>\n"
+        "</CHARACTER>\n"
+        "\n"
+        "<EVENTS>\n"
+        "  <0>\n"
+        "    <who>\n"
+        "      <who.0>a</who.0>\n"
+        "      <who.1>b</who.1>\n"
+        "    </who>\n"
+        "  </0>\n"
+        "  <1>party</1>\n"
+        "</EVENTS>\n"
+        "\n"
+        "<COUNT>\n"
+        "  3\n"
+        "</COUNT>"
+    )
+
+
+@pytest.mark.asyncio
+async def test_length_matches_prompt():
+    args = {
+        "ITEMS": ListValue("Items", [Value("Text", "a < b"), Value("Text", {"x": 1})]),
+        "NONE": None,
+        "TUPLE": (1, {2}),
+    }
+
+    assert await compile_user_prompt_length(**args) == len(
+        await compile_user_prompt(**args)
+    )
+
+
+@pytest.mark.asyncio
+async def test_memoized_values_track_updates():
+    value = Value("Text", "first")
+    assert "first" in await compile_user_prompt(ITEM=value)
+
+    value.value = "second & third"
+    assert "second &amp; third" in await compile_user_prompt(ITEM=value)
+    assert await compile_user_prompt_length(ITEM=value) == len(
+        await compile_user_prompt(ITEM=value)
+    )
@@ -1,48 +1,113 @@
+import asyncio
 import time
 
 import pytest
 
 from horsona.llm.base_engine import RateLimits
+from horsona.llm.limits import CallLimit, TokenLimit
 
 
-@pytest.mark.asyncio
-async def test_call_limit():
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_call_limit():
+    clock = FakeClock()
     limits = RateLimits(
         [
             {"interval": 0.2, "max_calls": 2, "max_tokens": 10},
             {"interval": 0.4, "max_calls": 3, "max_tokens": 10},
-        ]
+        ],
+        clock=clock,
     )
 
-    start = time.time()
-
-    # Should take no time to reach the limits
-    await limits.consume_call()
-    assert time.time() - start < 0.05
-    await limits.consume_call()
-    await limits.consume_call()
-    assert time.time() - start >= 0.2
+    times = []
+    for _ in range(5):
+        clock.now = limits.next_allowed()
+        for limit in limits.call_limits:
+            limit.reserve(1, clock.now)
+        times.append(round(clock.now - 1000, 3))
 
-    await limits.consume_call()
-    assert time.time() - start > 0.4
-    assert time.time() - start < 0.5
+    # A burst of 2, then the first limit refills a call every 0.1s until the
+    # second one, which refills every 0.133s, catches up
+    assert times == [0, 0, 0.1, 0.2, 0.3]
+    clock.now = limits.next_allowed()
+    assert clock.now - 1000 == pytest.approx(0.4)
 
 
-@pytest.mark.asyncio
-async def test_token_limit():
+def test_token_limit():
+    clock = FakeClock()
     limits = RateLimits(
         [
             {"interval": 0.1, "max_calls": 100, "max_tokens": 5},
             {"interval": 0.3, "max_calls": 100, "max_tokens": 9},
-        ]
+        ],
+        clock=clock,
     )
 
-    start = time.time()
-
     for i in range(5):
-        await limits.wait_for(9)
+        clock.now = limits.next_allowed(9)
         limits.report_tokens_consumed(9)
-    await limits.wait_for(1)
+    clock.now = limits.next_allowed(1)
+
+    # Requests larger than a bucket wait for it to be full and leave it in debt
+    assert clock.now - 1000 == pytest.approx(1.3)
+
+
+def test_burst_refills():
+    clock = FakeClock()
+    limit = CallLimit(3, 1.0, clock=clock)
+
+    assert [limit.reserve() - 1000 for _ in range(4)] == pytest.approx([0, 0, 0, 1 / 3])
+
+    # An idle bucket refills to its size, but no further
+    clock.now += 10
+    assert [limit.reserve() - clock.now for _ in range(4)] == pytest.approx(
+        [0, 0, 0, 1 / 3]
+    )
+
+    smooth = CallLimit(3, 1.0, burst=1, clock=clock)
+    assert [smooth.reserve() - clock.now for _ in range(3)] == pytest.approx(
+        [0, 1 / 3, 2 / 3]
+    )
+
+
+def test_unused_tokens_are_returned():
+    clock = FakeClock()
+    limit = TokenLimit(100, 1.0, clock=clock)
+
+    limit.report_consumed(100)
+    assert limit.next_allowed(50) - 1000 == pytest.approx(0.5)
+
+    limit.report_consumed(-50)
+    assert limit.next_allowed(50) == 1000
+
+    # Returning more than was taken can't overfill the bucket
+    limit.report_consumed(-1000)
+    assert limit.next_allowed(101) == 1000
+    limit.report_consumed(101)
+    assert limit.next_allowed(1) - 1000 == pytest.approx(0.02)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_are_served_in_order():
+    limits = RateLimits([{"interval": 0.2, "max_calls": 4}])
+    done = []
+
+    async def call(i):
+        await limits.consume_call()
+        done.append((i, time.time()))
+
+    start = time.time()
+    await asyncio.gather(*[call(i) for i in range(8)])
 
-    assert time.time() - start > 1.5
-    assert time.time() - start < 1.8
+    assert [i for i, _ in done] == list(range(8))
+    offsets = [t - start for _, t in done]
+    assert all(offset < 0.03 for offset in offsets[:4])
+    # The rest are spread out instead of all waking at once
+    for i, offset in enumerate(offsets[4:], start=1):
+        assert offset == pytest.approx(0.05 * i, abs=0.03)
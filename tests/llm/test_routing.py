@@ -0,0 +1,288 @@
+import asyncio
+import time
+
+import pytest
+
+from horsona.llm.base_engine import LLMMetrics, tracks_metrics
+from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.multi_engine import create_multi_engine
+from horsona.llm.routing import CircuitState, EngineRouter
+
+
+class DelayedChatEngine(AsyncChatEngine):
+    def __init__(self, delay, fail=False, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("provider error")
+        yield "ok"
+
+
+class Engine:
+    def __init__(self, name):
+        self.name = name
+
+
+@pytest.mark.asyncio
+async def test_prefers_faster_engines():
+    fast = DelayedChatEngine(0.01, name="fast")
+    slow = DelayedChatEngine(0.2, name="slow")
+    multi = create_multi_engine(fast, slow)
+
+    # Learn each engine's latency
+    await asyncio.gather(*[multi.query_response(messages=[]) for _ in range(2)])
+    fast.calls = slow.calls = 0
+
+    await asyncio.gather(*[multi.query_response(messages=[]) for _ in range(10)])
+
+    assert fast.calls >= 8
+    assert multi.router.health_of(slow).ewma_latency > 0.1
+    assert fast.telemetry.routed == multi.router.health_of(fast).selected
+
+
+@pytest.mark.asyncio
+async def test_weights():
+    engines = [Engine("a"), Engine("b")]
+    router = EngineRouter(engines, weights=[3, 1])
+
+    selected = [router.select() for _ in range(8)]
+
+    assert selected.count(engines[0]) == 6
+    assert [s["outstanding"] for s in router.stats()] == [6, 2]
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_recovers():
+    healthy, broken = Engine("healthy"), Engine("broken")
+    # The broken engine's weight makes it the preferred engine when available
+    router = EngineRouter(
+        [broken, healthy],
+        weights=[10, 1],
+        failure_threshold=2,
+        cooldown=0.05,
+        max_cooldown=1,
+    )
+
+    for _ in range(2):
+        assert router.select() is broken
+        router.finish(broken, False)
+    assert router.health_of(broken).state == CircuitState.OPEN
+
+    # Open circuits are skipped
+    assert router.select() is healthy
+    router.finish(healthy, True, latency=10)
+
+    # After the cooldown, a single probe is let through
+    await asyncio.sleep(0.06)
+    assert router.select() is broken
+    assert router.health_of(broken).state == CircuitState.HALF_OPEN
+    assert router.select() is healthy
+    router.finish(healthy, True, latency=10)
+
+    # A failed probe doubles the cooldown
+    router.finish(broken, False)
+    assert router.health_of(broken).state == CircuitState.OPEN
+    assert router.health_of(broken).cooldown == pytest.approx(0.1)
+
+    await asyncio.sleep(0.11)
+    assert router.select() is broken
+    router.finish(broken, True, latency=0.01)
+    assert router.health_of(broken).state == CircuitState.CLOSED
+    assert router.stats()[0]["state"] == "closed"
+
+
+@pytest.mark.asyncio
+async def test_multi_engine_waits_for_probe():
+    engine = DelayedChatEngine(0, fail=True)
+    multi = create_multi_engine(
+        engine, max_retries=2, backoff_multiplier=0, cooldown=0.05
+    )
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError):
+        await multi.query_response(messages=[])
+
+    # The circuit opened after the first 3 failures, so the engine is paused
+    # rather than removed
+    assert engine.calls == 3
+    assert multi.router.health_of(engine).state == CircuitState.OPEN
+
+    engine.fail = False
+    assert await multi.query_response(messages=[]) == "ok"
+    assert time.perf_counter() - start >= 0.05
+    assert multi.router.health_of(engine).state == CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_hedging():
+    primary = DelayedChatEngine(0.01, name="primary")
+    backup = DelayedChatEngine(0.01, name="backup")
+    multi = create_multi_engine(primary, backup, weights=[10, 1], hedge_percentile=0.9)
+    multi.router.health_of(primary).latencies.extend([0.01] * 10)
+
+    # The primary stalls, so the backup answers first
+    primary.delay = 1
+    start = time.perf_counter()
+    assert await multi.query_response(messages=[]) == "ok"
+    assert time.perf_counter() - start < 0.5
+
+    assert primary.telemetry.hedges == 1
+    assert backup.telemetry.hedge_wins == 1
+
+    # The slow call is cancelled in the background
+    await asyncio.sleep(0.01)
+    assert multi.router.health_of(primary).outstanding == 0
+
+
+@pytest.mark.asyncio
+async def test_hedge_cancelled_before_it_starts(monkeypatch):
+    primary = DelayedChatEngine(0.05, name="primary")
+    backup = DelayedChatEngine(0.01, name="backup")
+    multi = create_multi_engine(primary, backup, weights=[10, 1], hedge_percentile=0.9)
+    multi.router.health_of(primary).latencies.extend([0.01] * 10)
+
+    # Hold back the first step of the hedge until after the primary has won
+    ensure_future = asyncio.ensure_future
+    started = 0
+
+    def delay_hedge(coro):
+        nonlocal started
+        if "MultiEngine.__new__" in coro.__qualname__:
+            started += 1
+            if started == 2:
+
+                async def later():
+                    try:
+                        await asyncio.sleep(1)
+                    except asyncio.CancelledError:
+                        coro.close()
+                        raise
+                    return await coro
+
+                return ensure_future(later())
+        return ensure_future(coro)
+
+    monkeypatch.setattr(asyncio, "ensure_future", delay_hedge)
+    assert await multi.query_response(messages=[]) == "ok"
+    monkeypatch.undo()
+
+    assert started == 2
+    assert backup.calls == 0
+    await asyncio.sleep(0.01)
+    assert multi.router.health_of(backup).outstanding == 0
+    assert multi.router.health_of(primary).outstanding == 0
+
+
+@pytest.mark.asyncio
+async def test_hedging_respects_rate_limits():
+    primary = DelayedChatEngine(0.2, name="primary")
+    backup = DelayedChatEngine(
+        0.01, name="backup", rate_limits=[{"interval": 10, "max_calls": 1}]
+    )
+    multi = create_multi_engine(primary, backup, weights=[10, 1], hedge_percentile=0.9)
+    multi.router.health_of(primary).latencies.extend([0.01] * 10)
+
+    # The backup has no capacity left, so the call isn't hedged
+    await backup.rate_limit.consume_call()
+    assert await multi.query_response(messages=[]) == "ok"
+
+    assert primary.calls == 1
+    assert backup.calls == 0
+    assert primary.telemetry.hedges == 0
+
+
+class StreamingChatEngine(AsyncChatEngine):
+    def __init__(self, chunks, fail_after=None, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.requests = []
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, messages, **kwargs):
+        self.requests.append(messages)
+        for i, chunk in enumerate(self.chunks):
+            if i == self.fail_after:
+                raise RuntimeError("connection reset")
+            yield chunk
+        if self.fail_after == len(self.chunks):
+            raise RuntimeError("connection reset")
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_stream_retries_before_first_chunk():
+    broken = StreamingChatEngine(["a"], fail_after=0, name="broken")
+    healthy = StreamingChatEngine(["b", "c"], name="healthy")
+    multi = create_multi_engine(broken, healthy, weights=[10, 1], backoff_multiplier=0)
+
+    metrics = LLMMetrics()
+    chunks = await collect(
+        multi.query_stream(messages=[], PROMPT="hi", metrics=metrics)
+    )
+
+    assert chunks == ["b", "c"]
+    assert metrics.retries == 1
+    assert broken.telemetry.stream_failures == 1
+    assert multi.router.health_of(broken).failures == 1
+    # Each attempt sends the prompt exactly once
+    assert len(broken.requests[0]) == len(healthy.requests[0]) == 1
+    assert multi.router.health_of(healthy).ewma_time_to_first_token is not None
+
+
+@pytest.mark.asyncio
+async def test_stream_interruption_is_raised_by_default():
+    broken = StreamingChatEngine(["a", "b"], fail_after=1, name="broken")
+    healthy = StreamingChatEngine(["c"], name="healthy")
+    multi = create_multi_engine(broken, healthy, weights=[10, 1], backoff_multiplier=0)
+
+    chunks = []
+    with pytest.raises(RuntimeError):
+        async for chunk in multi.query_stream(messages=[]):
+            chunks.append(chunk)
+
+    assert chunks == ["a"]
+    assert healthy.requests == []
+    assert broken.telemetry.stream_interruptions == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_resumes_on_another_engine():
+    broken = StreamingChatEngine(["Once ", "upon"], fail_after=1, name="broken")
+    healthy = StreamingChatEngine([" a time"], name="healthy")
+    multi = create_multi_engine(
+        broken, healthy, weights=[10, 1], backoff_multiplier=0, resume_streams=True
+    )
+
+    chunks = await collect(multi.query_stream(messages=[], PROMPT="Tell a story"))
+
+    assert chunks == ["Once ", " a time"]
+    assert healthy.telemetry.stream_resumes == 1
+    user, partial, instruction = healthy.requests[0]
+    assert "Tell a story" in user["content"]
+    assert partial == {"role": "assistant", "content": "Once "}
+    assert instruction["role"] == "user"
+
+
+@pytest.mark.asyncio
+async def test_closed_stream_releases_engine():
+    engine = StreamingChatEngine(["a", "b", "c"])
+    multi = create_multi_engine(engine)
+
+    stream = multi.query_stream(messages=[])
+    assert await anext(stream) == "a"
+    await stream.aclose()
+
+    health = multi.router.health_of(engine)
+    assert health.outstanding == 0
+    assert health.failures == 0
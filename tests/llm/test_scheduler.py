@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+from horsona.llm.base_engine import RateLimits
+from horsona.llm.scheduler import (
+    Priority,
+    RequestScheduler,
+    current_priority,
+    request_priority,
+)
+
+
+async def admit_all(scheduler, requests):
+    order = []
+
+    async def admit(priority, session, label):
+        with request_priority(priority, session):
+            await scheduler.admit(0)
+        order.append(label)
+
+    # Use up the available call so every request below has to queue
+    await scheduler.admit(0)
+
+    tasks = []
+    for priority, session, label in requests:
+        tasks.append(asyncio.create_task(admit(priority, session, label)))
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    scheduler = RequestScheduler(RateLimits([{"interval": 0.1, "max_calls": 1}]))
+
+    order = await admit_all(
+        scheduler,
+        [
+            (Priority.BATCH, None, "batch1"),
+            (Priority.BATCH, None, "batch2"),
+            (Priority.BACKGROUND, None, "background"),
+            (Priority.INTERACTIVE, None, "interactive"),
+        ],
+    )
+
+    assert order == ["interactive", "background", "batch1", "batch2"]
+    assert scheduler.admitted[Priority.BATCH] == 2
+    assert scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_sessions_share_fairly():
+    scheduler = RequestScheduler(RateLimits([{"interval": 0.1, "max_calls": 1}]))
+
+    order = await admit_all(
+        scheduler,
+        [(Priority.INTERACTIVE, "a", f"a{i}") for i in range(4)]
+        + [(Priority.INTERACTIVE, "b", f"b{i}") for i in range(2)],
+    )
+
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_leaves_queue():
+    scheduler = RequestScheduler(RateLimits([{"interval": 0.05, "max_calls": 1}]))
+    await scheduler.admit(0)
+
+    with request_priority(Priority.INTERACTIVE):
+        first = asyncio.create_task(scheduler.admit(0))
+    with request_priority(Priority.BATCH):
+        second = asyncio.create_task(scheduler.admit(0))
+    await asyncio.sleep(0)
+    assert scheduler.queued() == 2
+
+    first.cancel()
+    await asyncio.wait_for(second, 1)
+    assert scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_waits_by_the_rate_limit_clock():
+    # A clock far from the wall clock, like one read from a shared backend
+    def clock():
+        return time.time() + 1e6
+
+    scheduler = RequestScheduler(
+        RateLimits([{"interval": 0.05, "max_calls": 1}], clock=clock)
+    )
+
+    async def admit_twice():
+        start = time.perf_counter()
+        await scheduler.admit(0)
+        await scheduler.admit(0)
+        return time.perf_counter() - start
+
+    # The second call waits for the interval, not for the offset of the clock
+    assert 0.04 <= await asyncio.wait_for(admit_twice(), 1) < 0.5
+
+
+def test_request_priority_nesting():
+    assert current_priority() == (Priority.INTERACTIVE, None)
+    with request_priority(Priority.BACKGROUND, "session"):
+        with request_priority(Priority.BATCH):
+            assert current_priority() == (Priority.BATCH, "session")
+        assert current_priority() == (Priority.BACKGROUND, "session")
+    assert current_priority() == (Priority.INTERACTIVE, None)
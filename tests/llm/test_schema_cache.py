@@ -0,0 +1,71 @@
+from enum import Enum
+from typing import Literal
+
+from pydantic import BaseModel
+
+from horsona.llm.engine_utils import (
+    model_fingerprint,
+    response_schema,
+    schema_prompt,
+    type_adapter,
+    validate_obj,
+)
+
+
+def define_model(field_type=str):
+    class Item(BaseModel):
+        value: field_type
+
+    class Response(BaseModel):
+        items: list[Item]
+
+    return Response
+
+
+def test_redefined_models_share_schemas():
+    first, second = define_model(), define_model()
+
+    assert model_fingerprint(first) == model_fingerprint(second)
+    assert response_schema(first) is response_schema(second)
+    assert schema_prompt(first) is schema_prompt(second)
+
+    # Nested changes produce a different schema
+    changed = define_model(int)
+    assert model_fingerprint(changed) != model_fingerprint(first)
+    assert response_schema(changed) == changed.model_json_schema()
+
+
+def test_validators_keep_model_identity():
+    first, second = define_model(), define_model()
+
+    assert isinstance(validate_obj(list[first], [{"items": []}])[0], first)
+    assert isinstance(validate_obj(list[second], [{"items": []}])[0], second)
+    assert type_adapter(list[first]) is type_adapter(list[first])
+
+
+def test_recursive_models():
+    class Node(BaseModel):
+        children: list["Node"]
+
+    assert response_schema(Node) == Node.model_json_schema()
+
+
+def define_enum_model(*colors):
+    Color = Enum("Color", {color: color for color in colors})
+
+    class Pony(BaseModel):
+        color: Color
+
+    return Pony
+
+
+def test_classes_with_the_same_name_dont_collide():
+    first = define_enum_model("red", "blue")
+    second = define_enum_model("pink", "white")
+
+    assert model_fingerprint(first) != model_fingerprint(second)
+    assert response_schema(second) == second.model_json_schema()
+    assert "pink" in schema_prompt(second)
+
+    # Literals of equal values with different types are different schemas
+    assert model_fingerprint(Literal[1]) != model_fingerprint(Literal[True])
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from horsona.llm.base_engine import LLMMetrics, tracks_metrics
+from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.single_flight import SingleFlight
+
+
+class SlowChatEngine(AsyncChatEngine):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        metrics.prompt_tokens = 10
+        metrics.tokens_consumed = 15
+        yield '```json\n{"name": "Celestia"}\n```'
+
+
+class Response(BaseModel):
+    name: str
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_coalesce():
+    engine = SlowChatEngine(coalesce_requests=True)
+
+    results = await asyncio.gather(
+        *[engine.query_object(Response, NAME="Celestia", TASK="x") for _ in range(10)]
+    )
+
+    assert engine.calls == 1
+    assert all(r == Response(name="Celestia") for r in results)
+    # Each caller gets its own parsed object
+    assert len({id(r) for r in results}) == 10
+    assert engine.in_flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_distinct_requests_do_not_coalesce():
+    engine = SlowChatEngine(coalesce_requests=True)
+
+    await asyncio.gather(
+        engine.query_object(Response, NAME="Celestia", TASK="x"),
+        engine.query_object(Response, NAME="Luna", TASK="x"),
+        engine.query_object(Response, NAME="Celestia", TASK="x", temperature=0.5),
+    )
+    assert engine.calls == 3
+
+    # Requests that don't overlap in time are not coalesced
+    await engine.query_object(Response, NAME="Celestia", TASK="x")
+    assert engine.calls == 4
+
+
+@pytest.mark.asyncio
+async def test_every_caller_gets_the_shared_usage():
+    engine = SlowChatEngine(coalesce_requests=True)
+    metrics = [LLMMetrics() for _ in range(3)]
+
+    await asyncio.gather(
+        *[
+            engine.query_object(Response, NAME="Celestia", TASK="x", metrics=m)
+            for m in metrics
+        ]
+    )
+
+    assert engine.calls == 1
+    for m in metrics:
+        assert (m.tokens_consumed, m.prompt_tokens, m.requests) == (15, 10, 1)
+
+
+@pytest.mark.asyncio
+async def test_coalescing_is_opt_in():
+    # Sampled requests must get independent responses
+    engine = SlowChatEngine()
+
+    await asyncio.gather(
+        *[engine.query_object(Response, NAME="Celestia", TASK="x") for _ in range(3)]
+    )
+    assert engine.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancellation():
+    single_flight = SingleFlight()
+    finished = asyncio.Event()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        finished.set()
+        return 42
+
+    first = asyncio.create_task(single_flight.do("key", call))
+    second = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+
+    # Cancelling one caller doesn't affect the other
+    first.cancel()
+    assert await second == 42
+    assert finished.is_set()
+    assert single_flight.coalesced == 1
+
+    # Cancelling every caller cancels the shared call
+    finished.clear()
+    only = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    only.cancel()
+    await asyncio.sleep(0.1)
+    assert not finished.is_set()
+    assert single_flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exceptions():
+    single_flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(
+        single_flight.do("key", call),
+        single_flight.do("key", call),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, ValueError) for r in results)
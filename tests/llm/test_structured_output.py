@@ -0,0 +1,153 @@
+import json
+
+import httpx
+import openai
+import pytest
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+from horsona.llm.oai_engine import AsyncOAIEngine
+from horsona.llm.perplexity_engine import AsyncPerplexityEngine
+
+
+class Pony(BaseModel):
+    name: str
+    color: str
+
+
+PONY = {"name": "Rarity", "color": "white"}
+
+
+class RecordingOAIEngine(AsyncOAIEngine):
+    def __init__(self, **kwargs):
+        super().__init__(coalesce_requests=False, **kwargs)
+        self.requests = []
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        self.requests.append(kwargs)
+        if "response_format" in kwargs:
+            content = json.dumps(PONY)
+        else:
+            content = f"```json\n{json.dumps(PONY)}\n```"
+
+        return ChatCompletion.model_validate(
+            {
+                "id": "test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "test",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": 5,
+                    "total_tokens": 15,
+                },
+            }
+        )
+
+
+@pytest.mark.asyncio
+async def test_native_structured_output():
+    engine = RecordingOAIEngine()
+
+    pony = await engine.query_object(Pony, DESCRIPTION="A fashionable unicorn")
+
+    assert pony == Pony(**PONY)
+    (request,) = engine.requests
+    response_format = request["response_format"]
+    assert response_format["json_schema"]["name"] == "Pony"
+    assert response_format["json_schema"]["schema"] == Pony.model_json_schema()
+    # The schema isn't repeated in the prompt
+    assert len(request["messages"]) == 1
+    assert "json_schema" not in request["messages"][0]["content"]
+
+
+@pytest.mark.asyncio
+async def test_prompt_fallback():
+    engine = RecordingOAIEngine(structured_output=False)
+
+    assert await engine.query_object(Pony) == Pony(**PONY)
+    assert "response_format" not in engine.requests[0]
+
+    # Types other than models always use the prompt
+    engine.structured_output = True
+    assert await engine.query_object(dict[str, str]) == PONY
+    assert "response_format" not in engine.requests[1]
+
+
+class RejectingOAIEngine(RecordingOAIEngine):
+    async def create(self, **kwargs) -> ChatCompletion:
+        if "response_format" in kwargs:
+            self.requests.append(kwargs)
+            request = httpx.Request("POST", "https://api.example.com/v1/chat")
+            raise openai.BadRequestError(
+                "response_format is not supported by this model",
+                response=httpx.Response(400, request=request),
+                body=None,
+            )
+        return await super().create(**kwargs)
+
+
+@pytest.mark.asyncio
+async def test_rejected_structured_output_falls_back_to_prompt():
+    engine = RejectingOAIEngine()
+
+    assert await engine.query_object(Pony, DESCRIPTION="A unicorn") == Pony(**PONY)
+    native, fallback = engine.requests
+    assert "response_format" in native
+    assert "response_format" not in fallback
+    # The prompt args are sent once, followed by the schema
+    assert len(fallback["messages"]) == 3
+    assert "A unicorn" in fallback["messages"][0]["content"]
+
+    # The engine remembers, so later calls go straight to the prompt
+    assert not engine.structured_output
+    assert await engine.query_object(Pony) == Pony(**PONY)
+    assert len(engine.requests) == 3
+    assert "response_format" not in engine.requests[2]
+
+
+@pytest.mark.asyncio
+async def test_other_errors_are_raised():
+    class FailingOAIEngine(RecordingOAIEngine):
+        async def create(self, **kwargs) -> ChatCompletion:
+            raise RuntimeError("connection reset")
+
+    engine = FailingOAIEngine()
+    with pytest.raises(RuntimeError):
+        await engine.query_object(Pony)
+    assert engine.structured_output
+
+
+@pytest.mark.asyncio
+async def test_rejected_structured_output_over_raw_http(monkeypatch):
+    def handle(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        if "response_format" in payload:
+            return httpx.Response(400, json={"error": "Invalid response_format"})
+        content = f"```json\n{json.dumps(PONY)}\n```"
+        return httpx.Response(
+            200,
+            json={
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": 5,
+                    "total_tokens": 15,
+                },
+            },
+        )
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    monkeypatch.setattr("horsona.llm.perplexity_engine.get_http_client", lambda: client)
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "test")
+    engine = AsyncPerplexityEngine(model="test")
+
+    assert await engine.query_object(Pony) == Pony(**PONY)
+    assert not engine.structured_output
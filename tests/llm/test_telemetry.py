@@ -0,0 +1,114 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from horsona.interface import metrics_api
+from horsona.llm.base_engine import LLMMetrics, tracks_metrics
+from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.multi_engine import create_multi_engine
+from horsona.llm.telemetry import (
+    InMemoryExporter,
+    JsonlExporter,
+    add_exporter,
+    remove_exporter,
+)
+
+
+class FakeChatEngine(AsyncChatEngine):
+    def __init__(self, fail=False, **kwargs):
+        super().__init__(**kwargs)
+        self.fail = fail
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, **kwargs):
+        if self.fail:
+            raise RuntimeError("provider error")
+        metrics.prompt_tokens = 10
+        for i in range(3):
+            metrics.tokens_consumed = 10 + i + 1
+            yield "x"
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemoryExporter()
+    add_exporter(exporter)
+    yield exporter
+    remove_exporter(exporter)
+
+
+@pytest.mark.asyncio
+async def test_metrics_and_telemetry(exporter):
+    engine = FakeChatEngine(name="fake_engine")
+
+    metrics = LLMMetrics()
+    assert await engine.query_response(messages=[], metrics=metrics) == "xxx"
+    await engine.query_response(messages=[], metrics=metrics)
+
+    assert metrics.requests == 2
+    assert metrics.tokens_consumed == 26
+    assert metrics.prompt_tokens == 20
+    assert metrics.completion_tokens == 6
+    assert metrics.latency >= metrics.time_to_first_token > 0
+
+    assert engine.telemetry.requests == 2
+    assert engine.telemetry.completion_tokens == 6
+    assert engine.telemetry.latency.count == 2
+
+    assert len(exporter.records) == 2
+    assert exporter.records[0].engine == "fake_engine"
+    assert exporter.records[0].prompt_tokens == 10
+    assert exporter.records[0].error is None
+
+
+@pytest.mark.asyncio
+async def test_errors_and_retries(exporter):
+    failing = FakeChatEngine(fail=True)
+    multi = create_multi_engine(failing, max_retries=1, backoff_multiplier=0)
+
+    metrics = LLMMetrics()
+    with pytest.raises(RuntimeError):
+        await multi.query_response(messages=[], metrics=metrics)
+
+    assert metrics.requests == 2
+    assert metrics.errors == 2
+    assert metrics.retries == 1
+    assert failing.telemetry.errors == 2
+    assert failing.telemetry.retries == 1
+    assert [r.error for r in exporter.records] == ["RuntimeError", "RuntimeError"]
+
+
+@pytest.mark.asyncio
+async def test_jsonl_exporter(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    exporter = JsonlExporter(str(path))
+    add_exporter(exporter)
+    try:
+        engine = FakeChatEngine(name="jsonl_engine")
+        await engine.query_response(messages=[])
+    finally:
+        remove_exporter(exporter)
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 1
+    assert records[0]["engine"] == "jsonl_engine"
+    assert records[0]["completion_tokens"] == 3
+
+
+@pytest.mark.asyncio
+async def test_prometheus_endpoint():
+    engine = FakeChatEngine(name="prometheus_engine")
+    await engine.query_response(messages=[])
+
+    app = FastAPI()
+    app.include_router(metrics_api.router)
+    response = TestClient(app).get("/api/metrics")
+
+    assert response.status_code == 200
+    assert 'horsona_llm_requests_total{engine="prometheus_engine"} 1' in response.text
+    assert (
+        'horsona_llm_latency_seconds_count{engine="prometheus_engine"} 1'
+        in response.text
+    )
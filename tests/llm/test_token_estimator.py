@@ -0,0 +1,109 @@
+import pytest
+
+from horsona.llm.base_engine import LLMMetrics, tracks_metrics
+from horsona.llm.chat_engine import AsyncChatEngine
+from horsona.llm.token_estimator import CharsPerTokenEstimator
+
+
+class UsageChatEngine(AsyncChatEngine):
+    def __init__(self, prompt_tokens, completion_tokens, **kwargs):
+        super().__init__(**kwargs)
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    @tracks_metrics
+    async def query(self, *, metrics: LLMMetrics, **kwargs):
+        for i in range(self.completion_tokens):
+            metrics.tokens_consumed = self.prompt_tokens + i + 1
+            yield "x"
+        metrics.prompt_tokens = self.prompt_tokens
+
+
+def record_reports(engine):
+    reports = []
+    original_reserve = engine.rate_limit.reserve_tokens
+    original_report = engine.rate_limit.report_tokens_consumed
+
+    async def reserve(count):
+        reports.append(count)
+        await original_reserve(count)
+
+    def report(count):
+        reports.append(count)
+        original_report(count)
+
+    engine.rate_limit.reserve_tokens = reserve
+    engine.rate_limit.report_tokens_consumed = report
+    return reports
+
+
+def test_chars_per_token_estimator():
+    estimator = CharsPerTokenEstimator(chars_per_token=4, smoothing=0.5)
+    assert estimator.estimate("x" * 400) == 100
+
+    estimator.calibrate("x" * 400, 200)
+    assert estimator.chars_per_token == 3
+    assert estimator.estimate("x" * 300) == 100
+
+    messages = [{"role": "user", "content": "x" * 300}]
+    assert estimator.estimate_messages(messages) == 104
+
+
+@pytest.mark.asyncio
+async def test_reservation_reconciled_upwards():
+    engine = UsageChatEngine(
+        prompt_tokens=120,
+        completion_tokens=30,
+        rate_limits=[{"interval": 60, "max_tokens": 100000}],
+        token_estimator=CharsPerTokenEstimator(chars_per_token=4),
+    )
+    reports = record_reports(engine)
+
+    metrics = LLMMetrics()
+    await engine.query_response(
+        messages=[{"role": "user", "content": "x" * 400}], metrics=metrics
+    )
+
+    # The estimate is reserved first, then topped up to the actual usage
+    assert reports[0] == 104
+    assert sum(reports) == 150
+    assert metrics.tokens_consumed == 150
+    assert metrics.prompt_tokens == 120
+
+    # The estimator moves towards the observed ratio
+    assert engine.token_estimator.chars_per_token < 4
+
+
+@pytest.mark.asyncio
+async def test_reservation_reconciled_downwards():
+    engine = UsageChatEngine(
+        prompt_tokens=40,
+        completion_tokens=10,
+        rate_limits=[{"interval": 60, "max_tokens": 100000}],
+        token_estimator=CharsPerTokenEstimator(chars_per_token=4),
+    )
+    reports = record_reports(engine)
+
+    await engine.query_response(messages=[{"role": "user", "content": "x" * 400}])
+
+    assert reports[0] == 104
+    assert sum(reports) == 50
+
+
+@pytest.mark.asyncio
+async def test_unused_reservation_returned_on_early_close():
+    engine = UsageChatEngine(
+        prompt_tokens=0,
+        completion_tokens=100,
+        rate_limits=[{"interval": 60, "max_tokens": 100000}],
+        token_estimator=CharsPerTokenEstimator(chars_per_token=4),
+    )
+    reports = record_reports(engine)
+
+    stream = engine.query_stream(messages=[{"role": "user", "content": "x" * 400}])
+    async for _ in stream:
+        break
+    await stream.aclose()
+
+    assert reports[0] == 104
+    assert sum(reports) == 1
@@ -0,0 +1,57 @@
+import pytest
+
+from horsona.llm.engine_utils import compile_user_prompt_length
+from horsona.memory.gist_module import GistModule
+
+
+class RecordingLLM:
+    def __init__(self):
+        self.requests = []
+
+    async def query_block(self, block_type, **kwargs):
+        self.requests.append(kwargs)
+        return f"Gist of {kwargs['CURRENT_PAGE'][:10]}"
+
+
+@pytest.mark.asyncio
+async def test_gist_module_context():
+    llm = RecordingLLM()
+    gist_module = GistModule(llm, max_page_chars=300, max_gist_chars=200)
+    pages = [f"Page {i} <{'x' * (i % 7) * 10}>" for i in range(40)]
+
+    for i, page in enumerate(pages):
+        await gist_module.append(page)
+
+        request = llm.requests[-1]
+        page_context = request["PREVIOUS_PAGES"]
+        gist_context = request["PREVIOUS_GISTS"]
+
+        # The latest pages that fit, and the gists of the pages before them
+        assert page_context == pages[i - len(page_context) : i]
+        assert (
+            await compile_user_prompt_length(ITEMS=page_context)
+            <= gist_module.max_page_chars
+        )
+        if len(page_context) < i:
+            assert (
+                await compile_user_prompt_length(
+                    ITEMS=pages[i - len(page_context) - 1 : i]
+                )
+                > gist_module.max_page_chars
+            )
+
+        first_page = i - len(page_context)
+        assert (
+            gist_context
+            == gist_module.available_gists[first_page - len(gist_context) : first_page]
+        )
+        assert (
+            await compile_user_prompt_length(ITEMS=gist_context)
+            <= gist_module.max_gist_chars
+        )
+
+    # Stale prefix sums, e.g. from an older save, are rebuilt
+    gist_module.page_offsets = [0]
+    await gist_module.append("Last page")
+    assert llm.requests[-1]["PREVIOUS_PAGES"][-1] == pages[-1]
+    assert len(gist_module.page_offsets) == len(gist_module.available_pages) + 1
@@ -1,7 +1,11 @@
 import pytest
 
 from horsona.autodiff.variables import Value
-from horsona.llm.engine_utils import compile_user_prompt
+from horsona.llm.engine_utils import (
+    compile_user_prompt,
+    compile_user_prompt_length,
+    list_prompt_length,
+)
 from horsona.memory.list_module import ListModule
 
 
@@ -65,3 +69,28 @@ async def test_list_module_init_with_items():
     assert len(list_module.items) == 2
     assert list_module.items[0].value == "test1"
     assert list_module.max_length == 100
+
+
+@pytest.mark.asyncio
+async def test_list_module_running_lengths():
+    list_module = ListModule(max_length=400, min_item_length=60)
+    for i in range(50):
+        await list_module.append(Value("Text", f"item & {i}" * (i % 4 + 1)))
+
+        assert list_module.total_length == sum(list_module.item_lengths)
+        assert list_module.total_length <= list_module.max_length
+        assert all(
+            length >= list_module.min_item_length for length in list_module.item_lengths
+        )
+        pending_length = await compile_user_prompt_length(
+            ITEM=list_module.pending_items
+        )
+        assert pending_length < list_module.min_item_length
+        assert pending_length == list_prompt_length(
+            "ITEM", list_module.pending_total, len(list_module.pending_items)
+        )
+
+    # The running totals survive a save and load
+    restored = ListModule.load_state_dict(list_module.state_dict())
+    assert restored.total_length == list_module.total_length
+    assert restored.pending_total == list_module.pending_total